@@ -0,0 +1,29 @@
+"""Device API key lookup fingerprint
+
+Revision ID: 002
+Revises: 001
+Create Date: 2024-02-01 00:00:00.000000
+
+Keys issued before this revision keep a NULL api_key_lookup. The plaintext
+key is never stored, so the fingerprint is backfilled by the API the first
+time each device authenticates with its existing key.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '002'
+down_revision = '001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('devices', sa.Column('api_key_lookup', sa.String(), nullable=True))
+    op.create_index('ix_devices_api_key_lookup', 'devices', ['api_key_lookup'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_devices_api_key_lookup', table_name='devices')
+    op.drop_column('devices', 'api_key_lookup')
@@ -0,0 +1,50 @@
+"""Hot-path indexes for time_events and face_embeddings
+
+Revision ID: 003
+Revises: 002
+Create Date: 2024-02-15 00:00:00.000000
+
+Indexes are built CONCURRENTLY so the migration can run against a live
+database without blocking kiosk writes.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        # Latest valid event per employee (clock state)
+        op.create_index(
+            'ix_time_events_employee_valid_time',
+            'time_events',
+            ['employee_id', sa.text('event_time DESC')],
+            postgresql_where=sa.text('is_valid'),
+            postgresql_concurrently=True,
+        )
+        # Per-location time range scans (exports, stats, listings)
+        op.create_index(
+            'ix_time_events_location_time',
+            'time_events',
+            ['location_id', 'event_time'],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_face_embeddings_employee_id',
+            'face_embeddings',
+            ['employee_id'],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_face_embeddings_employee_id', table_name='face_embeddings', postgresql_concurrently=True)
+        op.drop_index('ix_time_events_location_time', table_name='time_events', postgresql_concurrently=True)
+        op.drop_index('ix_time_events_employee_valid_time', table_name='time_events', postgresql_concurrently=True)
@@ -0,0 +1,65 @@
+"""Materialized employee clock state
+
+Revision ID: 004
+Revises: 003
+Create Date: 2024-03-01 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'employee_clock_state',
+        sa.Column('employee_id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('location_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('state', sa.String(), nullable=False, server_default='CLOCKED_OUT'),
+        sa.Column('last_event_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('last_event_time', sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column('last_event_type', sa.String(), nullable=True),
+        sa.Column('device_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.text('now()')),
+        sa.ForeignKeyConstraint(['employee_id'], ['employees.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['location_id'], ['locations.id'], ),
+        sa.ForeignKeyConstraint(['last_event_id'], ['time_events.id'], ),
+        sa.ForeignKeyConstraint(['device_id'], ['devices.id'], ),
+    )
+    op.create_index(
+        'ix_employee_clock_state_location_state',
+        'employee_clock_state',
+        ['location_id', 'state'],
+    )
+
+    # Backfill from each employee's latest valid event
+    op.execute("""
+        INSERT INTO employee_clock_state (
+            employee_id, location_id, state, last_event_id,
+            last_event_time, last_event_type, device_id, updated_at
+        )
+        SELECT DISTINCT ON (te.employee_id)
+            te.employee_id,
+            e.location_id,
+            CASE WHEN te.event_type = 'OUT' THEN 'CLOCKED_OUT' ELSE 'CLOCKED_IN' END,
+            te.id,
+            te.event_time,
+            te.event_type,
+            te.device_id,
+            now()
+        FROM time_events te
+        JOIN employees e ON e.id = te.employee_id
+        WHERE te.is_valid
+        ORDER BY te.employee_id, te.event_time DESC
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_employee_clock_state_location_state', table_name='employee_clock_state')
+    op.drop_table('employee_clock_state')
@@ -0,0 +1,34 @@
+"""Client-supplied idempotency key for time events
+
+Revision ID: 005
+Revises: 004
+Create Date: 2024-03-15 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('time_events', sa.Column('client_event_id', postgresql.UUID(as_uuid=True), nullable=True))
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_time_events_client_event_id',
+            'time_events',
+            ['client_event_id'],
+            unique=True,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_time_events_client_event_id', table_name='time_events', postgresql_concurrently=True)
+    op.drop_column('time_events', 'client_event_id')
@@ -0,0 +1,37 @@
+"""Scheduled export run log
+
+Revision ID: 006
+Revises: 005
+Create Date: 2024-04-01 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'export_runs',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('location_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('export_date', sa.Date(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='1'),
+        sa.Column('started_at', sa.DateTime(), nullable=False, server_default=sa.text('now()')),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('duration_ms', sa.Integer(), nullable=True),
+        sa.Column('error', sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(['location_id'], ['locations.id'], ondelete='CASCADE'),
+        sa.UniqueConstraint('location_id', 'export_date', name='uq_export_runs_location_date'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('export_runs')
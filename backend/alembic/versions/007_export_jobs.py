@@ -0,0 +1,42 @@
+"""Background export jobs
+
+Revision ID: 007
+Revises: 006
+Create Date: 2024-04-08 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'export_jobs',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('location_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('device_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('export_date', sa.Date(), nullable=False),
+        sa.Column('send_email', sa.Boolean(), nullable=False, server_default=sa.true()),
+        sa.Column('status', sa.String(), nullable=False, server_default='QUEUED'),
+        sa.Column('file_path', sa.String(), nullable=True),
+        sa.Column('file_size', sa.BigInteger(), nullable=True),
+        sa.Column('error', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.text('now()')),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['location_id'], ['locations.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['device_id'], ['devices.id'], ondelete='SET NULL'),
+    )
+    op.create_index('ix_export_jobs_status_finished', 'export_jobs', ['status', 'finished_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_export_jobs_status_finished', table_name='export_jobs')
+    op.drop_table('export_jobs')
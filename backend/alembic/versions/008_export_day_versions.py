@@ -0,0 +1,32 @@
+"""Export day data versions
+
+Revision ID: 008
+Revises: 007
+Create Date: 2024-04-15 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '008'
+down_revision = '007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'export_day_versions',
+        sa.Column('location_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('local_date', sa.Date(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False, server_default='1'),
+        sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.text('now()')),
+        sa.ForeignKeyConstraint(['location_id'], ['locations.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('location_id', 'local_date'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('export_day_versions')
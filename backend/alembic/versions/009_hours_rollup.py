@@ -0,0 +1,54 @@
+"""Hours worked rollup
+
+Revision ID: 009
+Revises: 008
+Create Date: 2024-04-22 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '009'
+down_revision = '008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'hours_rollup',
+        sa.Column('location_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('local_date', sa.Date(), nullable=False),
+        sa.Column('employee_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('worked_seconds', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('shift_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('open_shift', sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.ForeignKeyConstraint(['location_id'], ['locations.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['employee_id'], ['employees.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('location_id', 'local_date', 'employee_id'),
+    )
+
+    op.add_column('export_day_versions', sa.Column('rollup_version', sa.BigInteger(), nullable=True))
+    op.create_index(
+        'ix_export_day_versions_rollup_pending',
+        'export_day_versions',
+        ['location_id', 'local_date'],
+        postgresql_where=sa.text('rollup_version IS DISTINCT FROM version')
+    )
+
+    # Days recorded before versions were tracked are rolled up on the first refresh
+    op.execute("""
+        INSERT INTO export_day_versions (location_id, local_date, version, updated_at)
+        SELECT DISTINCT te.location_id, timezone(l.timezone, te.event_time)::date, 1, now() AT TIME ZONE 'UTC'
+        FROM time_events te
+        JOIN locations l ON l.id = te.location_id
+        ON CONFLICT (location_id, local_date) DO NOTHING
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_export_day_versions_rollup_pending', table_name='export_day_versions')
+    op.drop_column('export_day_versions', 'rollup_version')
+    op.drop_table('hours_rollup')
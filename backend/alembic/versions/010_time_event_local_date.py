@@ -0,0 +1,45 @@
+"""Stored local date of time events
+
+Revision ID: 010
+Revises: 009
+Create Date: 2024-04-29 00:00:00.000000
+
+Each event's date in its location timezone is backfilled, then the
+column becomes NOT NULL, so run this with the new application code. The
+index is built CONCURRENTLY so it does not block kiosk writes.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '010'
+down_revision = '009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('time_events', sa.Column('local_date', sa.Date(), nullable=True))
+    op.execute("""
+        UPDATE time_events te
+        SET local_date = timezone(l.timezone, te.event_time)::date
+        FROM locations l
+        WHERE l.id = te.location_id
+    """)
+    op.alter_column('time_events', 'local_date', nullable=False)
+
+    with op.get_context().autocommit_block():
+        # Per-location day lookups (exports, stats, timesheets), ordered by time within each day
+        op.create_index(
+            'ix_time_events_location_local_date',
+            'time_events',
+            ['location_id', 'local_date', 'event_time'],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_time_events_location_local_date', table_name='time_events', postgresql_concurrently=True)
+    op.drop_column('time_events', 'local_date')
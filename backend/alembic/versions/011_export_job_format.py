@@ -0,0 +1,26 @@
+"""Export job formats
+
+Revision ID: 011
+Revises: 010
+Create Date: 2024-05-06 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '011'
+down_revision = '010'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'export_jobs',
+        sa.Column('export_format', sa.String(), nullable=False, server_default='csv')
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('export_jobs', 'export_format')
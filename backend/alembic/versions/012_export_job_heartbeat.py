@@ -0,0 +1,23 @@
+"""Export job heartbeats
+
+Revision ID: 012
+Revises: 011
+Create Date: 2024-05-13 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '012'
+down_revision = '011'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('export_jobs', sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('export_jobs', 'heartbeat_at')
@@ -0,0 +1,42 @@
+"""Immutable location timezones
+
+Revision ID: 013
+Revises: 012
+Create Date: 2024-05-20 00:00:00.000000
+
+Each time event stores its local_date in the location timezone, and the
+API caches timezones per process, so a location's timezone cannot change
+once it exists. Moving a location to another zone means dropping this
+trigger, recomputing time_events.local_date for it, bumping its
+export_day_versions and restarting the API.
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '013'
+down_revision = '012'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE FUNCTION locations_timezone_immutable() RETURNS trigger AS $$
+        BEGIN
+            RAISE EXCEPTION 'timezone of location % cannot be changed', OLD.id
+                USING ERRCODE = 'check_violation';
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER locations_timezone_immutable
+        BEFORE UPDATE OF timezone ON locations
+        FOR EACH ROW WHEN (OLD.timezone IS DISTINCT FROM NEW.timezone)
+        EXECUTE FUNCTION locations_timezone_immutable()
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER locations_timezone_immutable ON locations")
+    op.execute("DROP FUNCTION locations_timezone_immutable()")
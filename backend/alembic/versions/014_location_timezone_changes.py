@@ -0,0 +1,41 @@
+"""Allow location timezone changes
+
+Revision ID: 014
+Revises: 013
+Create Date: 2024-05-27 00:00:00.000000
+
+Timezones are no longer cached per process. Changes go through
+ClockLogicService.set_location_timezone, which redates the location's
+time events and bumps their export_day_versions, so the trigger from
+013 is dropped.
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '014'
+down_revision = '013'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("DROP TRIGGER locations_timezone_immutable ON locations")
+    op.execute("DROP FUNCTION locations_timezone_immutable()")
+
+
+def downgrade() -> None:
+    op.execute("""
+        CREATE FUNCTION locations_timezone_immutable() RETURNS trigger AS $$
+        BEGIN
+            RAISE EXCEPTION 'timezone of location % cannot be changed', OLD.id
+                USING ERRCODE = 'check_violation';
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER locations_timezone_immutable
+        BEFORE UPDATE OF timezone ON locations
+        FOR EACH ROW WHEN (OLD.timezone IS DISTINCT FROM NEW.timezone)
+        EXECUTE FUNCTION locations_timezone_immutable()
+    """)
@@ -0,0 +1,46 @@
+"""Export day change log
+
+Revision ID: 015
+Revises: 014
+Create Date: 2024-06-03 00:00:00.000000
+
+Writes append a row per changed day instead of bumping the day's
+export_day_versions row, which serialized all punches of a location on
+today's row. The hours rollup folds the rows into the versions.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '015'
+down_revision = '014'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'export_day_changes',
+        sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column('location_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('local_date', sa.Date(), nullable=False),
+        sa.ForeignKeyConstraint(['location_id'], ['locations.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_export_day_changes_location_date', 'export_day_changes', ['location_id', 'local_date'])
+
+
+def downgrade() -> None:
+    # Unfolded changes become version bumps
+    op.execute("""
+        INSERT INTO export_day_versions (location_id, local_date, version, updated_at)
+        SELECT DISTINCT location_id, local_date, 1, now() AT TIME ZONE 'UTC'
+        FROM export_day_changes
+        ON CONFLICT (location_id, local_date) DO UPDATE SET
+            version = export_day_versions.version + 1,
+            updated_at = excluded.updated_at
+    """)
+    op.drop_index('ix_export_day_changes_location_date', table_name='export_day_changes')
+    op.drop_table('export_day_changes')
@@ -0,0 +1,41 @@
+"""Background import jobs
+
+Revision ID: 016
+Revises: 015
+Create Date: 2024-06-10 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '016'
+down_revision = '015'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'import_jobs',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('location_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('device_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('dry_run', sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.Column('status', sa.String(), nullable=False, server_default='QUEUED'),
+        sa.Column('report', postgresql.JSONB(), nullable=True),
+        sa.Column('error', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.text('now()')),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['location_id'], ['locations.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['device_id'], ['devices.id'], ondelete='SET NULL'),
+    )
+    op.create_index('ix_import_jobs_status_finished', 'import_jobs', ['status', 'finished_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_import_jobs_status_finished', table_name='import_jobs')
+    op.drop_table('import_jobs')
@@ -1,31 +1,72 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, Request, status, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from datetime import date, datetime
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date, datetime, timedelta
 from typing import Optional, List
-from app.database import get_db
+from uuid import UUID
+import os
+import asyncio
+import json
+import pytz
+import tempfile
+from app.config import settings
+from app.database import SessionLocal, get_db, get_async_db, get_pool_stats
 from app.models.device import Device
 from app.models.location import Location
 from app.security import get_current_device
+from app.services.export_jobs import export_job_service
+from app.services.export_formats import EXPORT_FORMATS, ExportFormat, get_export_format
 from app.services.export_service import export_service
-from app.services.clock_logic import clock_logic_service
-from app.models.employee import Employee
+from app.services.clock_logic import clock_logic_service, ClockState
+from app.services.bcrypt_service import bcrypt_service
+from app.services.event_bus import clock_event_bus
+from app.services.ingest_queue import ingest_queue
+from app.services.import_jobs import import_job_service
+from app.services.scheduler import scheduler_service
+from app.services.mail_service import mail_queue
+from app.services.export_cache import export_cache
+from app.services.timesheet_service import timesheet_service
+from app.services.hours_rollup import hours_rollup_service
 from app.models.time_event import TimeEvent
 from sqlalchemy import func
 from app.schemas.time_event import ClockedInEmployee
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
 
+IMPORT_SPOOL_BYTES = 16 * 1024 * 1024
+EXPORT_FORMAT_PATTERN = "^(" + "|".join(name.replace(".", "[.]") for name in EXPORT_FORMATS) + ")$"
 
-@router.post("/export-now")
+
+def _export_format(name: str) -> ExportFormat:
+    try:
+        return get_export_format(name)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+
+@router.post("/export-now", status_code=status.HTTP_202_ACCEPTED)
 async def export_now(
     export_date: Optional[date] = Query(None),
+    send_email: bool = Query(True),
+    format: str = Query("csv", pattern=EXPORT_FORMAT_PATTERN),
     device: Device = Depends(get_current_device),
     db: Session = Depends(get_db)
 ):
     """
-    Trigger immediate export (admin)
+    Queue an immediate export (admin)
     Exports specified date or yesterday if not specified
+    
+    format is csv, csv.gz, ndjson or parquet. Returns a job_id to poll at
+    /export-jobs/{job_id}. Once the file is written it can be downloaded
+    from /export-jobs/{job_id}/download.
     """
+    export_format = _export_format(format)
     location = db.query(Location).filter(Location.id == device.location_id).first()
     if not location:
         raise HTTPException(
@@ -34,24 +75,126 @@ async def export_now(
         )
     
     if not export_date:
-        import pytz
-        from datetime import timedelta
         tz = pytz.timezone(location.timezone)
         export_date = (datetime.now(tz) - timedelta(days=1)).date()
     
-    success = export_service.export_and_send(db, device.location_id, export_date)
+    job = export_job_service.submit(db, device.location_id, device.id, export_date, send_email, export_format.name)
     
-    if success:
-        return {
-            "status": "ok",
-            "message": f"Export sent for {export_date}",
-            "date": export_date.isoformat()
-        }
-    else:
+    return {
+        "status": "queued",
+        "message": f"Export queued for {export_date}",
+        "date": export_date.isoformat(),
+        "format": export_format.name,
+        "job_id": str(job.id)
+    }
+
+
+@router.get("/export-jobs/{job_id}")
+async def get_export_job(
+    job_id: UUID,
+    device: Device = Depends(get_current_device),
+    db: Session = Depends(get_db)
+):
+    """Get the status of an export job (admin)"""
+    job = export_job_service.get(db, job_id, device.location_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Export job not found"
+        )
+    
+    return {
+        "job_id": str(job.id),
+        "status": job.status,
+        "date": job.export_date.isoformat(),
+        "format": job.export_format,
+        "send_email": job.send_email,
+        "file_size": job.file_size,
+        "download_url": f"{router.prefix}/export-jobs/{job.id}/download" if job.file_path else None,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at
+    }
+
+
+@router.get("/export-jobs/{job_id}/download")
+async def download_export_job(
+    job_id: UUID,
+    device: Device = Depends(get_current_device),
+    db: Session = Depends(get_db)
+):
+    """Download the file written by an export job (admin)"""
+    job = export_job_service.get(db, job_id, device.location_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Export job not found"
+        )
+    
+    if not job.file_path:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Export is {job.status.lower()}"
+        )
+    
+    if not os.path.exists(job.file_path):
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="Export file is no longer available"
+        )
+    
+    export_format = EXPORT_FORMATS[job.export_format]
+    return FileResponse(
+        job.file_path,
+        media_type=export_format.media_type,
+        filename=f"time_events_{job.export_date.strftime('%Y%m%d')}.{export_format.extension}"
+    )
+
+
+@router.get("/export")
+async def export_range(
+    start_date: date = Query(...),
+    end_date: date = Query(...),
+    format: str = Query("csv", pattern=EXPORT_FORMAT_PATTERN),
+    device: Device = Depends(get_current_device),
+    db: Session = Depends(get_db)
+):
+    """
+    Stream the events of a range of local dates (admin)
+    
+    format is csv, csv.gz, ndjson or parquet. The file is written while
+    it is sent, from a single query, so ranges of months do not have to
+    fit in memory; Parquet arrives one row group at a time.
+    """
+    export_format = _export_format(format)
+    if end_date < start_date:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="end_date is before start_date"
+        )
+    if (end_date - start_date).days + 1 > settings.export_range_max_days:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Export failed"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Exports cover at most {settings.export_range_max_days} days"
         )
+    
+    location_id = device.location_id
+    
+    def chunks():
+        # The request's session may be closed before the body is sent
+        stream_db = SessionLocal()
+        try:
+            yield from export_service.iter_export(stream_db, location_id, start_date, end_date, export_format.name)
+        finally:
+            stream_db.close()
+    
+    filename = f"time_events_{start_date.strftime('%Y%m%d')}_{end_date.strftime('%Y%m%d')}.{export_format.extension}"
+    return StreamingResponse(
+        chunks(),
+        media_type=export_format.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 
 @router.get("/stats")
@@ -60,40 +203,175 @@ async def get_stats(
     db: Session = Depends(get_db)
 ):
     """Get dashboard statistics (admin)"""
-    # Total employees
-    total_employees = db.query(Employee).filter(
-        Employee.location_id == device.location_id,
-        Employee.is_active == True
-    ).count()
+    states = clock_logic_service.get_location_states(db, device.location_id)
     
-    # Currently clocked in
-    employees = db.query(Employee).filter(
-        Employee.location_id == device.location_id,
-        Employee.is_active == True
-    ).all()
+    # Total employees and currently clocked in
+    total_employees = len(states)
+    clocked_in_count = sum(1 for s in states if s.state == ClockState.CLOCKED_IN)
     
-    clocked_in_count = 0
-    for employee in employees:
-        state, _ = clock_logic_service.get_employee_state(
-            db,
-            employee.employee_id,
-            str(employee.location_id)
-        )
-        if state == "CLOCKED_IN":
-            clocked_in_count += 1
-    
-    # Today's events
-    today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    # Today's events, by the location's local date
+    location = db.query(Location).filter(Location.id == device.location_id).first()
+    today = datetime.now(pytz.timezone(location.timezone)).date()
     today_events = db.query(TimeEvent).filter(
         TimeEvent.location_id == device.location_id,
-        TimeEvent.event_time >= today_start
+        TimeEvent.local_date == today
     ).count()
     
+    # Hours worked today, from the rollup
+    rollup_current = await run_in_threadpool(hours_rollup_service.refresh_if_pending, db, device.location_id)
+    days = hours_rollup_service.daily_totals(db, device.location_id, today, today)
+    
     return {
         "total_employees": total_employees,
         "clocked_in_count": clocked_in_count,
         "clocked_out_count": total_employees - clocked_in_count,
-        "today_events": today_events
+        "today_events": today_events,
+        "today_worked_hours": round(days[0].worked_seconds / 3600, 2) if days else 0.0,
+        "hours_pending": not rollup_current
+    }
+
+
+@router.put("/location/timezone")
+async def set_location_timezone(
+    timezone: str = Query(...),
+    device: Device = Depends(get_current_device),
+    db: Session = Depends(get_db)
+):
+    """
+    Move this location to another timezone (admin)
+
+    Time events are redated to the new zone, so exports, timesheets and
+    hours follow it.
+    """
+    try:
+        events_redated = await run_in_threadpool(
+            clock_logic_service.set_location_timezone, db, device.location_id, timezone
+        )
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    db.commit()
+
+    return {"timezone": timezone, "events_redated": events_redated}
+
+
+@router.get("/timesheet")
+async def get_timesheet(
+    start_date: date = Query(...),
+    end_date: date = Query(...),
+    format: str = Query("json", pattern="^(json|csv)$"),
+    device: Device = Depends(get_current_device),
+    db: Session = Depends(get_db)
+):
+    """
+    Worked hours per employee for a range of local dates (admin)
+    
+    IN/OUT punches are paired into shifts, which are split at local
+    midnight. json returns per-employee totals with seconds worked per
+    day and the unpaired punches; csv returns one row per shift and day.
+    """
+    if end_date < start_date:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="end_date is before start_date"
+        )
+    if (end_date - start_date).days + 1 > settings.timesheet_max_days:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Timesheets cover at most {settings.timesheet_max_days} days"
+        )
+    
+    timesheet = await run_in_threadpool(
+        timesheet_service.build, db, device.location_id, start_date, end_date
+    )
+    
+    if format == "csv":
+        return StreamingResponse(
+            timesheet.iter_shifts_csv(),
+            media_type="text/csv",
+            headers={
+                "Content-Disposition": f'attachment; filename="shifts_{start_date.strftime("%Y%m%d")}_{end_date.strftime("%Y%m%d")}.csv"'
+            }
+        )
+    
+    return {
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "timezone": timesheet.timezone,
+        "employees": timesheet.totals(),
+        "unpaired": timesheet.unpaired_punches()
+    }
+
+
+@router.get("/hours")
+async def get_hours(
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    group_by: str = Query("employee", pattern="^(employee|day)$"),
+    device: Device = Depends(get_current_device),
+    db: Session = Depends(get_db)
+):
+    """
+    Hours worked from the hours rollup (admin)
+    
+    Defaults to the current week (Monday to today, local time). group_by
+    employee gives each employee's total, day gives the location's labor
+    hours per day. Shifts are split at local midnight. pending is true
+    when changes were left to the scheduled refresh because another
+    refresh of the location was running.
+    """
+    location = db.query(Location).filter(Location.id == device.location_id).first()
+    if not location:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Location not found"
+        )
+    
+    today = datetime.now(pytz.timezone(location.timezone)).date()
+    end_date = end_date or today
+    start_date = start_date or end_date - timedelta(days=end_date.weekday())
+    if end_date < start_date:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="end_date is before start_date"
+        )
+    
+    rollup_current = await run_in_threadpool(hours_rollup_service.refresh_if_pending, db, device.location_id)
+    
+    if group_by == "day":
+        rows = hours_rollup_service.daily_totals(db, device.location_id, start_date, end_date)
+        items = [
+            {
+                "date": row.local_date.isoformat(),
+                "worked_hours": round(row.worked_seconds / 3600, 2),
+                "shift_count": row.shift_count,
+                "employee_count": row.employee_count,
+                "open_shifts": row.open_shifts
+            }
+            for row in rows
+        ]
+    else:
+        rows = hours_rollup_service.employee_totals(db, device.location_id, start_date, end_date)
+        items = [
+            {
+                "employee_id": row.employee_id,
+                "name": row.name,
+                "worked_hours": round(row.worked_seconds / 3600, 2),
+                "shift_count": row.shift_count,
+                "open_shift": row.open_shift
+            }
+            for row in rows
+        ]
+    
+    return {
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "group_by": group_by,
+        "pending": not rollup_current,
+        "items": items
     }
 
 
@@ -103,29 +381,152 @@ async def get_clocked_in(
     db: Session = Depends(get_db)
 ):
     """Get list of currently clocked in employees (admin)"""
-    # Reuse the logic from time_events endpoint
-    employees = db.query(Employee).filter(
-        Employee.location_id == device.location_id,
-        Employee.is_active == True
-    ).all()
-    
-    clocked_in = []
-    for emp in employees:
-        state, last_event = clock_logic_service.get_employee_state(
-            db,
-            emp.employee_id,
-            str(emp.location_id)
+    states = clock_logic_service.get_location_states(db, device.location_id)
+    
+    return [
+        ClockedInEmployee(
+            employee_id=s.employee_id,
+            name=s.name,
+            clock_in_time=s.last_event_time,
+            device_id=s.device_id,
+            device_name=s.device_name
         )
+        for s in states
+        if s.state == ClockState.CLOCKED_IN
+    ]
+
+
+@router.get("/metrics")
+async def get_metrics(
+    device: Device = Depends(get_current_device)
+):
+    """Get internal performance metrics (admin)"""
+    return {
+        "bcrypt": bcrypt_service.get_stats(),
+        "db_pool": get_pool_stats(),
+        "ingest_queue": ingest_queue.get_stats(),
+        "exports": scheduler_service.get_stats(),
+        "export_jobs": export_job_service.get_stats(),
+        "import_jobs": import_job_service.get_stats(),
+        "export_cache": export_cache.get_stats(),
+        "hours_rollup": hours_rollup_service.get_stats(),
+        "mail": mail_queue.get_stats()
+    }
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.get("/stream")
+async def stream_clock_state(
+    request: Request,
+    device: Device = Depends(get_current_device),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Server-sent events for the location's clock state (admin)
+    
+    Sends a snapshot of every employee's state on connect, then a state
+    event whenever a punch, sync batch or correction changes it. On a
+    resync event the client should reconnect to get a fresh snapshot.
+    """
+    location_id = device.location_id
+    
+    # Subscribe before reading the snapshot so no change falls in between
+    queue = clock_event_bus.subscribe(location_id)
+    try:
+        states = await db.run_sync(clock_logic_service.get_location_states, location_id)
+    except Exception:
+        clock_event_bus.unsubscribe(location_id, queue)
+        raise
+    finally:
+        # The stream can stay open for hours; do not hold a pooled connection
+        await db.close()
+    
+    snapshot = jsonable_encoder({"employees": [dict(s._mapping) for s in states]})
+    
+    async def events():
+        try:
+            yield _sse("snapshot", snapshot)
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(
+                        queue.get(),
+                        timeout=settings.event_stream_keepalive_seconds
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _sse(message["event"], message["data"])
+        finally:
+            clock_event_bus.unsubscribe(location_id, queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/import", status_code=status.HTTP_202_ACCEPTED)
+async def import_time_events(
+    request: Request,
+    dry_run: bool = Query(False),
+    device: Device = Depends(get_current_device),
+    db: Session = Depends(get_db)
+):
+    """
+    Queue a bulk import of historical time events from a CSV request body (admin)
+    
+    Columns: employee_id, event_type, event_time and optionally device_id
+    and method. Rows without a device are attributed to this device.
+    Already recorded rows are skipped as duplicates; the first rejected
+    rows are listed with their reason. dry_run validates without saving.
+    Returns a job_id to poll at /import-jobs/{job_id} for the report.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES)
+    try:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        
+        if ingest_queue.enabled:
+            await ingest_queue.flush()
         
-        if state == "CLOCKED_IN" and last_event:
-            device_info = db.query(Device).filter(Device.id == last_event.device_id).first()
-            clocked_in.append(ClockedInEmployee(
-                employee_id=emp.employee_id,
-                name=emp.name,
-                clock_in_time=last_event.event_time,
-                device_id=last_event.device_id,
-                device_name=device_info.name if device_info else None
-            ))
-    
-    return clocked_in
+        job = import_job_service.submit(db, device.location_id, device.id, spool, dry_run)
+    except BaseException:
+        spool.close()
+        raise
+    
+    return {
+        "status": "queued",
+        "dry_run": dry_run,
+        "job_id": str(job.id)
+    }
+
 
+@router.get("/import-jobs/{job_id}")
+async def get_import_job(
+    job_id: UUID,
+    device: Device = Depends(get_current_device),
+    db: Session = Depends(get_db)
+):
+    """Get the status and, once finished, the report of an import job (admin)"""
+    job = import_job_service.get(db, job_id, device.location_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Import job not found"
+        )
+    
+    return {
+        "job_id": str(job.id),
+        "status": job.status,
+        "dry_run": job.dry_run,
+        "report": job.report,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at
+    }
@@ -6,7 +6,8 @@ from app.database import get_db
 from app.models.device import Device
 from app.models.location import Location
 from app.schemas.device import DeviceRegister, DeviceRegisterResponse, DeviceResponse
-from app.security import generate_api_key, hash_api_key, get_current_device
+from app.security import generate_api_key, hash_api_key, api_key_fingerprint, get_current_device
+from app.services.heartbeat import heartbeat_service
 
 router = APIRouter(prefix="/api/devices", tags=["devices"])
 
@@ -29,7 +30,7 @@ async def register_device(
             name=device_data.location_name,
             manager_email="",  # Set via admin later
             export_time=datetime.now().time(),  # Default to current time
-            timezone="America/Toronto"
+            timezone="America/Toronto"  # Set via PUT /api/admin/location/timezone
         )
         db.add(location)
         db.flush()
@@ -44,13 +45,14 @@ async def register_device(
     
     # Generate API key
     api_key = generate_api_key()
-    api_key_hash = hash_api_key(api_key)
+    api_key_hash = await hash_api_key(api_key)
     
     # Create device
     device = Device(
         device_id=device_data.device_id,
         location_id=location.id,
         api_key=api_key_hash,
+        api_key_lookup=api_key_fingerprint(api_key),
         name=device_data.name,
         registered_at=datetime.utcnow(),
         last_seen_at=datetime.utcnow()
@@ -86,17 +88,14 @@ async def get_device_info(
         location_id=device.location_id,
         name=device.name,
         registered_at=device.registered_at,
-        last_seen_at=device.last_seen_at
+        last_seen_at=heartbeat_service.last_seen(device)
     )
 
 
 @router.post("/ping")
 async def ping_device(
-    device: Device = Depends(get_current_device),
-    db: Session = Depends(get_db)
+    device: Device = Depends(get_current_device)
 ):
-    """Update device last_seen_at timestamp"""
-    device.last_seen_at = datetime.utcnow()
-    db.commit()
+    """Update device last_seen_at timestamp (recorded by authentication)"""
     return {"status": "ok"}
 
@@ -1,11 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 from uuid import UUID
 import numpy as np
 from pydantic import BaseModel
-from app.database import get_db
+from app.database import get_db, get_async_db
 from app.models.employee import Employee
+from app.models.device import Device
 from app.security import get_current_device
 from app.services.face_service import face_service
 
@@ -73,13 +75,13 @@ async def store_embedding(
 @router.get("/embeddings", response_model=List[EmbeddingResponse])
 async def get_embeddings(
     device: Device = Depends(get_current_device),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get all embeddings for device location (for sync)
     Returns decrypted embeddings for offline matching
     """
-    embeddings_data = face_service.get_embeddings_for_sync(db, device.location_id)
+    embeddings_data = await db.run_sync(face_service.get_embeddings_for_sync, device.location_id)
     
     return [
         EmbeddingResponse(
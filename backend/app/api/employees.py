@@ -3,22 +3,23 @@ from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from typing import List
 from uuid import UUID
-import bcrypt
 import numpy as np
 from app.database import get_db
 from app.models.employee import Employee
+from app.models.device import Device
 from app.models.location import Location
 from app.schemas.employee import EmployeeCreate, EmployeeUpdate, EmployeeResponse, EmployeeStateResponse
 from app.security import get_current_device
+from app.services.bcrypt_service import bcrypt_service
 from app.services.face_service import face_service
 from app.services.clock_logic import clock_logic_service
 
 router = APIRouter(prefix="/api/employees", tags=["employees"])
 
 
-def hash_pin(pin: str) -> str:
+async def hash_pin(pin: str) -> str:
     """Hash a PIN using bcrypt"""
-    return bcrypt.hashpw(pin.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return await bcrypt_service.hashpw(pin)
 
 
 @router.get("", response_model=List[EmployeeResponse])
@@ -60,7 +61,7 @@ async def create_employee(
         )
     
     # Hash PIN
-    pin_hash = hash_pin(employee_data.pin)
+    pin_hash = await hash_pin(employee_data.pin)
     
     employee = Employee(
         location_id=employee_data.location_id,
@@ -114,7 +115,7 @@ async def update_employee(
     if employee_update.name is not None:
         employee.name = employee_update.name
     if employee_update.pin is not None:
-        employee.pin_hash = hash_pin(employee_update.pin)
+        employee.pin_hash = await hash_pin(employee_update.pin)
     if employee_update.is_active is not None:
         employee.is_active = employee_update.is_active
     
@@ -1,126 +1,280 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, Response, status, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import desc, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import desc, and_, select, tuple_
+from fastapi.responses import StreamingResponse
 from datetime import datetime, date
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from uuid import UUID
-from app.database import get_db
+import base64
+import json
+from app.database import get_db, get_async_db, SessionLocal
 from app.models.time_event import TimeEvent
-from app.models.employee import Employee
 from app.models.device import Device
-from app.schemas.time_event import TimeEventCreate, TimeEventUpdate, TimeEventResponse, ClockedInEmployee
+from app.schemas.time_event import (
+    TimeEventCreate,
+    TimeEventUpdate,
+    TimeEventResponse,
+    ClockedInEmployee,
+    TimeEventBatchCreate,
+    TimeEventBatchResult,
+    TimeEventBatchResponse,
+)
 from app.security import get_current_device
-from app.services.clock_logic import clock_logic_service
+from app.services.clock_logic import clock_logic_service, ClockState, EventRejected
+from app.services.event_bus import clock_event_bus
+from app.services.ingest_queue import ingest_queue
+from app.services.export_cache import export_cache
 
 router = APIRouter(prefix="/api/time-events", tags=["time-events"])
 
+REJECTION_STATUS_CODES = {
+    EventRejected.EMPLOYEE_NOT_FOUND: status.HTTP_404_NOT_FOUND,
+    EventRejected.WRONG_LOCATION: status.HTTP_403_FORBIDDEN,
+    EventRejected.INVALID_TRANSITION: status.HTTP_400_BAD_REQUEST,
+    EventRejected.CLIENT_ID_CONFLICT: status.HTTP_409_CONFLICT,
+}
+
+STREAM_BATCH_SIZE = 1000
+
 
 @router.post("", response_model=TimeEventResponse, status_code=status.HTTP_201_CREATED)
 async def create_time_event(
     event_data: TimeEventCreate,
+    response: Response,
     device: Device = Depends(get_current_device),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Create a new time event (clock in/out)"""
-    # Get employee
-    employee = db.query(Employee).filter(Employee.id == event_data.employee_id).first()
-    if not employee:
+    """
+    Create a new time event (clock in/out)
+    Retries with a known client_event_id return the original event with 200
+    
+    In queued ingest mode the event is written by the group-commit writer;
+    202 means it was accepted into the local journal but is not in the
+    database yet.
+    """
+    if ingest_queue.enabled:
+        try:
+            time_event, is_replay = await ingest_queue.submit(db, clock_logic_service.new_event(
+                event_data.employee_id,
+                device.id,
+                device.location_id,
+                event_data.event_type,
+                event_data.method,
+                event_data.event_time,
+                event_data.client_event_id
+            ))
+        except EventRejected as e:
+            raise HTTPException(
+                status_code=REJECTION_STATUS_CODES[e.reason],
+                detail=str(e)
+            )
+        
+        if is_replay:
+            response.status_code = status.HTTP_200_OK
+        elif ingest_queue.durability != "database":
+            response.status_code = status.HTTP_202_ACCEPTED
+        return _event_response(time_event)
+    
+    try:
+        time_event, is_replay = await db.run_sync(
+            clock_logic_service.record_event,
+            event_data.employee_id,
+            device.id,
+            device.location_id,
+            event_data.event_type,
+            event_data.method,
+            event_data.event_time,
+            event_data.client_event_id
+        )
+    except EventRejected as e:
+        await db.rollback()
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Employee not found"
+            status_code=REJECTION_STATUS_CODES[e.reason],
+            detail=str(e)
         )
     
-    # Validate employee belongs to device location
-    if employee.location_id != device.location_id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Employee does not belong to device location"
+    await db.commit()
+    
+    if is_replay:
+        response.status_code = status.HTTP_200_OK
+    
+    event_response = _event_response(time_event)
+    
+    if not is_replay and clock_event_bus.has_subscribers(device.location_id):
+        states = await db.run_sync(
+            clock_logic_service.get_location_states,
+            device.location_id,
+            False,
+            [time_event.employee_id]
         )
+        reason = "CLOCK_IN" if time_event.event_type == "IN" else "CLOCK_OUT"
+        clock_event_bus.publish_states(device.location_id, reason, states, [event_response])
     
-    # Validate clock state transition
-    can_proceed, error_msg = clock_logic_service.validate_event(
-        db,
-        employee.employee_id,
-        str(employee.location_id),
-        event_data.event_type
-    )
+    return event_response
+
+
+@router.post("/batch", response_model=TimeEventBatchResponse)
+async def create_time_events_batch(
+    batch: TimeEventBatchCreate,
+    device: Device = Depends(get_current_device),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Create queued time events in one transaction (offline sync)
+    Events are validated in order; each result reports CREATED, DUPLICATE
+    or REJECTED so the device can mark its queue synced in bulk
+    """
+    pending = [
+        clock_logic_service.new_event(
+            e.employee_id,
+            device.id,
+            device.location_id,
+            e.event_type,
+            e.method,
+            e.event_time,
+            e.client_event_id
+        )
+        for e in batch.events
+    ]
     
-    if not can_proceed:
+    # Queued punches must be in the database before these are validated
+    if ingest_queue.enabled and not await ingest_queue.flush():
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=error_msg
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Queued punches could not be written, please retry",
+            headers={"Retry-After": "5"}
         )
     
-    # Create event
-    event_time = event_data.event_time or datetime.utcnow()
-    
-    time_event = TimeEvent(
-        employee_id=employee.id,
-        device_id=device.id,
-        location_id=device.location_id,
-        event_type=event_data.event_type,
-        event_time=event_time,
-        method=event_data.method,
-        is_valid=True
-    )
+    outcomes = await db.run_sync(clock_logic_service.record_events, pending)
+    await db.commit()
     
-    db.add(time_event)
-    db.commit()
-    db.refresh(time_event)
+    for e in pending:
+        ingest_queue.invalidate(e.employee_id)
+    
+    results = []
+    for index, (time_event, error, is_replay) in enumerate(outcomes):
+        if error:
+            results.append(TimeEventBatchResult(index=index, status="REJECTED", error=str(error)))
+        else:
+            results.append(TimeEventBatchResult(
+                index=index,
+                status="DUPLICATE" if is_replay else "CREATED",
+                event=_event_response(time_event)
+            ))
+    
+    created_events = [r.event for r in results if r.status == "CREATED"]
+    if created_events and clock_event_bus.has_subscribers(device.location_id):
+        states = await db.run_sync(
+            clock_logic_service.get_location_states,
+            device.location_id,
+            False,
+            list({e.employee_id for e in created_events})
+        )
+        clock_event_bus.publish_states(device.location_id, "SYNC", states, created_events)
     
+    return TimeEventBatchResponse(
+        created=sum(1 for r in results if r.status == "CREATED"),
+        duplicate=sum(1 for r in results if r.status == "DUPLICATE"),
+        rejected=sum(1 for r in results if r.status == "REJECTED"),
+        results=results
+    )
+
+
+def _encode_cursor(event_time: datetime, event_id: UUID) -> str:
+    """Opaque keyset cursor for the (event_time, id) position of a row"""
+    payload = json.dumps({"t": event_time.isoformat(), "id": str(event_id)})
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(payload["t"]), UUID(payload["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+
+def _event_response(e: TimeEvent) -> TimeEventResponse:
     return TimeEventResponse(
-        id=time_event.id,
-        employee_id=time_event.employee_id,
-        device_id=time_event.device_id,
-        location_id=time_event.location_id,
-        event_type=time_event.event_type,
-        event_time=time_event.event_time,
-        method=time_event.method,
-        is_valid=time_event.is_valid,
-        created_at=time_event.created_at
+        id=e.id,
+        employee_id=e.employee_id,
+        device_id=e.device_id,
+        location_id=e.location_id,
+        event_type=e.event_type,
+        event_time=e.event_time,
+        method=e.method,
+        is_valid=e.is_valid,
+        created_at=e.created_at,
+        client_event_id=e.client_event_id
     )
 
 
+def _stream_ndjson(statement):
+    """Yield NDJSON chunks from a server-side cursor with its own session"""
+    db = SessionLocal()
+    try:
+        result = db.scalars(statement.execution_options(yield_per=STREAM_BATCH_SIZE))
+        for partition in result.partitions():
+            yield "".join(_event_response(e).model_dump_json() + "\n" for e in partition)
+    finally:
+        db.close()
+
+
 @router.get("", response_model=List[TimeEventResponse])
 async def list_time_events(
+    response: Response,
     location_id: Optional[UUID] = Query(None),
     employee_id: Optional[UUID] = Query(None),
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
+    limit: int = Query(1000, ge=1, le=1000),
+    cursor: Optional[str] = Query(None),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
     device: Device = Depends(get_current_device),
     db: Session = Depends(get_db)
 ):
     """
-    List time events (admin view)
+    List time events (admin view), newest first
     Filtered by device location by default
+    
+    Pages are keyset-paginated: when more rows exist, the X-Next-Cursor
+    response header holds the cursor for the next page.
+    format=ndjson streams every matching row (from the cursor, if given)
+    as newline-delimited JSON instead of returning one page.
     """
-    query = db.query(TimeEvent).filter(TimeEvent.location_id == device.location_id)
+    statement = select(TimeEvent).where(TimeEvent.location_id == device.location_id)
     
     if employee_id:
-        query = query.filter(TimeEvent.employee_id == employee_id)
+        statement = statement.where(TimeEvent.employee_id == employee_id)
     
     if start_date:
-        query = query.filter(TimeEvent.event_time >= datetime.combine(start_date, datetime.min.time()))
+        statement = statement.where(TimeEvent.event_time >= datetime.combine(start_date, datetime.min.time()))
     
     if end_date:
-        query = query.filter(TimeEvent.event_time <= datetime.combine(end_date, datetime.max.time()))
-    
-    events = query.order_by(desc(TimeEvent.event_time)).limit(1000).all()
+        statement = statement.where(TimeEvent.event_time <= datetime.combine(end_date, datetime.max.time()))
     
-    return [
-        TimeEventResponse(
-            id=e.id,
-            employee_id=e.employee_id,
-            device_id=e.device_id,
-            location_id=e.location_id,
-            event_type=e.event_type,
-            event_time=e.event_time,
-            method=e.method,
-            is_valid=e.is_valid,
-            created_at=e.created_at
+    if cursor:
+        cursor_time, cursor_id = _decode_cursor(cursor)
+        statement = statement.where(
+            tuple_(TimeEvent.event_time, TimeEvent.id) < tuple_(cursor_time, cursor_id)
         )
-        for e in events
-    ]
+    
+    statement = statement.order_by(desc(TimeEvent.event_time), desc(TimeEvent.id))
+    
+    if format == "ndjson":
+        return StreamingResponse(_stream_ndjson(statement), media_type="application/x-ndjson")
+    
+    events = db.scalars(statement.limit(limit + 1)).all()
+    
+    if len(events) > limit:
+        events = events[:limit]
+        response.headers["X-Next-Cursor"] = _encode_cursor(events[-1].event_time, events[-1].id)
+    
+    return [_event_response(e) for e in events]
 
 
 @router.put("/{event_id}", response_model=TimeEventResponse)
@@ -142,27 +296,39 @@ async def update_time_event(
             detail="Time event not found"
         )
     
+    previous_date = time_event.local_date
     if event_update.event_type is not None:
         time_event.event_type = event_update.event_type
     if event_update.event_time is not None:
         time_event.event_time = event_update.event_time
+        time_event.local_date = clock_logic_service.local_date(db, time_event.location_id, event_update.event_time)
     if event_update.is_valid is not None:
         time_event.is_valid = event_update.is_valid
     
+    clock_logic_service.refresh_employee_state(db, time_event.employee_id, time_event.location_id)
+    export_cache.bump(db, [time_event.location_id] * 2, [previous_date, time_event.local_date])
     db.commit()
     db.refresh(time_event)
     
-    return TimeEventResponse(
-        id=time_event.id,
-        employee_id=time_event.employee_id,
-        device_id=time_event.device_id,
-        location_id=time_event.location_id,
-        event_type=time_event.event_type,
-        event_time=time_event.event_time,
-        method=time_event.method,
-        is_valid=time_event.is_valid,
-        created_at=time_event.created_at
+    event_response = _event_response(time_event)
+    _publish_correction(db, time_event, event_response)
+    
+    return event_response
+
+
+def _publish_correction(db: Session, time_event: TimeEvent, event_response: TimeEventResponse):
+    """Push the corrected employee state to subscribers of the location"""
+    ingest_queue.invalidate(time_event.employee_id)
+    if not clock_event_bus.has_subscribers(time_event.location_id):
+        return
+    
+    states = clock_logic_service.get_location_states(
+        db,
+        time_event.location_id,
+        active_only=False,
+        employee_ids=[time_event.employee_id]
     )
+    clock_event_bus.publish_states(time_event.location_id, "CORRECTION", states, [event_response])
 
 
 @router.delete("/{event_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -184,40 +350,32 @@ async def invalidate_time_event(
         )
     
     time_event.is_valid = False
+    clock_logic_service.refresh_employee_state(db, time_event.employee_id, time_event.location_id)
+    export_cache.bump_events(db, [time_event])
     db.commit()
     
+    _publish_correction(db, time_event, _event_response(time_event))
+    
     return None
 
 
 @router.get("/clocked-in", response_model=List[ClockedInEmployee])
 async def get_clocked_in_employees(
     device: Device = Depends(get_current_device),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get list of currently clocked in employees"""
-    # Get all employees at location
-    employees = db.query(Employee).filter(
-        Employee.location_id == device.location_id,
-        Employee.is_active == True
-    ).all()
-    
-    clocked_in = []
-    for employee in employees:
-        state, last_event = clock_logic_service.get_employee_state(
-            db,
-            employee.employee_id,
-            str(employee.location_id)
-        )
-        
-        if state == "CLOCKED_IN" and last_event:
-            device_info = db.query(Device).filter(Device.id == last_event.device_id).first()
-            clocked_in.append(ClockedInEmployee(
-                employee_id=employee.employee_id,
-                name=employee.name,
-                clock_in_time=last_event.event_time,
-                device_id=last_event.device_id,
-                device_name=device_info.name if device_info else None
-            ))
+    states = await db.run_sync(clock_logic_service.get_location_states, device.location_id)
     
-    return clocked_in
+    return [
+        ClockedInEmployee(
+            employee_id=s.employee_id,
+            name=s.name,
+            clock_in_time=s.last_event_time,
+            device_id=s.device_id,
+            device_name=s.device_name
+        )
+        for s in states
+        if s.state == ClockState.CLOCKED_IN
+    ]
 
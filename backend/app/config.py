@@ -1,13 +1,77 @@
 from pydantic_settings import BaseSettings
+from datetime import date
 from typing import Optional
 
 
 class Settings(BaseSettings):
     database_url: str
+    async_database_url: Optional[str] = None  # Defaults to database_url on asyncpg
     secret_key: str
     sendgrid_api_key: Optional[str] = None
     log_level: str = "INFO"
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout_seconds: int = 30
+    db_pool_recycle_seconds: int = 1800
+    db_pool_pre_ping: bool = True
+    db_statement_timeout_ms: int = 0  # 0 disables the timeout
     encryption_key_id: str = "v1"
+    api_key_cache_ttl_seconds: int = 300
+    api_key_cache_max_size: int = 1024
+    api_key_legacy_deadline: Optional[date] = None  # Keys without a lookup fingerprint are refused after this day
+    heartbeat_flush_interval_seconds: int = 30
+    bcrypt_pool_size: int = 4
+    bcrypt_queue_depth: int = 64
+    event_stream_queue_size: int = 100
+    event_stream_keepalive_seconds: int = 15
+    ingest_mode: str = "direct"  # "direct" or "queued" (group commit)
+    ingest_durability: str = "normal"  # "database", "full" or "normal"
+    ingest_journal_path: Optional[str] = None  # Defaults to kiosk-backend/ingest_journal.db in $XDG_STATE_HOME (~/.local/state)
+    ingest_flush_max_events: int = 200
+    ingest_flush_interval_ms: int = 20
+    ingest_queue_max_pending: int = 10000
+    ingest_write_max_attempts: int = 3  # Failed writes of a single event before it is rejected
+    ingest_retry_base_ms: int = 100
+    ingest_retry_max_seconds: int = 30
+    ingest_submit_timeout_seconds: float = 10.0  # Longest a kiosk request waits for its punch to be acknowledged
+    export_workers: int = 4
+    export_timeout_seconds: int = 300
+    export_schedule_refresh_seconds: int = 60
+    export_catchup_days: int = 3
+    export_max_attempts: int = 3
+    scheduler_enabled: bool = True  # False keeps this process out of leader election
+    scheduler_lease_check_seconds: int = 15
+    export_job_workers: int = 2
+    export_job_queue_depth: int = 16
+    web_concurrency: int = 1  # API worker processes; uvicorn and gunicorn read the same WEB_CONCURRENCY
+    export_job_dir: Optional[str] = None  # Defaults to kiosk-exports in the temp directory; required with several workers
+    export_job_retention_hours: int = 24
+    export_job_heartbeat_seconds: int = 30
+    import_job_workers: int = 1
+    import_job_queue_depth: int = 4
+    import_job_retention_hours: int = 24
+    import_job_heartbeat_seconds: int = 30
+    export_cache_dir: Optional[str] = None  # Defaults to kiosk-export-cache in the temp directory
+    export_cache_retention_days: int = 7
+    export_range_max_days: int = 366
+    export_gzip_level: int = 6
+    export_parquet_compression: str = "zstd"  # Any codec pyarrow supports, e.g. "snappy" or "none"
+    export_parquet_row_group_rows: int = 131072
+    timesheet_max_shift_hours: int = 24  # Longer IN/OUT pairs are reported as unpaired
+    timesheet_max_days: int = 93
+    rollup_refresh_seconds: int = 30
+    rollup_refresh_max_days: int = 400  # Changed days recomputed per location and refresh
+    mail_transport: str = "sendgrid"  # "sendgrid" or "stub" (in-memory, for tests and benchmarks)
+    mail_from: str = "noreply@kioskapp.com"
+    sendgrid_api_url: str = "https://api.sendgrid.com"
+    mail_concurrency: int = 4
+    mail_batch_size: int = 50
+    mail_queue_size: int = 1000
+    mail_max_attempts: int = 5
+    mail_retry_base_seconds: float = 1.0
+    mail_send_timeout_seconds: int = 120
+    mail_stub_latency_ms: float = 0
+    mail_stub_failure_rate: float = 0.0
     
     class Config:
         env_file = ".env"
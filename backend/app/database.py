@@ -1,15 +1,57 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 from app.config import settings
+from app.services.metrics import PoolMetrics
 
-engine = create_engine(settings.database_url)
+
+def _async_database_url(url: str) -> str:
+    """Map the configured (sync) database URL onto the asyncpg driver"""
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+pool_options = dict(
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout_seconds,
+    pool_recycle=settings.db_pool_recycle_seconds,
+    pool_pre_ping=settings.db_pool_pre_ping,
+)
+
+sync_pool_metrics = PoolMetrics()
+async_pool_metrics = PoolMetrics()
+
+sync_connect_args = {}
+async_connect_args = {}
+if settings.db_statement_timeout_ms:
+    sync_connect_args["options"] = f"-c statement_timeout={settings.db_statement_timeout_ms}"
+    async_connect_args["server_settings"] = {"statement_timeout": str(settings.db_statement_timeout_ms)}
+
+engine = create_engine(
+    settings.database_url,
+    poolclass=sync_pool_metrics.pool_class(QueuePool),
+    connect_args=sync_connect_args,
+    **pool_options
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(
+    settings.async_database_url or _async_database_url(settings.database_url),
+    poolclass=async_pool_metrics.pool_class(AsyncAdaptedQueuePool),
+    connect_args=async_connect_args,
+    **pool_options
+)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 # Import all models so Alembic can detect them
-from app.models import Location, Device, Employee, FaceEmbedding, TimeEvent, Settings  # noqa
+from app.models import Location, Device, Employee, FaceEmbedding, TimeEvent, EmployeeClockState, Settings, ExportRun, ExportJob, ExportDayVersion, HoursRollup  # noqa
 
 
 def get_db():
@@ -20,3 +62,16 @@ def get_db():
     finally:
         db.close()
 
+
+async def get_async_db():
+    """Dependency for FastAPI to get an async database session"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def get_pool_stats() -> dict:
+    """Occupancy and checkout wait times for both connection pools"""
+    return {
+        "sync": sync_pool_metrics.snapshot(engine.pool),
+        "async": async_pool_metrics.snapshot(async_engine.sync_engine.pool)
+    }
@@ -1,7 +1,16 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.config import settings
+from app.database import async_engine
 from app.api import devices, employees, time_events, embeddings, admin
+from app.services.heartbeat import heartbeat_service
+from app.services.bcrypt_service import BcryptQueueFullError
+from app.services.ingest_queue import ingest_queue, IngestQueueFullError, IngestTimeoutError
+from app.services.scheduler import scheduler_service
+from app.services.mail_service import mail_queue
+from app.services.export_jobs import export_job_service, ExportJobQueueFullError
+from app.services.import_jobs import ImportJobQueueFullError
 
 app = FastAPI(
     title="Kiosk Face Recognition API",
@@ -25,6 +34,69 @@ app.include_router(embeddings.router)
 app.include_router(admin.router)
 
 
+@app.exception_handler(BcryptQueueFullError)
+async def bcrypt_queue_full_handler(request: Request, exc: BcryptQueueFullError):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server busy, please retry"},
+        headers={"Retry-After": "1"}
+    )
+
+
+@app.exception_handler(IngestQueueFullError)
+async def ingest_queue_full_handler(request: Request, exc: IngestQueueFullError):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server busy, please retry"},
+        headers={"Retry-After": "1"}
+    )
+
+
+@app.exception_handler(IngestTimeoutError)
+async def ingest_timeout_handler(request: Request, exc: IngestTimeoutError):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Punch not confirmed yet, please retry"},
+        headers={"Retry-After": "5"}
+    )
+
+
+@app.exception_handler(ExportJobQueueFullError)
+async def export_job_queue_full_handler(request: Request, exc: ExportJobQueueFullError):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Too many exports in progress, please retry"},
+        headers={"Retry-After": "30"}
+    )
+
+
+@app.exception_handler(ImportJobQueueFullError)
+async def import_job_queue_full_handler(request: Request, exc: ImportJobQueueFullError):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Too many imports in progress, please retry"},
+        headers={"Retry-After": "30"}
+    )
+
+
+@app.on_event("startup")
+async def startup():
+    export_job_service.start()
+    heartbeat_service.start()
+    mail_queue.start()
+    await ingest_queue.start()
+    scheduler_service.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await scheduler_service.stop()
+    await ingest_queue.stop()
+    await heartbeat_service.stop()
+    await mail_queue.stop()
+    await async_engine.dispose()
+
+
 @app.get("/")
 async def root():
     return {"message": "Kiosk Face Recognition API", "version": "1.0.0"}
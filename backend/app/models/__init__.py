@@ -3,7 +3,14 @@ from app.models.device import Device
 from app.models.employee import Employee
 from app.models.face_embedding import FaceEmbedding
 from app.models.time_event import TimeEvent
+from app.models.employee_clock_state import EmployeeClockState
 from app.models.settings import Settings
+from app.models.export_run import ExportRun
+from app.models.export_job import ExportJob
+from app.models.import_job import ImportJob
+from app.models.export_day_version import ExportDayVersion
+from app.models.export_day_change import ExportDayChange
+from app.models.hours_rollup import HoursRollup
 
 __all__ = [
     "Location",
@@ -11,6 +18,13 @@ __all__ = [
     "Employee",
     "FaceEmbedding",
     "TimeEvent",
+    "EmployeeClockState",
     "Settings",
+    "ExportRun",
+    "ExportJob",
+    "ImportJob",
+    "ExportDayVersion",
+    "ExportDayChange",
+    "HoursRollup",
 ]
 
@@ -13,6 +13,7 @@ class Device(Base):
     device_id = Column(String, unique=True, nullable=False)  # Hardware identifier
     location_id = Column(UUID(as_uuid=True), ForeignKey("locations.id"), nullable=False)
     api_key = Column(String, nullable=False)  # Bcrypt hashed
+    api_key_lookup = Column(String, unique=True, index=True, nullable=True)  # HMAC fingerprint for indexed lookup
     name = Column(String, nullable=True)  # Optional device name
     registered_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     last_seen_at = Column(DateTime, default=datetime.utcnow, nullable=False)
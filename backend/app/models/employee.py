@@ -22,6 +22,7 @@ class Employee(Base):
     location = relationship("Location", back_populates="employees")
     face_embeddings = relationship("FaceEmbedding", back_populates="employee", cascade="all, delete-orphan")
     time_events = relationship("TimeEvent", back_populates="employee")
+    clock_state = relationship("EmployeeClockState", back_populates="employee", uselist=False, passive_deletes=True)
 
     # Constraints
     __table_args__ = (
@@ -0,0 +1,30 @@
+from sqlalchemy import Column, String, DateTime, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import UUID, TIMESTAMP
+from sqlalchemy.orm import relationship
+from datetime import datetime
+from app.database import Base
+
+
+class EmployeeClockState(Base):
+    """Current clock state per employee, derived from their latest valid time event"""
+
+    __tablename__ = "employee_clock_state"
+
+    employee_id = Column(UUID(as_uuid=True), ForeignKey("employees.id", ondelete="CASCADE"), primary_key=True)
+    location_id = Column(UUID(as_uuid=True), ForeignKey("locations.id"), nullable=False)
+    state = Column(String, nullable=False, default="CLOCKED_OUT")  # 'CLOCKED_IN' or 'CLOCKED_OUT'
+    last_event_id = Column(UUID(as_uuid=True), ForeignKey("time_events.id"), nullable=True)
+    last_event_time = Column(TIMESTAMP(timezone=True), nullable=True)
+    last_event_type = Column(String, nullable=True)
+    device_id = Column(UUID(as_uuid=True), ForeignKey("devices.id"), nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    # Relationships
+    employee = relationship("Employee", back_populates="clock_state")
+    last_event = relationship("TimeEvent")
+    device = relationship("Device")
+
+    # Indexes
+    __table_args__ = (
+        Index("ix_employee_clock_state_location_state", "location_id", "state"),
+    )
@@ -0,0 +1,23 @@
+from sqlalchemy import Column, Date, BigInteger, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import UUID
+from app.database import Base
+
+
+class ExportDayChange(Base):
+    """
+    A change to one local day of a location, not yet folded into its version
+
+    Rows are only ever inserted, so concurrent writers never wait on each
+    other; the hours rollup folds them into export_day_versions.
+    """
+
+    __tablename__ = "export_day_changes"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    location_id = Column(UUID(as_uuid=True), ForeignKey("locations.id", ondelete="CASCADE"), nullable=False)
+    local_date = Column(Date, nullable=False)  # Date in the location timezone
+
+    # Indexes
+    __table_args__ = (
+        Index("ix_export_day_changes_location_date", "location_id", "local_date"),
+    )
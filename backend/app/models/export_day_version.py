@@ -0,0 +1,26 @@
+from sqlalchemy import Column, Date, DateTime, BigInteger, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import UUID
+from datetime import datetime
+from app.database import Base
+
+
+class ExportDayVersion(Base):
+    """Data version of one local day of a location, bumped as its changes are folded in"""
+
+    __tablename__ = "export_day_versions"
+
+    location_id = Column(UUID(as_uuid=True), ForeignKey("locations.id", ondelete="CASCADE"), primary_key=True)
+    local_date = Column(Date, primary_key=True)  # Date in the location timezone
+    version = Column(BigInteger, nullable=False, default=1)
+    rollup_version = Column(BigInteger, nullable=True)  # Version the hours rollup was computed from
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    # Indexes
+    __table_args__ = (
+        Index(
+            "ix_export_day_versions_rollup_pending",
+            "location_id",
+            "local_date",
+            postgresql_where=rollup_version.is_distinct_from(version)
+        ),
+    )
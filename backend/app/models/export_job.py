@@ -0,0 +1,31 @@
+from sqlalchemy import Column, String, Date, DateTime, Boolean, BigInteger, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import UUID
+import uuid
+from datetime import datetime
+from app.database import Base
+
+
+class ExportJob(Base):
+    """On-demand export requested from an admin screen, run in the background"""
+
+    __tablename__ = "export_jobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    location_id = Column(UUID(as_uuid=True), ForeignKey("locations.id", ondelete="CASCADE"), nullable=False)
+    device_id = Column(UUID(as_uuid=True), ForeignKey("devices.id", ondelete="SET NULL"), nullable=True)
+    export_date = Column(Date, nullable=False)
+    export_format = Column(String, nullable=False, default="csv")  # A name in export_formats.EXPORT_FORMATS
+    send_email = Column(Boolean, nullable=False, default=True)
+    status = Column(String, nullable=False, default="QUEUED")  # 'QUEUED', 'RUNNING', 'SUCCEEDED' or 'FAILED'
+    file_path = Column(String, nullable=True)
+    file_size = Column(BigInteger, nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)  # Renewed by the process that queued the job until it finishes
+
+    # Indexes
+    __table_args__ = (
+        Index("ix_export_jobs_status_finished", "status", "finished_at"),
+    )
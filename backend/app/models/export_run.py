@@ -0,0 +1,26 @@
+from sqlalchemy import Column, String, Date, DateTime, Integer, ForeignKey, UniqueConstraint
+from sqlalchemy.dialects.postgresql import UUID
+import uuid
+from datetime import datetime
+from app.database import Base
+
+
+class ExportRun(Base):
+    """One scheduled daily export of a location, claimed by the process that runs it"""
+
+    __tablename__ = "export_runs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    location_id = Column(UUID(as_uuid=True), ForeignKey("locations.id", ondelete="CASCADE"), nullable=False)
+    export_date = Column(Date, nullable=False)  # Local date that was exported
+    status = Column(String, nullable=False)  # 'RUNNING', 'SUCCEEDED' or 'FAILED'
+    attempts = Column(Integer, nullable=False, default=1)
+    started_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+    duration_ms = Column(Integer, nullable=True)
+    error = Column(String, nullable=True)
+
+    # Indexes
+    __table_args__ = (
+        UniqueConstraint("location_id", "export_date", name="uq_export_runs_location_date"),
+    )
@@ -10,7 +10,7 @@ class FaceEmbedding(Base):
     __tablename__ = "face_embeddings"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    employee_id = Column(UUID(as_uuid=True), ForeignKey("employees.id", ondelete="CASCADE"), nullable=False)
+    employee_id = Column(UUID(as_uuid=True), ForeignKey("employees.id", ondelete="CASCADE"), nullable=False, index=True)
     embedding_encrypted = Column(LargeBinary, nullable=False)  # AES-256-GCM encrypted
     encryption_key_id = Column(String, nullable=False, default="v1")
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
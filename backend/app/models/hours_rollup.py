@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Date, Integer, Boolean, ForeignKey
+from sqlalchemy.dialects.postgresql import UUID
+from app.database import Base
+
+
+class HoursRollup(Base):
+    """Time an employee worked on one local day, derived from paired punches"""
+
+    __tablename__ = "hours_rollup"
+
+    location_id = Column(UUID(as_uuid=True), ForeignKey("locations.id", ondelete="CASCADE"), primary_key=True)
+    local_date = Column(Date, primary_key=True)  # Date in the location timezone
+    employee_id = Column(UUID(as_uuid=True), ForeignKey("employees.id", ondelete="CASCADE"), primary_key=True)
+    worked_seconds = Column(Integer, nullable=False, default=0)
+    shift_count = Column(Integer, nullable=False, default=0)  # Shifts worked on this day, split at midnight
+    open_shift = Column(Boolean, nullable=False, default=False)  # An IN on this day has no matching OUT
@@ -0,0 +1,28 @@
+from sqlalchemy import Column, String, DateTime, Boolean, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import JSONB, UUID
+import uuid
+from datetime import datetime
+from app.database import Base
+
+
+class ImportJob(Base):
+    """Bulk CSV import uploaded from an admin screen, run in the background"""
+
+    __tablename__ = "import_jobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    location_id = Column(UUID(as_uuid=True), ForeignKey("locations.id", ondelete="CASCADE"), nullable=False)
+    device_id = Column(UUID(as_uuid=True), ForeignKey("devices.id", ondelete="SET NULL"), nullable=True)
+    dry_run = Column(Boolean, nullable=False, default=False)
+    status = Column(String, nullable=False, default="QUEUED")  # 'QUEUED', 'RUNNING', 'SUCCEEDED' or 'FAILED'
+    report = Column(JSONB, nullable=True)  # ImportReport of a finished job
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)  # Renewed by the process running the job until it finishes
+
+    # Indexes
+    __table_args__ = (
+        Index("ix_import_jobs_status_finished", "status", "finished_at"),
+    )
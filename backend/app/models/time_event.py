@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, String, Boolean, Date, DateTime, ForeignKey, Index
 from sqlalchemy.dialects.postgresql import UUID, TIMESTAMP
 from sqlalchemy.orm import relationship
 import uuid
@@ -15,8 +15,10 @@ class TimeEvent(Base):
     location_id = Column(UUID(as_uuid=True), ForeignKey("locations.id"), nullable=False)
     event_type = Column(String, nullable=False)  # 'IN' or 'OUT'
     event_time = Column(TIMESTAMP(timezone=True), nullable=False)
+    local_date = Column(Date, nullable=False)  # Date of event_time in the location timezone
     method = Column(String, nullable=False)  # 'FACE' or 'PIN'
     is_valid = Column(Boolean, default=True, nullable=False)
+    client_event_id = Column(UUID(as_uuid=True), unique=True, index=True, nullable=True)  # Idempotency key
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
     # Relationships
@@ -24,3 +26,13 @@ class TimeEvent(Base):
     device = relationship("Device", back_populates="time_events")
     location = relationship("Location", back_populates="time_events")
 
+
+# Indexes
+Index(
+    "ix_time_events_employee_valid_time",
+    TimeEvent.employee_id,
+    TimeEvent.event_time.desc(),
+    postgresql_where=TimeEvent.is_valid
+)
+Index("ix_time_events_location_time", TimeEvent.location_id, TimeEvent.event_time)
+Index("ix_time_events_location_local_date", TimeEvent.location_id, TimeEvent.local_date, TimeEvent.event_time)
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Optional
 from uuid import UUID
 from datetime import datetime
 
@@ -9,6 +9,7 @@ class TimeEventCreate(BaseModel):
     event_type: str  # 'IN' or 'OUT'
     method: str  # 'FACE' or 'PIN'
     event_time: Optional[datetime] = None  # If None, use current time
+    client_event_id: Optional[UUID] = None  # Client-generated; retries return the original event
 
 
 class TimeEventUpdate(BaseModel):
@@ -27,6 +28,7 @@ class TimeEventResponse(BaseModel):
     method: str
     is_valid: bool
     created_at: datetime
+    client_event_id: Optional[UUID] = None
 
     class Config:
         from_attributes = True
@@ -39,3 +41,20 @@ class ClockedInEmployee(BaseModel):
     device_id: UUID
     device_name: Optional[str] = None
 
+
+class TimeEventBatchCreate(BaseModel):
+    events: List[TimeEventCreate] = Field(..., max_length=1000)  # Replayed in order
+
+
+class TimeEventBatchResult(BaseModel):
+    index: int  # Position in the submitted batch
+    status: str  # 'CREATED', 'DUPLICATE' or 'REJECTED'
+    event: Optional[TimeEventResponse] = None
+    error: Optional[str] = None
+
+
+class TimeEventBatchResponse(BaseModel):
+    created: int
+    duplicate: int
+    rejected: int
+    results: List[TimeEventBatchResult]
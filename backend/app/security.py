@@ -1,10 +1,22 @@
 from fastapi import Security, HTTPException, status, Depends
 from fastapi.security import APIKeyHeader
-from sqlalchemy.orm import Session
-import bcrypt
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from collections import OrderedDict
+from datetime import date
+from typing import Optional, Tuple
+from uuid import UUID
+import asyncio
+import hashlib
+import hmac
 import secrets
-from app.database import get_db
+import threading
+import time
+from app.config import settings
+from app.database import get_async_db
 from app.models.device import Device
+from app.services.bcrypt_service import bcrypt_service
+from app.services.heartbeat import heartbeat_service
 
 api_key_header = APIKeyHeader(name="X-Device-API-Key", auto_error=False)
 
@@ -14,23 +26,136 @@ def generate_api_key() -> str:
     return secrets.token_urlsafe(32)
 
 
-def hash_api_key(api_key: str) -> str:
+async def hash_api_key(api_key: str) -> str:
     """Hash an API key using bcrypt"""
-    return bcrypt.hashpw(api_key.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return await bcrypt_service.hashpw(api_key)
 
 
-def verify_api_key(api_key: str, hashed: str) -> bool:
+async def verify_api_key(api_key: str, hashed: str) -> bool:
     """Verify an API key against its hash"""
-    return bcrypt.checkpw(api_key.encode('utf-8'), hashed.encode('utf-8'))
+    return await bcrypt_service.checkpw(api_key, hashed)
+
+
+def api_key_fingerprint(api_key: str) -> str:
+    """
+    Keyed HMAC-SHA256 fingerprint of an API key
+
+    Stored in the indexed devices.api_key_lookup column so a request can
+    fetch its device with a single lookup. Not usable without SECRET_KEY.
+    """
+    return hmac.new(
+        settings.secret_key.encode('utf-8'),
+        api_key.encode('utf-8'),
+        hashlib.sha256
+    ).hexdigest()
+
+
+class VerifiedKeyCache:
+    """
+    Bounded, TTL'd cache of API key fingerprints that already passed bcrypt
+
+    Entries are tied to the device's stored hash, so re-keying a device
+    invalidates them immediately.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: int):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[UUID, str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_verified(self, fingerprint: str, device: Device) -> bool:
+        """Check whether this fingerprint was recently verified for the device"""
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if not entry:
+                return False
+
+            device_id, api_key_hash, expires_at = entry
+            if (
+                expires_at < time.monotonic()
+                or device_id != device.id
+                or api_key_hash != device.api_key
+            ):
+                del self._entries[fingerprint]
+                return False
+
+            self._entries.move_to_end(fingerprint)
+            return True
+
+    def add(self, fingerprint: str, device: Device) -> None:
+        """Remember a successful verification, evicting the oldest entry if full"""
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._entries[fingerprint] = (
+                device.id,
+                device.api_key,
+                time.monotonic() + self.ttl_seconds
+            )
+            self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+verified_key_cache = VerifiedKeyCache(
+    max_size=settings.api_key_cache_max_size,
+    ttl_seconds=settings.api_key_cache_ttl_seconds
+)
+
+
+async def _find_legacy_device(db: AsyncSession, api_key: str, fingerprint: str) -> Optional[Device]:
+    """
+    Find a device whose key was issued before lookup fingerprints existed
+
+    The plaintext key is only known when the device presents it, so the
+    fingerprint is backfilled here on the first successful authentication.
+    Every device still without a fingerprint is tried, most recently seen
+    first, bcrypt_pool_size at a time, so the scan shrinks as the fleet
+    migrates and its cost is bounded by the bcrypt pool. After
+    api_key_legacy_deadline legacy keys are refused and their devices must
+    be registered again.
+    """
+    deadline = settings.api_key_legacy_deadline
+    if deadline and date.today() > deadline:
+        return None
+
+    result = await db.execute(
+        select(Device)
+        .where(Device.api_key_lookup.is_(None))
+        .order_by(Device.last_seen_at.desc())
+    )
+    candidates = result.scalars().all()
+    step = max(settings.bcrypt_pool_size, 1)
+    for start in range(0, len(candidates), step):
+        chunk = candidates[start:start + step]
+        matches = await asyncio.gather(*(verify_api_key(api_key, device.api_key) for device in chunk))
+        for device, matched in zip(chunk, matches):
+            if matched:
+                device.api_key_lookup = fingerprint
+                await db.commit()
+                return device
+
+    return None
 
 
 async def get_current_device(
     api_key: str = Security(api_key_header),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> Device:
     """
     Dependency to get the current authenticated device
-    
+
+    The session's transaction is ended before returning, so its pooled
+    connection is not held for the rest of the request; endpoints that
+    keep using the session start a new one. The device stays loaded
+    since sessions do not expire on commit.
+
     Raises HTTPException if authentication fails
     """
     if not api_key:
@@ -38,19 +163,31 @@ async def get_current_device(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="API key required"
         )
-    
-    # Find device by comparing API key hash
-    devices = db.query(Device).all()
-    for device in devices:
-        if verify_api_key(api_key, device.api_key):
-            # Update last_seen_at
-            from datetime import datetime
-            device.last_seen_at = datetime.utcnow()
-            db.commit()
-            return device
-    
+
+    # Find device by its indexed key fingerprint, then verify the hash once
+    fingerprint = api_key_fingerprint(api_key)
+    result = await db.execute(select(Device).where(Device.api_key_lookup == fingerprint))
+    device = result.scalar_one_or_none()
+
+    if device:
+        if not verified_key_cache.is_verified(fingerprint, device):
+            if not await verify_api_key(api_key, device.api_key):
+                device = None
+            else:
+                verified_key_cache.add(fingerprint, device)
+    else:
+        device = await _find_legacy_device(db, api_key, fingerprint)
+        if device:
+            verified_key_cache.add(fingerprint, device)
+
+    await db.commit()
+
+    if device:
+        # Buffered; flushed to last_seen_at in batches
+        heartbeat_service.record(device.id)
+        return device
+
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid API key"
     )
-
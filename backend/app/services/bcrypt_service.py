@@ -0,0 +1,83 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+import asyncio
+import bcrypt
+import threading
+import time
+from app.config import settings
+from app.services.metrics import LatencyHistogram
+
+
+class BcryptQueueFullError(Exception):
+    """Raised when the bcrypt pool already has bcrypt_queue_depth jobs waiting"""
+
+
+class BcryptService:
+    """
+    Runs bcrypt hashing and verification on a bounded worker pool
+
+    bcrypt is deliberately slow and releases the GIL, so running it on a
+    thread pool keeps the event loop free for other requests.
+    """
+
+    def __init__(self):
+        self.pool_size = settings.bcrypt_pool_size
+        self.queue_depth = settings.bcrypt_queue_depth
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.pool_size,
+            thread_name_prefix="bcrypt"
+        )
+        self._in_flight = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+        self.queue_wait = LatencyHistogram()
+        self.hash_time = LatencyHistogram()
+
+    async def _run(self, func: Callable, *args):
+        with self._lock:
+            if self._in_flight >= self.pool_size + self.queue_depth:
+                self._rejected += 1
+                raise BcryptQueueFullError("Too many pending bcrypt operations")
+            self._in_flight += 1
+
+        submitted_at = time.perf_counter()
+
+        def job():
+            started_at = time.perf_counter()
+            self.queue_wait.observe(started_at - submitted_at)
+            try:
+                return func(*args)
+            finally:
+                self.hash_time.observe(time.perf_counter() - started_at)
+
+        try:
+            return await asyncio.wrap_future(self._executor.submit(job))
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    async def hashpw(self, secret: str) -> str:
+        """Hash a secret using bcrypt"""
+        hashed = await self._run(bcrypt.hashpw, secret.encode('utf-8'), bcrypt.gensalt())
+        return hashed.decode('utf-8')
+
+    async def checkpw(self, secret: str, hashed: str) -> bool:
+        """Verify a secret against its bcrypt hash"""
+        return await self._run(bcrypt.checkpw, secret.encode('utf-8'), hashed.encode('utf-8'))
+
+    def get_stats(self) -> Dict:
+        """Pool occupancy, rejections and queue wait / hash time histograms"""
+        with self._lock:
+            in_flight = self._in_flight
+            rejected = self._rejected
+        return {
+            "pool_size": self.pool_size,
+            "queue_depth": self.queue_depth,
+            "in_flight": in_flight,
+            "rejected": rejected,
+            "queue_wait": self.queue_wait.snapshot(),
+            "hash_time": self.hash_time.snapshot()
+        }
+
+
+bcrypt_service = BcryptService()
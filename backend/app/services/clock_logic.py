@@ -1,9 +1,28 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from datetime import datetime
-from typing import Optional, Tuple
+from sqlalchemy import desc, func, select, literal, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from datetime import date, datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+import pytz
+import uuid
+from app.models.device import Device
 from app.models.employee import Employee
+from app.models.employee_clock_state import EmployeeClockState
+from app.models.location import Location
 from app.models.time_event import TimeEvent
+from app.services.export_cache import export_cache
+
+_MOVED_DAYS_SQL = text("""
+    SELECT DISTINCT local_date, timezone(:timezone, event_time)::date
+    FROM time_events
+    WHERE location_id = :location_id AND local_date <> timezone(:timezone, event_time)::date
+""")
+
+_REDATE_SQL = text("""
+    UPDATE time_events SET local_date = timezone(:timezone, event_time)::date
+    WHERE location_id = :location_id AND local_date <> timezone(:timezone, event_time)::date
+""")
 
 
 class ClockState:
@@ -11,9 +30,80 @@ class ClockState:
     CLOCKED_OUT = "CLOCKED_OUT"
 
 
+class EventRejected(ValueError):
+    """Raised when a time event cannot be recorded"""
+
+    EMPLOYEE_NOT_FOUND = "EMPLOYEE_NOT_FOUND"
+    WRONG_LOCATION = "WRONG_LOCATION"
+    INVALID_TRANSITION = "INVALID_TRANSITION"
+    CLIENT_ID_CONFLICT = "CLIENT_ID_CONFLICT"
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
 class ClockLogicService:
     """Service for calculating clock state and validating transitions"""
 
+    @staticmethod
+    def location_timezones(db: Session, location_ids: Iterable[UUID]) -> Dict[UUID, str]:
+        """
+        Timezone names of the given locations
+
+        The rows are key-share locked until the caller commits, the same lock
+        inserting a time event takes for its foreign key, so a timezone
+        change waits for events dated in the old zone and then redates them.
+        """
+        return dict(
+            db.query(Location.id, Location.timezone)
+            .filter(Location.id.in_(set(location_ids)))
+            .with_for_update(read=True, key_share=True)
+            .all()
+        )
+
+    @staticmethod
+    def local_date(db: Session, location_id: UUID, event_time: datetime) -> date:
+        """Date of an event time in the location timezone; naive times are taken as UTC"""
+        if event_time.tzinfo is None:
+            event_time = event_time.replace(tzinfo=timezone.utc)
+        timezone_name = ClockLogicService.location_timezones(db, [location_id])[location_id]
+        return event_time.astimezone(pytz.timezone(timezone_name)).date()
+
+    @staticmethod
+    def set_location_timezone(db: Session, location_id: UUID, timezone_name: str) -> int:
+        """
+        Move a location to another timezone and redate its time events
+
+        The location row is locked first, so concurrent punches wait for the
+        change and are dated in the new zone. Every event whose local date
+        moves is updated, and changes to the days it left and joined are
+        recorded for the export cache and hours rollup. The caller commits.
+
+        Returns:
+            Number of time events whose local date changed
+
+        Raises:
+            ValueError if the timezone is unknown or the location does not exist
+        """
+        if timezone_name not in pytz.all_timezones_set:
+            raise ValueError(f"Unknown timezone {timezone_name!r}")
+        location = db.query(Location).filter(Location.id == location_id).with_for_update().first()
+        if location is None:
+            raise ValueError(f"Location {location_id} not found")
+        if location.timezone == timezone_name:
+            return 0
+
+        # Redating every event of a location can outlast the request timeout
+        db.execute(text("SET LOCAL statement_timeout = 0"))
+        params = {"location_id": location_id, "timezone": timezone_name}
+        days = {day for pair in db.execute(_MOVED_DAYS_SQL, params) for day in pair}
+        moved = db.execute(_REDATE_SQL, params).rowcount
+        location.timezone = timezone_name
+        db.flush()
+        export_cache.bump(db, [location_id] * len(days), sorted(days))
+        return moved
+
     @staticmethod
     def get_employee_state(db: Session, employee_id: str, location_id: str) -> Tuple[str, Optional[TimeEvent]]:
         """
@@ -22,24 +112,419 @@ class ClockLogicService:
         Returns:
             Tuple of (state, last_event)
         """
-        employee = db.query(Employee).filter(
+        row = db.query(Employee.id, EmployeeClockState.state, TimeEvent).outerjoin(
+            EmployeeClockState, EmployeeClockState.employee_id == Employee.id
+        ).outerjoin(
+            TimeEvent, TimeEvent.id == EmployeeClockState.last_event_id
+        ).filter(
             Employee.employee_id == employee_id,
             Employee.location_id == location_id
         ).first()
         
-        if not employee:
+        if not row:
             raise ValueError(f"Employee {employee_id} not found")
         
-        # Get latest valid event
+        # Employees without a state row have never clocked in
+        return row.state or ClockState.CLOCKED_OUT, row.TimeEvent
+
+    @staticmethod
+    def state_after(event_type: Optional[str]) -> str:
+        """Clock state implied by an employee's latest valid event type"""
+        if not event_type or event_type == "OUT":
+            return ClockState.CLOCKED_OUT
+        return ClockState.CLOCKED_IN
+
+    @staticmethod
+    def _upsert_states(db: Session, states: List[Tuple[UUID, UUID, Optional[TimeEvent]]]):
+        """Write materialized clock state rows from (employee_id, location_id, last_event)"""
+        if not states:
+            return
+        
+        now = datetime.utcnow()
+        rows = [
+            {
+                "employee_id": employee_id,
+                "location_id": location_id,
+                "state": ClockLogicService.state_after(last_event.event_type if last_event else None),
+                "last_event_id": last_event.id if last_event else None,
+                "last_event_time": last_event.event_time if last_event else None,
+                "last_event_type": last_event.event_type if last_event else None,
+                "device_id": last_event.device_id if last_event else None,
+                "updated_at": now
+            }
+            for employee_id, location_id, last_event in states
+        ]
+        statement = pg_insert(EmployeeClockState).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[EmployeeClockState.employee_id],
+            set_={key: statement.excluded[key] for key in rows[0] if key != "employee_id"}
+        )
+        db.execute(statement)
+
+    @staticmethod
+    def refresh_employee_state(db: Session, employee_id: UUID, location_id: UUID) -> str:
+        """
+        Re-derive the materialized clock state from the latest valid event
+        
+        Used after admin corrections, which can change any event in the
+        history. Must run in the same transaction as the correction.
+        """
+        db.flush()
         last_event = db.query(TimeEvent).filter(
-            TimeEvent.employee_id == employee.id,
+            TimeEvent.employee_id == employee_id,
             TimeEvent.is_valid == True
         ).order_by(desc(TimeEvent.event_time)).first()
         
-        if not last_event or last_event.event_type == "OUT":
-            return ClockState.CLOCKED_OUT, last_event
+        ClockLogicService._upsert_states(db, [(employee_id, location_id, last_event)])
+        return ClockLogicService.state_after(last_event.event_type if last_event else None)
+
+    @staticmethod
+    def get_location_states(
+        db: Session,
+        location_id: UUID,
+        active_only: bool = True,
+        employee_ids: Optional[List[UUID]] = None
+    ) -> List:
+        """
+        Clock state of every employee at a location in one query
+        
+        Joins employees to their materialized clock state and the device of
+        their latest event. Employees who never clocked in are CLOCKED_OUT.
+        employee_ids restricts the result to those employees.
+        
+        Returns:
+            Rows with id, employee_id, name, state, last_event_time,
+            last_event_type, device_id and device_name
+        """
+        query = db.query(
+            Employee.id,
+            Employee.employee_id,
+            Employee.name,
+            func.coalesce(EmployeeClockState.state, ClockState.CLOCKED_OUT).label("state"),
+            EmployeeClockState.last_event_time,
+            EmployeeClockState.last_event_type,
+            EmployeeClockState.device_id,
+            Device.name.label("device_name")
+        ).outerjoin(
+            EmployeeClockState, EmployeeClockState.employee_id == Employee.id
+        ).outerjoin(
+            Device, Device.id == EmployeeClockState.device_id
+        ).filter(
+            Employee.location_id == location_id
+        )
+        
+        if active_only:
+            query = query.filter(Employee.is_active == True)
+        
+        if employee_ids is not None:
+            query = query.filter(Employee.id.in_(employee_ids))
+        
+        return query.order_by(Employee.name).all()
+
+    @staticmethod
+    def transition_error(state: str, last_event_time: Optional[datetime], event_type: str) -> Optional[str]:
+        """
+        Error message for an invalid state transition, or None if allowed
+        """
+        if event_type == "IN":
+            if state == ClockState.CLOCKED_IN:
+                if last_event_time:
+                    return f"You are already clocked in since {last_event_time.strftime('%H:%M')}"
+                return "You are already clocked in"
+            return None
+        elif event_type == "OUT":
+            if state == ClockState.CLOCKED_OUT:
+                if last_event_time:
+                    return "You must clock in before clocking out"
+                return "You are not clocked in"
+            return None
+        else:
+            return f"Invalid event type: {event_type}"
+
+    @staticmethod
+    def lock_states(db: Session, employee_ids: List[UUID]) -> dict:
+        """
+        Lock the clock state rows of the given employees, creating missing ones
+        
+        The upsert takes a row lock that is held until the transaction ends,
+        so concurrent punches for the same employee are serialized, and it
+        returns the latest committed state rather than a stale snapshot.
+        Other writers of clock history, such as bulk imports, take the same
+        locks.
+        
+        Returns:
+            Dict of employee UUID -> row with location_id, state and last_event_time
+        """
+        statement = pg_insert(EmployeeClockState).from_select(
+            ["employee_id", "location_id", "state", "updated_at"],
+            select(
+                Employee.id,
+                Employee.location_id,
+                literal(ClockState.CLOCKED_OUT),
+                literal(datetime.utcnow())
+            ).where(
+                Employee.id.in_(employee_ids)
+            ).order_by(Employee.id)  # Consistent lock order avoids deadlocks
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[EmployeeClockState.employee_id],
+            set_={"employee_id": statement.excluded.employee_id}
+        ).returning(
+            EmployeeClockState.employee_id,
+            EmployeeClockState.location_id,
+            EmployeeClockState.state,
+            EmployeeClockState.last_event_time
+        )
+        return {row.employee_id: row for row in db.execute(statement)}
+
+    @staticmethod
+    def get_states(db: Session, employee_ids: List[UUID]) -> dict:
+        """
+        Current clock state of the given employees, without locking
+        
+        Returns:
+            Dict of employee UUID -> (location_id, state, last_event_time)
+            for the employees that exist
+        """
+        rows = db.query(
+            Employee.id,
+            Employee.location_id,
+            func.coalesce(EmployeeClockState.state, ClockState.CLOCKED_OUT).label("state"),
+            EmployeeClockState.last_event_time
+        ).outerjoin(
+            EmployeeClockState, EmployeeClockState.employee_id == Employee.id
+        ).filter(
+            Employee.id.in_(employee_ids)
+        )
+        return {row.id: (row.location_id, row.state, row.last_event_time) for row in rows}
+
+    @staticmethod
+    def check_event(current: Optional[Tuple[UUID, str, Optional[datetime]]], event: TimeEvent) -> Optional[EventRejected]:
+        """
+        Validate a new event against its employee's (location_id, state, last_event_time)
+        
+        current is None when the employee does not exist. Returns the
+        rejection, or None if the event is allowed.
+        """
+        if not current:
+            return EventRejected(EventRejected.EMPLOYEE_NOT_FOUND, "Employee not found")
+        
+        location_id, state, last_event_time = current
+        if location_id != event.location_id:
+            return EventRejected(EventRejected.WRONG_LOCATION, "Employee does not belong to device location")
+        
+        error = ClockLogicService.transition_error(state, last_event_time, event.event_type)
+        if error:
+            return EventRejected(EventRejected.INVALID_TRANSITION, error)
+        
+        return None
+
+    @staticmethod
+    def advance_state(
+        current: Tuple[UUID, str, Optional[datetime]],
+        event: TimeEvent
+    ) -> Tuple[UUID, str, Optional[datetime]]:
+        """
+        (location_id, state, last_event_time) after an accepted event
+        
+        Backdated events are stored but do not change the current state,
+        in which case current is returned unchanged.
+        """
+        location_id, state, last_event_time = current
+        if last_event_time is not None and event.event_time < last_event_time:
+            return current
+        return location_id, ClockLogicService.state_after(event.event_type), event.event_time
+
+    @staticmethod
+    def new_event(
+        employee_id: UUID,
+        device_id: UUID,
+        location_id: UUID,
+        event_type: str,
+        method: str,
+        event_time: Optional[datetime] = None,
+        client_event_id: Optional[UUID] = None
+    ) -> TimeEvent:
+        """Build an unsaved valid time event; naive event times are taken as UTC"""
+        event_time = event_time or datetime.now(timezone.utc)
+        if event_time.tzinfo is None:
+            event_time = event_time.replace(tzinfo=timezone.utc)
+        
+        return TimeEvent(
+            id=uuid.uuid4(),
+            employee_id=employee_id,
+            device_id=device_id,
+            location_id=location_id,
+            event_type=event_type,
+            event_time=event_time,
+            method=method,
+            is_valid=True,
+            client_event_id=client_event_id,
+            created_at=datetime.utcnow()
+        )
+
+    @staticmethod
+    def _recorded(db: Session, client_ids: List[UUID]) -> Dict[UUID, TimeEvent]:
+        """Recorded events by client_event_id"""
+        if not client_ids:
+            return {}
+        return {
+            e.client_event_id: e
+            for e in db.query(TimeEvent).filter(TimeEvent.client_event_id.in_(client_ids))
+        }
+
+    @staticmethod
+    def _check_events(
+        locked: dict,
+        recorded: Dict[UUID, TimeEvent],
+        events: List[TimeEvent]
+    ) -> Tuple[List[TimeEvent], Dict[UUID, TimeEvent], list]:
+        """
+        Check an ordered list of new events against the locked states
+
+        Returns:
+            Tuple of (accepted events, latest event per employee whose state
+            changed, results as returned by record_events)
+        """
+        recorded = dict(recorded)
+        running = {
+            employee_id: (row.location_id, row.state, row.last_event_time)
+            for employee_id, row in locked.items()
+        }
+        latest = {}
+        accepted = []
+        results = []
         
-        return ClockState.CLOCKED_IN, last_event
+        for event in events:
+            original = recorded.get(event.client_event_id) if event.client_event_id else None
+            if original:
+                if original.location_id != event.location_id or original.employee_id != event.employee_id:
+                    results.append((None, EventRejected(
+                        EventRejected.CLIENT_ID_CONFLICT,
+                        "client_event_id already used for another event"
+                    ), False))
+                else:
+                    results.append((original, None, True))
+                continue
+            
+            current = running.get(event.employee_id)
+            error = ClockLogicService.check_event(current, event)
+            if error:
+                results.append((None, error, False))
+                continue
+            
+            accepted.append(event)
+            results.append((event, None, False))
+            if event.client_event_id:
+                recorded[event.client_event_id] = event
+            
+            advanced = ClockLogicService.advance_state(current, event)
+            if advanced is not current:
+                running[event.employee_id] = advanced
+                latest[event.employee_id] = event
+        
+        return accepted, latest, results
+
+    @staticmethod
+    def record_events(db: Session, events: List[TimeEvent]) -> List[Tuple[Optional[TimeEvent], Optional[EventRejected], bool]]:
+        """
+        Validate and insert an ordered list of new events in one transaction
+        
+        The clock state rows of all employees involved are locked first, so
+        concurrent kiosks cannot both clock the same employee in. Transitions
+        are then checked in order in memory, as if the events had been posted
+        one at a time. Accepted events get their local date and are bulk
+        inserted, the clock state rows updated and changes to their days
+        recorded. The caller commits.
+        
+        Events whose client_event_id was already recorded, also by a
+        concurrent request, are not validated again; the original event is
+        returned as a replay, or the event rejected with CLIENT_ID_CONFLICT
+        if the original belongs to another employee.
+        
+        Returns:
+            One (event, error, is_replay) per input, in order: (event, None, False)
+            when created, (original, None, True) for a replay and
+            (None, EventRejected, False) when rejected
+        """
+        if not events:
+            return []
+        
+        locked = ClockLogicService.lock_states(db, list({e.employee_id for e in events}))
+        
+        # Looked up after locking so a concurrent retry sees the committed original
+        client_ids = [e.client_event_id for e in events if e.client_event_id]
+        recorded = ClockLogicService._recorded(db, client_ids)
+        
+        while True:
+            accepted, latest, results = ClockLogicService._check_events(locked, recorded, events)
+            if not accepted:
+                return results
+            
+            timezones = {
+                location_id: pytz.timezone(name)
+                for location_id, name in ClockLogicService.location_timezones(
+                    db, {event.location_id for event in accepted}
+                ).items()
+            }
+            for event in accepted:
+                event.local_date = event.event_time.astimezone(timezones[event.location_id]).date()
+            
+            # The state locks do not cover other employees, so a concurrent
+            # request can still commit one of these client ids. The insert
+            # waits for it, and the events are then checked again against it.
+            columns = [column.key for column in TimeEvent.__table__.columns]
+            savepoint = db.begin_nested()
+            inserted = db.execute(
+                pg_insert(TimeEvent.__table__).on_conflict_do_nothing(
+                    index_elements=[TimeEvent.client_event_id]
+                ).returning(TimeEvent.id),
+                [{column: getattr(event, column) for column in columns} for event in accepted]
+            ).all()
+            if len(inserted) == len(accepted):
+                savepoint.commit()
+                break
+            savepoint.rollback()
+            recorded = ClockLogicService._recorded(db, client_ids)
+        
+        ClockLogicService._upsert_states(db, [
+            (event.employee_id, event.location_id, event)
+            for event in latest.values()
+        ])
+        export_cache.bump_events(db, accepted)
+        
+        return results
+
+    @staticmethod
+    def record_event(
+        db: Session,
+        employee_id: UUID,
+        device_id: UUID,
+        location_id: UUID,
+        event_type: str,
+        method: str,
+        event_time: Optional[datetime] = None,
+        client_event_id: Optional[UUID] = None
+    ) -> Tuple[TimeEvent, bool]:
+        """
+        Validate a clock transition and insert the event atomically
+        
+        The caller commits.
+        
+        Returns:
+            Tuple of (event, is_replay); is_replay is True when client_event_id
+            was already recorded and the original event is returned
+        
+        Raises:
+            EventRejected with the same messages as validate_event
+        """
+        time_event = ClockLogicService.new_event(
+            employee_id, device_id, location_id, event_type, method, event_time, client_event_id
+        )
+        recorded, error, is_replay = ClockLogicService.record_events(db, [time_event])[0]
+        if error:
+            raise error
+        return recorded, is_replay
 
     @staticmethod
     def can_clock_in(db: Session, employee_id: str, location_id: str) -> Tuple[bool, Optional[str]]:
@@ -51,14 +536,12 @@ class ClockLogicService:
         """
         try:
             state, last_event = ClockLogicService.get_employee_state(db, employee_id, location_id)
-            
-            if state == ClockState.CLOCKED_IN:
-                if last_event:
-                    event_time_str = last_event.event_time.strftime("%H:%M")
-                    return False, f"You are already clocked in since {event_time_str}"
-                return False, "You are already clocked in"
-            
-            return True, None
+            error = ClockLogicService.transition_error(
+                state,
+                last_event.event_time if last_event else None,
+                "IN"
+            )
+            return error is None, error
         except ValueError as e:
             return False, str(e)
 
@@ -72,13 +555,12 @@ class ClockLogicService:
         """
         try:
             state, last_event = ClockLogicService.get_employee_state(db, employee_id, location_id)
-            
-            if state == ClockState.CLOCKED_OUT:
-                if last_event:
-                    return False, "You must clock in before clocking out"
-                return False, "You are not clocked in"
-            
-            return True, None
+            error = ClockLogicService.transition_error(
+                state,
+                last_event.event_time if last_event else None,
+                "OUT"
+            )
+            return error is None, error
         except ValueError as e:
             return False, str(e)
 
@@ -107,8 +589,15 @@ class ClockLogicService:
         """
         Recalculate and return employee state (useful after admin corrections)
         """
-        state, _ = ClockLogicService.get_employee_state(db, employee_id, location_id)
-        return state
+        employee = db.query(Employee).filter(
+            Employee.employee_id == employee_id,
+            Employee.location_id == location_id
+        ).first()
+        
+        if not employee:
+            raise ValueError(f"Employee {employee_id} not found")
+        
+        return ClockLogicService.refresh_employee_state(db, employee.id, employee.location_id)
 
 
 clock_logic_service = ClockLogicService()
@@ -0,0 +1,71 @@
+from collections import defaultdict
+from fastapi.encoders import jsonable_encoder
+from typing import Dict, List, Optional, Set
+from uuid import UUID
+import asyncio
+from app.config import settings
+
+
+class ClockEventBus:
+    """
+    In-process fan-out of clock state changes to per-location subscribers
+
+    Each subscriber gets a bounded queue. A subscriber that falls behind has
+    its queue replaced by a single RESYNC message, telling it to reload the
+    snapshot instead of blocking publishers. Publish from the event loop.
+
+    Subscribers only see changes made by the same process; run a single
+    worker, or one per location, for the stream to be complete.
+    """
+
+    def __init__(self):
+        self.queue_size = settings.event_stream_queue_size
+        self._subscribers: Dict[UUID, Set[asyncio.Queue]] = defaultdict(set)
+
+    def subscribe(self, location_id: UUID) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[location_id].add(queue)
+        return queue
+
+    def unsubscribe(self, location_id: UUID, queue: asyncio.Queue) -> None:
+        subscribers = self._subscribers.get(location_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[location_id]
+
+    def has_subscribers(self, location_id: UUID) -> bool:
+        return bool(self._subscribers.get(location_id))
+
+    def publish(self, location_id: UUID, event: str, data: dict) -> None:
+        """Send a message to every subscriber of a location"""
+        message = {"event": event, "data": jsonable_encoder(data)}
+        for queue in list(self._subscribers.get(location_id, ())):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"event": "resync", "data": {}})
+
+    def publish_states(
+        self,
+        location_id: UUID,
+        reason: str,
+        states: List,
+        events: Optional[List] = None
+    ) -> None:
+        """
+        Publish changed employee clock states
+
+        states are rows from ClockLogicService.get_location_states, events
+        the time events that caused the change
+        """
+        self.publish(location_id, "state", {
+            "reason": reason,
+            "events": events or [],
+            "employees": [dict(row._mapping) for row in states]
+        })
+
+
+clock_event_bus = ClockEventBus()
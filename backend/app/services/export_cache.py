@@ -0,0 +1,190 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from datetime import date
+from typing import BinaryIO, Callable, Iterable, List, Optional
+from uuid import UUID
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from app.config import settings
+from app.services.metrics import LatencyHistogram
+
+EXPORT_BUILD_BUCKETS_MS = (10, 50, 100, 500, 1000, 5000, 10000, 30000, 60000)
+PRUNE_INTERVAL_SECONDS = 3600
+
+_CHANGE_SQL = text("""
+    INSERT INTO export_day_changes (location_id, local_date)
+    SELECT DISTINCT location_id, local_date
+    FROM unnest(CAST(:location_ids AS uuid[]), CAST(:local_dates AS date[])) AS t(location_id, local_date)
+""")
+
+_FOLD_SQL = text("""
+    WITH changed AS (
+        DELETE FROM export_day_changes WHERE location_id = :location_id
+        RETURNING location_id, local_date
+    )
+    INSERT INTO export_day_versions (location_id, local_date, version, updated_at)
+    SELECT DISTINCT location_id, local_date, 1, now() AT TIME ZONE 'UTC'
+    FROM changed
+    ORDER BY 1, 2
+    ON CONFLICT (location_id, local_date) DO UPDATE SET
+        version = export_day_versions.version + 1,
+        updated_at = excluded.updated_at
+""")
+
+# Names and the location are part of each row, so renames also invalidate artifacts.
+# Until it is folded, each change counts towards the day's version.
+_FINGERPRINT_SQL = text("""
+    SELECT l.name, l.timezone, l.updated_at,
+        (SELECT max(e.updated_at) FROM employees e WHERE e.location_id = l.id),
+        coalesce(v.version, 0),
+        (SELECT count(*) FROM export_day_changes c WHERE c.location_id = l.id AND c.local_date = :local_date)
+    FROM locations l
+    LEFT JOIN export_day_versions v ON v.location_id = l.id AND v.local_date = :local_date
+    WHERE l.id = :location_id
+""")
+
+
+class ExportCache:
+    """
+    Cache of daily export files keyed by (location, local date, data version)
+
+    Every insert or correction of a time event records a change to the
+    location's local day it falls on, in the same transaction. The hours
+    rollup folds changes into the day's version, and the key counts the
+    changes not folded yet, so a cached file is reused until that day
+    changes. Files live in export_cache_dir,
+    one per location, day and format; a file that has not been used for
+    export_cache_retention_days is deleted.
+    """
+
+    def __init__(self):
+        self.directory = settings.export_cache_dir or os.path.join(tempfile.gettempdir(), "kiosk-export-cache")
+        self._counts = {"hits": 0, "misses": 0}
+        self._last_prune = 0.0
+        self._lock = threading.Lock()
+        self.build_duration = LatencyHistogram(EXPORT_BUILD_BUCKETS_MS)
+
+    @staticmethod
+    def bump(db: Session, location_ids: List[UUID], local_dates: List[date]):
+        """
+        Record changes to the given location days (parallel lists)
+
+        Only appends to export_day_changes, so concurrent writers of the
+        same day do not wait on each other.
+        """
+        if location_ids:
+            db.execute(_CHANGE_SQL, {"location_ids": location_ids, "local_dates": local_dates})
+
+    @staticmethod
+    def fold_changes(db: Session, location_id: UUID):
+        """
+        Bump the versions of a location's changed days and clear its changes
+
+        Locks the version rows until the caller commits; callers serialize
+        per location (see HoursRollupService.refresh).
+        """
+        db.execute(_FOLD_SQL, {"location_id": location_id})
+
+    @staticmethod
+    def bump_events(db: Session, events: Iterable):
+        """Record changes to the local days of time events"""
+        events = list(events)
+        ExportCache.bump(db, [e.location_id for e in events], [e.local_date for e in events])
+
+    def _cache_key(self, db: Session, location_id: UUID, local_date: date) -> Optional[str]:
+        row = db.execute(_FINGERPRINT_SQL, {"location_id": location_id, "local_date": local_date}).first()
+        if row is None:
+            return None
+        name, timezone, updated_at, employees_updated_at, version, changes = row
+        catalog = hashlib.sha1(f"{name}|{timezone}|{updated_at}|{employees_updated_at}".encode()).hexdigest()[:12]
+        return f"{local_date.isoformat()}-v{version}.{changes}-{catalog}"
+
+    def get_file(
+        self,
+        db: Session,
+        location_id: UUID,
+        local_date: date,
+        extension: str,
+        write: Callable[[BinaryIO], None]
+    ) -> str:
+        """
+        Path of the cached export file of a location's day, built by write on a miss
+
+        Each format is cached under its own extension. The version is read
+        before the data, so a file may include changes newer than its
+        version but never lacks any of them.
+
+        Raises:
+            ValueError if the location does not exist
+        """
+        key = self._cache_key(db, location_id, local_date)
+        if key is None:
+            raise ValueError(f"Location {location_id} not found")
+
+        directory = os.path.join(self.directory, str(location_id))
+        path = os.path.join(directory, f"{key}.{extension}")
+        if os.path.exists(path):
+            os.utime(path)
+            with self._lock:
+                self._counts["hits"] += 1
+            return path
+
+        started = time.perf_counter()
+        os.makedirs(directory, exist_ok=True)
+        partial = f"{path}.{threading.get_ident()}.partial"
+        try:
+            with open(partial, "wb") as export_file:
+                write(export_file)
+            os.replace(partial, path)
+        except Exception:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+
+        # Older versions of the day are stale now, in every format
+        prefix = f"{local_date.isoformat()}-"
+        for entry in os.scandir(directory):
+            if entry.name.startswith(prefix) and not entry.name.startswith(f"{key}.") and not entry.name.endswith(".partial"):
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+        with self._lock:
+            self._counts["misses"] += 1
+        self.build_duration.observe(time.perf_counter() - started)
+        self.prune()
+        return path
+
+    def prune(self):
+        """Delete files unused for the retention period, at most once an hour"""
+        now = time.time()
+        with self._lock:
+            if now - self._last_prune < PRUNE_INTERVAL_SECONDS:
+                return
+            self._last_prune = now
+
+        cutoff = now - settings.export_cache_retention_days * 86400
+        try:
+            for location_dir in os.scandir(self.directory):
+                if not location_dir.is_dir():
+                    continue
+                for entry in os.scandir(location_dir.path):
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+        except OSError as e:
+            print(f"Error pruning export cache: {e}")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        return {
+            **counts,
+            "build_duration": self.build_duration.snapshot()
+        }
+
+
+export_cache = ExportCache()
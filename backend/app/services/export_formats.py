@@ -0,0 +1,220 @@
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Sequence
+import csv
+import gzip
+import importlib.util
+import io
+import json
+from app.config import settings
+
+EXPORT_HEADER = [
+    "Date",
+    "Time",
+    "Employee ID",
+    "Employee Name",
+    "Event Type",
+    "Location Name",
+    "Device ID",
+    "Method",
+    "Valid"
+]
+
+# Field names of the self-describing formats, in EXPORT_HEADER order
+EXPORT_FIELDS = [
+    "date",
+    "time",
+    "employee_id",
+    "employee_name",
+    "event_type",
+    "location_name",
+    "device_id",
+    "method",
+    "valid"
+]
+
+
+class ChunkSink(io.RawIOBase):
+    """
+    Write-only binary file that hands out what was written since the last drain
+
+    tell() keeps counting across drains, since the Parquet footer records
+    absolute offsets.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ExportWriter:
+    """
+    Encodes export rows to a binary file
+
+    Rows are tuples in EXPORT_HEADER order, with the date and time as
+    strings and valid as a bool. close() writes any trailer but leaves the
+    file open.
+    """
+
+    def __init__(self, file):
+        self.file = file
+
+    def write_rows(self, rows: Sequence[tuple]):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class CsvWriter(ExportWriter):
+    def __init__(self, file):
+        super().__init__(file)
+        self._output = io.StringIO()
+        self._writer = csv.writer(self._output)
+        self._writer.writerow(EXPORT_HEADER)
+
+    def _encode(self) -> bytes:
+        data = self._output.getvalue().encode("utf-8")
+        self._output.seek(0)
+        self._output.truncate()
+        return data
+
+    def write_rows(self, rows: Sequence[tuple]):
+        self._writer.writerows(
+            (*row[:8], "true" if row[8] else "false")
+            for row in rows
+        )
+        self.file.write(self._encode())
+
+    def close(self):
+        # Writes the header of an empty export
+        if self._output.tell():
+            self.file.write(self._encode())
+
+
+class GzipCsvWriter(CsvWriter):
+    """CSV in a gzip member; mtime is zeroed so the same rows give the same bytes"""
+
+    def __init__(self, file):
+        self._gzip = gzip.GzipFile(fileobj=file, mode="wb", compresslevel=settings.export_gzip_level, mtime=0)
+        super().__init__(self._gzip)
+
+    def close(self):
+        super().close()
+        self._gzip.close()
+
+
+class NdjsonWriter(ExportWriter):
+    """One compact JSON object per line, keyed by EXPORT_FIELDS"""
+
+    _encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+    def write_rows(self, rows: Sequence[tuple]):
+        encode = self._encode
+        self.file.write("".join(
+            encode(dict(zip(EXPORT_FIELDS, row))) + "\n"
+            for row in rows
+        ).encode("utf-8"))
+
+
+class ParquetWriter(ExportWriter):
+    """
+    Parquet with typed columns: date as date32, valid as bool, the rest strings
+
+    Rows are buffered into row groups of export_parquet_row_group_rows, so
+    output only appears once a group is full and at close.
+    """
+
+    def __init__(self, file):
+        super().__init__(file)
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self._schema = pa.schema([
+            (name, pa.date32() if name == "date" else pa.bool_() if name == "valid" else pa.string())
+            for name in EXPORT_FIELDS
+        ])
+        self._writer = pq.ParquetWriter(
+            pa.PythonFile(file, mode="w"),
+            self._schema,
+            compression=settings.export_parquet_compression
+        )
+        self._rows: List[tuple] = []
+
+    def _flush(self):
+        pa = self._pa
+        columns = list(zip(*self._rows))
+        arrays = [
+            pa.array(column, type=pa.string()).cast(field.type) if field.name == "date"
+            else pa.array(column, type=field.type)
+            for column, field in zip(columns, self._schema)
+        ]
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self._schema))
+        self._rows = []
+
+    def write_rows(self, rows: Sequence[tuple]):
+        self._rows.extend(rows)
+        if len(self._rows) >= settings.export_parquet_row_group_rows:
+            self._flush()
+
+    def close(self):
+        if self._rows:
+            self._flush()
+        self._writer.close()
+
+
+@dataclass(frozen=True)
+class ExportFormat:
+    name: str
+    extension: str
+    media_type: str
+    writer: Callable[[io.RawIOBase], ExportWriter]
+    requires: str = ""  # Optional module the writer imports
+
+    @property
+    def available(self) -> bool:
+        return not self.requires or importlib.util.find_spec(self.requires) is not None
+
+
+EXPORT_FORMATS: Dict[str, ExportFormat] = {
+    export_format.name: export_format
+    for export_format in (
+        ExportFormat("csv", "csv", "text/csv", CsvWriter),
+        ExportFormat("csv.gz", "csv.gz", "application/gzip", GzipCsvWriter),
+        ExportFormat("ndjson", "ndjson", "application/x-ndjson", NdjsonWriter),
+        ExportFormat("parquet", "parquet", "application/vnd.apache.parquet", ParquetWriter, requires="pyarrow"),
+    )
+}
+
+
+def get_export_format(name: str) -> ExportFormat:
+    """
+    Export format by name
+
+    Raises:
+        ValueError if the format is unknown or its dependency is not installed
+    """
+    export_format = EXPORT_FORMATS.get(name)
+    if export_format is None:
+        raise ValueError(f"Unknown export format {name!r}")
+    if not export_format.available:
+        raise ValueError(f"Export format {name!r} requires {export_format.requires}, which is not installed")
+    return export_format
@@ -0,0 +1,277 @@
+from sqlalchemy.orm import Session
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Optional, Set
+from uuid import UUID
+import os
+import shutil
+import tempfile
+import threading
+import time
+from app.config import settings
+from app.database import SessionLocal
+from app.models.export_job import ExportJob
+from app.models.location import Location
+from app.services.export_formats import get_export_format
+from app.services.export_service import export_service
+
+
+class ExportJobQueueFullError(Exception):
+    """Raised when too many export jobs are already queued or running"""
+
+
+class ExportJobService:
+    """
+    Runs on-demand exports on a worker pool instead of inside the request
+
+    Job state lives in the export_jobs table so any worker can report it.
+    The export file is written to export_job_dir, which must be shared by the
+    workers serving downloads, so it has no default when web_concurrency
+    is above one. Files and job rows are pruned after
+    export_job_retention_hours. At most export_job_workers jobs run at
+    once and export_job_queue_depth more may wait.
+
+    The process that queued a job renews its heartbeat_at every
+    export_job_heartbeat_seconds until it finishes, so a poll can tell a
+    job waiting its turn from one lost with its process.
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.export_job_workers,
+            thread_name_prefix="export-job"
+        )
+        self.max_in_flight = settings.export_job_workers + settings.export_job_queue_depth
+        self.directory = settings.export_job_dir or os.path.join(tempfile.gettempdir(), "kiosk-exports")
+        self._in_flight = 0
+        self._jobs: Set[UUID] = set()
+        self._heartbeat: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Check the configuration before the API serves requests
+
+        Raises:
+            RuntimeError if several workers would each write to their own temp directory
+        """
+        if settings.web_concurrency > 1 and not settings.export_job_dir:
+            raise RuntimeError(
+                "EXPORT_JOB_DIR must be set to a directory shared by all workers when WEB_CONCURRENCY is above 1"
+            )
+
+    def submit(
+        self,
+        db: Session,
+        location_id: UUID,
+        device_id: Optional[UUID],
+        export_date: date,
+        send_email: bool = True,
+        export_format: str = "csv"
+    ) -> ExportJob:
+        """
+        Create a job row and queue it; the job is committed before it runs
+
+        Raises:
+            ExportJobQueueFullError if the queue is full
+        """
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                raise ExportJobQueueFullError()
+            self._in_flight += 1
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="export-job-heartbeat", daemon=True)
+                self._heartbeat.start()
+
+        try:
+            now = datetime.utcnow()
+            job = ExportJob(
+                location_id=location_id,
+                device_id=device_id,
+                export_date=export_date,
+                export_format=export_format,
+                send_email=send_email,
+                status="QUEUED",
+                created_at=now,
+                heartbeat_at=now
+            )
+            db.add(job)
+            db.commit()
+            with self._lock:
+                self._jobs.add(job.id)
+            self.executor.submit(self._run, job.id)
+        except Exception:
+            with self._lock:
+                self._in_flight -= 1
+            raise
+
+        return job
+
+    def get(self, db: Session, job_id: UUID, location_id: UUID) -> Optional[ExportJob]:
+        """
+        Get a job of a location
+
+        A job running for longer than twice the export timeout, or queued
+        by a process that stopped renewing its heartbeat, is marked failed.
+        """
+        job = db.query(ExportJob).filter(
+            ExportJob.id == job_id,
+            ExportJob.location_id == location_id
+        ).first()
+        if not job:
+            return None
+
+        now = datetime.utcnow()
+        if job.status == "RUNNING":
+            stale = job.started_at < now - timedelta(seconds=2 * settings.export_timeout_seconds)
+        elif job.status == "QUEUED":
+            last_seen = job.heartbeat_at or job.created_at
+            stale = last_seen < now - timedelta(seconds=3 * settings.export_job_heartbeat_seconds)
+        else:
+            stale = False
+
+        if stale:
+            db.query(ExportJob).filter(
+                ExportJob.id == job.id,
+                ExportJob.status == job.status
+            ).update({
+                "status": "FAILED",
+                "error": "Export did not finish",
+                "finished_at": now
+            }, synchronize_session=False)
+            db.commit()
+            db.refresh(job)
+
+        return job
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(settings.export_job_heartbeat_seconds)
+            with self._lock:
+                job_ids = list(self._jobs)
+            if not job_ids:
+                continue
+
+            db = SessionLocal()
+            try:
+                db.query(ExportJob).filter(
+                    ExportJob.id.in_(job_ids),
+                    ExportJob.status.in_(["QUEUED", "RUNNING"])
+                ).update({"heartbeat_at": datetime.utcnow()}, synchronize_session=False)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                print(f"Error renewing export job heartbeats: {e}")
+            finally:
+                db.close()
+
+    def _run(self, job_id: UUID):
+        db = SessionLocal()
+        try:
+            # A job already marked failed by a poll is not brought back
+            started = db.query(ExportJob).filter(
+                ExportJob.id == job_id,
+                ExportJob.status == "QUEUED"
+            ).update({"status": "RUNNING", "started_at": datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+            if not started:
+                return
+
+            job = db.query(ExportJob).filter(ExportJob.id == job_id).first()
+            try:
+                result = self._export(db, job)
+                result["status"] = "SUCCEEDED" if result["error"] is None else "FAILED"
+            except Exception as e:
+                if not db.is_active:
+                    db.rollback()
+                result = {"status": "FAILED", "error": str(e)}
+                print(f"Error in export job {job_id}: {e}")
+
+            result["finished_at"] = datetime.utcnow()
+            finished = db.query(ExportJob).filter(
+                ExportJob.id == job_id,
+                ExportJob.status.in_(["QUEUED", "RUNNING"])
+            ).update(result, synchronize_session=False)
+            db.commit()
+            if not finished and result.get("file_path"):
+                os.remove(result["file_path"])
+        finally:
+            db.close()
+            with self._lock:
+                self._in_flight -= 1
+                self._jobs.discard(job_id)
+
+        self.prune()
+
+    def _export(self, db: Session, job: ExportJob) -> dict:
+        """
+        Give the job its own link to the cached export file and email it if requested
+
+        A link keeps the download working when the cache moves on to a
+        newer version; it is copied when the directories are on different
+        file systems. Returns the file_path, file_size and error to store.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        extension = get_export_format(job.export_format).extension
+        path = os.path.join(self.directory, f"{job.id}.{extension}")
+        cached = export_service.cached_export(db, job.location_id, job.export_date, job.export_format)
+        try:
+            os.link(cached, path)
+        except OSError:
+            shutil.copyfile(cached, path)
+
+        result = {"file_path": path, "file_size": os.path.getsize(path), "error": None}
+
+        # The file stays downloadable, so its path is returned whatever happens to the email
+        if job.send_email:
+            try:
+                location = db.query(Location).filter(Location.id == job.location_id).first()
+                if not location.manager_email:
+                    result["error"] = "Location has no manager email"
+                    return result
+                with open(path, "rb") as export_file:
+                    content = export_file.read()
+                sent = export_service.send_export_email(content, location.manager_email, job.export_date, job.export_format)
+            except Exception as e:
+                print(f"Error emailing export job {job.id}: {e}")
+                db.rollback()
+                sent = False
+            if not sent:
+                result["error"] = "Email could not be sent"
+
+        return result
+
+    def prune(self):
+        """Delete files and rows of jobs finished before the retention period"""
+        cutoff = datetime.utcnow() - timedelta(hours=settings.export_job_retention_hours)
+        db = SessionLocal()
+        try:
+            expired = db.query(ExportJob).filter(
+                ExportJob.status.in_(["SUCCEEDED", "FAILED"]),
+                ExportJob.finished_at < cutoff
+            ).all()
+            for job in expired:
+                if job.file_path:
+                    try:
+                        os.remove(job.file_path)
+                    except FileNotFoundError:
+                        pass
+                db.delete(job)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Error pruning export jobs: {e}")
+        finally:
+            db.close()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            in_flight = self._in_flight
+        return {
+            "workers": settings.export_job_workers,
+            "in_flight": in_flight,
+            "max_in_flight": self.max_in_flight
+        }
+
+
+export_job_service = ExportJobService()
@@ -1,137 +1,181 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
-from datetime import datetime, date, time, timedelta
-from typing import List, Optional
-import csv
-import io
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail, Attachment
+from sqlalchemy import func, literal, select
+from datetime import datetime, date, timedelta
+from typing import BinaryIO, Iterator, Optional, Union
+import tempfile
 from app.models.location import Location
 from app.models.time_event import TimeEvent
 from app.models.employee import Employee
 from app.models.device import Device
-from app.config import settings
+from app.services.export_cache import export_cache
+from app.services.export_formats import ChunkSink, get_export_format
+from app.services.mail_service import mail_queue, MailAttachment, OutboundMail
 import pytz
 from uuid import UUID
 
+EXPORT_BATCH_SIZE = 2000
+EXPORT_SPOOL_BYTES = 8 * 1024 * 1024
+
 
 class ExportService:
-    """Service for generating and emailing CSV exports"""
+    """Service for generating and emailing exports"""
 
-    def __init__(self):
-        self.sendgrid_client = None
-        if settings.sendgrid_api_key:
-            self.sendgrid_client = SendGridAPIClient(settings.sendgrid_api_key)
+    def _export_statement(self, location: Location, start_date: date, end_date: date):
+        """
+        Column projection of a location's events for an inclusive range of local dates
+        
+        Days are matched on the stored local_date, and the index on
+        (location_id, local_date, event_time) returns rows already in time
+        order. Clock times are converted and formatted by the database, and
+        columns come back in EXPORT_HEADER order, so rows go to the writers
+        as they are.
+        """
+        local_time = func.timezone(location.timezone, TimeEvent.event_time)
+        
+        return select(
+            func.to_char(TimeEvent.local_date, "YYYY-MM-DD").label("local_date"),
+            func.to_char(local_time, "HH24:MI:SS").label("local_clock"),
+            Employee.employee_id,
+            Employee.name,
+            TimeEvent.event_type,
+            literal(location.name).label("location_name"),
+            Device.device_id,
+            TimeEvent.method,
+            TimeEvent.is_valid
+        ).join(
+            Employee, Employee.id == TimeEvent.employee_id
+        ).join(
+            Device, Device.id == TimeEvent.device_id
+        ).where(
+            TimeEvent.location_id == location.id,
+            TimeEvent.local_date.between(start_date, end_date)
+        ).order_by(TimeEvent.local_date, TimeEvent.event_time)
 
-    def generate_csv(
+    def iter_export(
         self,
         db: Session,
         location_id: UUID,
-        export_date: date
-    ) -> str:
+        start_date: date,
+        end_date: Optional[date] = None,
+        export_format: str = "csv"
+    ) -> Iterator[bytes]:
         """
-        Generate CSV content for a specific date
+        Generate an export for a local date or inclusive date range, in chunks
         
-        Returns CSV string
+        Runs one projection query read through a server-side cursor and
+        feeds each batch of rows to the format's writer, so memory use
+        stays flat however many events the range holds.
+        
+        Raises:
+            ValueError if the format is unavailable or the location does not exist
         """
-        # Get location with timezone
+        writer_class = get_export_format(export_format).writer
         location = db.query(Location).filter(Location.id == location_id).first()
         if not location:
             raise ValueError(f"Location {location_id} not found")
         
-        tz = pytz.timezone(location.timezone)
+        statement = self._export_statement(location, start_date, end_date or start_date)
+        sink = ChunkSink()
+        writer = writer_class(sink)
+        
+        # Core execution on the session's connection skips ORM row processing
+        result = db.connection().execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        for partition in result.partitions():
+            writer.write_rows(partition)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+        
+        writer.close()
+        chunk = sink.drain()
+        if chunk:
+            yield chunk
+
+    def write_export(
+        self,
+        db: Session,
+        location_id: UUID,
+        start_date: date,
+        end_date: Optional[date] = None,
+        export_format: str = "csv"
+    ) -> BinaryIO:
+        """
+        Write an export to a spooled temporary file
         
-        # Get start and end of day in location timezone
-        start_dt = tz.localize(datetime.combine(export_date, time.min))
-        end_dt = tz.localize(datetime.combine(export_date, time.max))
-        
-        # Convert to UTC for database query
-        start_utc = start_dt.astimezone(pytz.UTC).replace(tzinfo=None)
-        end_utc = end_dt.astimezone(pytz.UTC).replace(tzinfo=None)
-        
-        # Query events
-        events = db.query(TimeEvent).join(Employee).join(Device).filter(
-            and_(
-                TimeEvent.location_id == location_id,
-                TimeEvent.event_time >= start_utc,
-                TimeEvent.event_time <= end_utc
-            )
-        ).order_by(TimeEvent.event_time).all()
-        
-        # Generate CSV
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Header
-        writer.writerow([
-            "Date",
-            "Time",
-            "Employee ID",
-            "Employee Name",
-            "Event Type",
-            "Location Name",
-            "Device ID",
-            "Method",
-            "Valid"
-        ])
-        
-        # Rows
-        for event in events:
-            # Convert to location timezone
-            event_time_local = event.event_time.replace(tzinfo=pytz.UTC).astimezone(tz)
-            
-            writer.writerow([
-                event_time_local.strftime("%Y-%m-%d"),
-                event_time_local.strftime("%H:%M:%S"),
-                event.employee.employee_id,
-                event.employee.name,
-                event.event_type,
-                location.name,
-                event.device.device_id,
-                event.method,
-                str(event.is_valid).lower()
-            ])
-        
-        return output.getvalue()
+        Stays in memory up to EXPORT_SPOOL_BYTES, then moves to disk.
+        Returns the file positioned at the start; the caller closes it.
+        """
+        spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES)
+        try:
+            for chunk in self.iter_export(db, location_id, start_date, end_date, export_format):
+                spool.write(chunk)
+        except Exception:
+            spool.close()
+            raise
+        spool.seek(0)
+        return spool
 
-    def send_csv_email(
+    def cached_export(
         self,
-        csv_content: str,
-        recipient_email: str,
+        db: Session,
+        location_id: UUID,
+        export_date: date,
+        export_format: str = "csv"
+    ) -> str:
+        """
+        Path of the export file for a specific date from the export cache
+        
+        The file is only generated if the day changed since it was cached.
+        """
+        extension = get_export_format(export_format).extension
+        
+        def write(export_file):
+            for chunk in self.iter_export(db, location_id, export_date, export_format=export_format):
+                export_file.write(chunk)
+        
+        return export_cache.get_file(db, location_id, export_date, extension, write)
+
+    def generate_csv(
+        self,
+        db: Session,
+        location_id: UUID,
         export_date: date
+    ) -> str:
+        """
+        Generate CSV content for a specific date
+        
+        Returns CSV string
+        """
+        return b"".join(self.iter_export(db, location_id, export_date)).decode("utf-8")
+
+    def send_export_email(
+        self,
+        content: Union[str, bytes],
+        recipient_email: str,
+        export_date: date,
+        export_format: str = "csv"
     ) -> bool:
         """
-        Send CSV as email attachment via SendGrid
+        Send an export as email attachment through the mail queue
+        
+        Blocks until the mail is delivered or its retries are exhausted,
+        so call it from a worker thread, not the event loop.
         
         Returns True if successful
         """
-        if not self.sendgrid_client:
-            raise ValueError("SendGrid API key not configured")
-        
-        # Create email
-        message = Mail(
-            from_email="noreply@kioskapp.com",  # Configure in settings
-            to_emails=recipient_email,
+        export_format = get_export_format(export_format)
+        mail = OutboundMail(
+            to_email=recipient_email,
             subject=f"Daily Time Event Export - {export_date.strftime('%Y-%m-%d')}",
-            html_content=f"<p>Please find attached the daily time event export for {export_date.strftime('%Y-%m-%d')}.</p>"
+            html_content=f"<p>Please find attached the daily time event export for {export_date.strftime('%Y-%m-%d')}.</p>",
+            attachments=[MailAttachment(
+                filename=f"time_events_{export_date.strftime('%Y%m%d')}.{export_format.extension}",
+                content=content.encode('utf-8') if isinstance(content, str) else content,
+                mime_type=export_format.media_type
+            )]
         )
         
-        # Create attachment
-        encoded_csv = csv_content.encode('utf-8')
-        attachment = Attachment()
-        attachment.file_content = encoded_csv
-        attachment.file_type = "text/csv"
-        attachment.file_name = f"time_events_{export_date.strftime('%Y%m%d')}.csv"
-        attachment.disposition = "attachment"
-        
-        message.add_attachment(attachment)
-        
-        try:
-            response = self.sendgrid_client.send(message)
-            return response.status_code in [200, 201, 202]
-        except Exception as e:
-            print(f"Error sending email: {e}")
-            return False
+        return mail_queue.send_blocking(mail).ok
 
     def export_and_send(
         self,
@@ -149,8 +193,9 @@ class ExportService:
             return False
         
         try:
-            csv_content = self.generate_csv(db, location_id, export_date)
-            return self.send_csv_email(csv_content, location.manager_email, export_date)
+            with open(self.cached_export(db, location_id, export_date), "rb") as csv_file:
+                csv_content = csv_file.read()
+            return self.send_export_email(csv_content, location.manager_email, export_date)
         except Exception as e:
             print(f"Error in export_and_send: {e}")
             return False
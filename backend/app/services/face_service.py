@@ -73,29 +73,31 @@ class FaceService:
         Get all embeddings for a location (decrypted, for device sync)
         Returns list of dicts with employee_id, name, and embedding array
         """
-        employees = db.query(Employee).filter(
+        rows = db.query(
+            Employee.employee_id,
+            Employee.name,
+            FaceEmbedding.embedding_encrypted,
+            FaceEmbedding.encryption_key_id
+        ).join(
+            FaceEmbedding, FaceEmbedding.employee_id == Employee.id
+        ).filter(
             Employee.location_id == location_id,
             Employee.is_active == True
         ).all()
         
         result = []
-        for employee in employees:
-            embedding_record = db.query(FaceEmbedding).filter(
-                FaceEmbedding.employee_id == employee.id
-            ).first()
+        for row in rows:
+            # Decrypt embedding
+            embedding = encryption_service.decrypt_embedding(
+                row.embedding_encrypted,
+                row.encryption_key_id
+            )
             
-            if embedding_record:
-                # Decrypt embedding
-                embedding = encryption_service.decrypt_embedding(
-                    embedding_record.embedding_encrypted,
-                    embedding_record.encryption_key_id
-                )
-                
-                result.append({
-                    "employee_id": employee.employee_id,
-                    "name": employee.name,
-                    "embedding": embedding.tolist()  # Convert to list for JSON
-                })
+            result.append({
+                "employee_id": row.employee_id,
+                "name": row.name,
+                "embedding": embedding.tolist()  # Convert to list for JSON
+            })
         
         return result
 
@@ -0,0 +1,105 @@
+from sqlalchemy import update, bindparam
+from datetime import datetime
+from typing import Dict, Optional
+from uuid import UUID
+import asyncio
+import threading
+from app.config import settings
+from app.database import SessionLocal
+from app.models.device import Device
+
+
+class HeartbeatService:
+    """
+    Write-behind buffer for device last_seen_at timestamps
+
+    Authenticated requests only record the timestamp in memory. The buffer
+    is flushed to the devices table in one batched UPDATE every
+    heartbeat_flush_interval_seconds and on shutdown, which is also the
+    bound on how stale last_seen_at can be in the database.
+    """
+
+    def __init__(self):
+        self.flush_interval = settings.heartbeat_flush_interval_seconds
+        self._pending: Dict[UUID, datetime] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, device_id: UUID, seen_at: Optional[datetime] = None) -> None:
+        """Record that a device was seen"""
+        seen_at = seen_at or datetime.utcnow()
+        with self._lock:
+            current = self._pending.get(device_id)
+            if current is None or seen_at > current:
+                self._pending[device_id] = seen_at
+
+    def last_seen(self, device: Device) -> datetime:
+        """Most recent last_seen_at for a device, including unflushed heartbeats"""
+        with self._lock:
+            pending = self._pending.get(device.id)
+        if pending and pending > device.last_seen_at:
+            return pending
+        return device.last_seen_at
+
+    def flush(self) -> int:
+        """
+        Write all buffered heartbeats in a single batched UPDATE
+
+        Returns the number of devices flushed
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        if not pending:
+            return 0
+
+        devices = Device.__table__
+        statement = update(devices).where(
+            devices.c.id == bindparam("b_id"),
+            devices.c.last_seen_at < bindparam("b_seen_at")
+        ).values(last_seen_at=bindparam("b_seen_at"))
+
+        db = SessionLocal()
+        try:
+            db.execute(statement, [
+                {"b_id": device_id, "b_seen_at": seen_at}
+                for device_id, seen_at in pending.items()
+            ])
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Error flushing device heartbeats: {e}")
+            # Keep the timestamps for the next flush
+            for device_id, seen_at in pending.items():
+                self.record(device_id, seen_at)
+            return 0
+        finally:
+            db.close()
+
+        return len(pending)
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await loop.run_in_executor(None, self.flush)
+
+    def start(self):
+        """Start the periodic flush task on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the periodic flush task and flush what is left"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+
+heartbeat_service = HeartbeatService()
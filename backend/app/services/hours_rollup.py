@@ -0,0 +1,207 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from datetime import date, timedelta
+from typing import List, Tuple
+from uuid import UUID
+import numpy as np
+import threading
+from app.config import settings
+from app.database import SessionLocal
+from app.services.export_cache import export_cache
+from app.services.timesheet_service import timesheet_service
+
+ROLLUP_LOCK_CLASS = 0x726F6C6C  # Advisory lock class, keyed by location within it
+
+
+class HoursRollupService:
+    """
+    Hours worked per location, employee and local day in the hours_rollup table
+
+    Each insert or correction of a time event records a change to its local
+    day in export_day_changes. A refresh folds a location's changes into the
+    versions in export_day_versions, and days whose rollup_version lags
+    behind are recomputed with the timesheet engine. Since a shift can cross midnight,
+    the neighbouring days within timesheet_max_shift_hours are recomputed
+    with them. The scheduler leader refreshes every
+    rollup_refresh_seconds, and readers refresh their location first when
+    it has changed days, so they see their own writes.
+    """
+
+    def __init__(self):
+        self._counts = {"refreshes": 0, "days_refreshed": 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _ranges(days: List[date], span: int) -> List[Tuple[date, date]]:
+        """Merge each day widened by span days into inclusive, disjoint ranges"""
+        ranges = []
+        for day in days:
+            start, end = day - timedelta(days=span), day + timedelta(days=span)
+            if ranges and start <= ranges[-1][1] + timedelta(days=1):
+                ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+            else:
+                ranges.append((start, end))
+        return ranges
+
+    def _rebuild(self, db: Session, location_id: UUID, start_date: date, end_date: date):
+        timesheet = timesheet_service.build(db, location_id, start_date, end_date)
+        open_shifts = timesheet.open_shifts()
+        rows, days = np.nonzero((timesheet.worked_seconds > 0) | (timesheet.shift_counts > 0) | open_shifts)
+
+        db.execute(text("""
+            DELETE FROM hours_rollup
+            WHERE location_id = :location_id AND local_date BETWEEN :start_date AND :end_date
+        """), {"location_id": location_id, "start_date": start_date, "end_date": end_date})
+
+        if len(rows):
+            dates = [d.isoformat() for d in timesheet.days]
+            db.execute(text("""
+                INSERT INTO hours_rollup (location_id, local_date, employee_id, worked_seconds, shift_count, open_shift)
+                SELECT :location_id, r.*
+                FROM unnest(
+                    CAST(:dates AS date[]), CAST(:employee_ids AS uuid[]),
+                    CAST(:worked AS integer[]), CAST(:shifts AS integer[]), CAST(:open AS boolean[])
+                ) AS r
+            """), {
+                "location_id": location_id,
+                "dates": [dates[day] for day in days.tolist()],
+                "employee_ids": [str(timesheet.employees[row][0]) for row in rows.tolist()],
+                "worked": timesheet.worked_seconds[rows, days].tolist(),
+                "shifts": timesheet.shift_counts[rows, days].tolist(),
+                "open": open_shifts[rows, days].tolist()
+            })
+
+    def refresh(self, db: Session, location_id: UUID) -> int:
+        """
+        Recompute the changed days of a location, up to rollup_refresh_max_days
+
+        Serialized per location with a transaction-level advisory lock.
+        The caller commits. Returns the number of changed days.
+        """
+        db.execute(
+            text("SELECT pg_advisory_xact_lock(:lock_class, hashtext(CAST(:location_id AS text)))"),
+            {"lock_class": ROLLUP_LOCK_CLASS, "location_id": location_id}
+        )
+        return self._refresh_locked(db, location_id)
+
+    def refresh_if_pending(self, db: Session, location_id: UUID) -> bool:
+        """
+        Bring a location up to date before a read, if it has changed days
+
+        The check reads the change log and the partial pending index, so
+        reads of an up to date location take no lock and write nothing. A refresh already
+        running elsewhere is not waited for. Commits. Returns False if
+        changed days are left for the scheduler refresh.
+        """
+        pending = db.execute(text("""
+            SELECT EXISTS (
+                SELECT 1 FROM export_day_changes WHERE location_id = :location_id
+            ) OR EXISTS (
+                SELECT 1 FROM export_day_versions
+                WHERE location_id = :location_id AND rollup_version IS DISTINCT FROM version
+            )
+        """), {"location_id": location_id}).scalar()
+        if not pending:
+            db.commit()
+            return True
+
+        locked = db.execute(
+            text("SELECT pg_try_advisory_xact_lock(:lock_class, hashtext(CAST(:location_id AS text)))"),
+            {"lock_class": ROLLUP_LOCK_CLASS, "location_id": location_id}
+        ).scalar()
+        if not locked:
+            db.commit()
+            return False
+
+        self._refresh_locked(db, location_id)
+        db.commit()
+        return True
+
+    def _refresh_locked(self, db: Session, location_id: UUID) -> int:
+        export_cache.fold_changes(db, location_id)
+        pending = db.execute(text("""
+            SELECT local_date, version
+            FROM export_day_versions
+            WHERE location_id = :location_id AND rollup_version IS DISTINCT FROM version
+            ORDER BY local_date
+            LIMIT :limit
+        """), {"location_id": location_id, "limit": settings.rollup_refresh_max_days}).all()
+        if not pending:
+            return 0
+
+        span = settings.timesheet_max_shift_hours // 24 + 1
+        for start_date, end_date in self._ranges([row.local_date for row in pending], span):
+            self._rebuild(db, location_id, start_date, end_date)
+
+        # A day bumped again since it was read stays pending
+        db.execute(text("""
+            UPDATE export_day_versions v
+            SET rollup_version = p.version
+            FROM unnest(CAST(:dates AS date[]), CAST(:versions AS bigint[])) AS p(local_date, version)
+            WHERE v.location_id = :location_id AND v.local_date = p.local_date
+        """), {
+            "location_id": location_id,
+            "dates": [row.local_date for row in pending],
+            "versions": [row.version for row in pending]
+        })
+
+        with self._lock:
+            self._counts["refreshes"] += 1
+            self._counts["days_refreshed"] += len(pending)
+        return len(pending)
+
+    def refresh_all(self):
+        """Refresh every location with changed days, each in its own transaction"""
+        db = SessionLocal()
+        try:
+            location_ids = db.scalars(text("""
+                SELECT location_id FROM export_day_versions WHERE rollup_version IS DISTINCT FROM version
+                UNION
+                SELECT DISTINCT location_id FROM export_day_changes
+            """)).all()
+            for location_id in location_ids:
+                try:
+                    self.refresh(db, location_id)
+                    db.commit()
+                except Exception as e:
+                    db.rollback()
+                    print(f"Error refreshing hours rollup for location {location_id}: {e}")
+        finally:
+            db.close()
+
+    @staticmethod
+    def employee_totals(db: Session, location_id: UUID, start_date: date, end_date: date) -> List:
+        """Rows with employee_id, name, worked_seconds, shift_count and open_shift per employee"""
+        return db.execute(text("""
+            SELECT e.employee_id, e.name,
+                sum(r.worked_seconds) AS worked_seconds,
+                sum(r.shift_count) AS shift_count,
+                bool_or(r.open_shift) AS open_shift
+            FROM hours_rollup r
+            JOIN employees e ON e.id = r.employee_id
+            WHERE r.location_id = :location_id AND r.local_date BETWEEN :start_date AND :end_date
+            GROUP BY e.id, e.employee_id, e.name
+            ORDER BY e.name
+        """), {"location_id": location_id, "start_date": start_date, "end_date": end_date}).all()
+
+    @staticmethod
+    def daily_totals(db: Session, location_id: UUID, start_date: date, end_date: date) -> List:
+        """Rows with local_date, worked_seconds, shift_count, employee_count and open_shifts per day"""
+        return db.execute(text("""
+            SELECT local_date,
+                sum(worked_seconds) AS worked_seconds,
+                sum(shift_count) AS shift_count,
+                count(*) FILTER (WHERE worked_seconds > 0) AS employee_count,
+                count(*) FILTER (WHERE open_shift) AS open_shifts
+            FROM hours_rollup
+            WHERE location_id = :location_id AND local_date BETWEEN :start_date AND :end_date
+            GROUP BY local_date
+            ORDER BY local_date
+        """), {"location_id": location_id, "start_date": start_date, "end_date": end_date}).all()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+
+hours_rollup_service = HoursRollupService()
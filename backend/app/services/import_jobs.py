@@ -0,0 +1,233 @@
+from sqlalchemy.orm import Session
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from datetime import datetime, timedelta
+from typing import BinaryIO, Optional, Set
+from uuid import UUID
+import asyncio
+import io
+import threading
+import time
+from app.config import settings
+from app.database import SessionLocal
+from app.models.import_job import ImportJob
+from app.services.event_bus import clock_event_bus
+from app.services.import_service import import_service
+from app.services.ingest_queue import ingest_queue
+
+REPORT_MAX_ROWS = 1000
+
+
+class ImportJobQueueFullError(Exception):
+    """Raised when too many import jobs are already queued or running"""
+
+
+class ImportJobService:
+    """
+    Runs bulk CSV imports on a worker pool instead of inside the request
+
+    Job state and the import report live in the import_jobs table so any
+    worker can report them; job rows are pruned after
+    import_job_retention_hours. The upload stays with the process that
+    received it, which renews the job's heartbeat_at every
+    import_job_heartbeat_seconds until it finishes, so a poll can tell a
+    job lost with its process. At most import_job_workers jobs run at
+    once and import_job_queue_depth more may wait.
+
+    A job's import and its final status are committed together.
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.import_job_workers,
+            thread_name_prefix="import-job"
+        )
+        self.max_in_flight = settings.import_job_workers + settings.import_job_queue_depth
+        self._in_flight = 0
+        self._jobs: Set[UUID] = set()
+        self._heartbeat: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        db: Session,
+        location_id: UUID,
+        device_id: Optional[UUID],
+        upload: BinaryIO,
+        dry_run: bool = False
+    ) -> ImportJob:
+        """
+        Create a job row and queue it; the job is committed before it runs
+
+        Call from the event loop. The job takes over the upload, a binary
+        CSV file positioned at its start, and closes it.
+
+        Raises:
+            ImportJobQueueFullError if the queue is full
+        """
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                raise ImportJobQueueFullError()
+            self._in_flight += 1
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="import-job-heartbeat", daemon=True)
+                self._heartbeat.start()
+        self._loop = asyncio.get_running_loop()
+
+        try:
+            now = datetime.utcnow()
+            job = ImportJob(
+                location_id=location_id,
+                device_id=device_id,
+                dry_run=dry_run,
+                status="QUEUED",
+                created_at=now,
+                heartbeat_at=now
+            )
+            db.add(job)
+            db.commit()
+            with self._lock:
+                self._jobs.add(job.id)
+            self.executor.submit(self._run, job.id, upload)
+        except Exception:
+            with self._lock:
+                self._in_flight -= 1
+            raise
+
+        return job
+
+    def get(self, db: Session, job_id: UUID, location_id: UUID) -> Optional[ImportJob]:
+        """
+        Get a job of a location
+
+        A job whose process stopped renewing its heartbeat is marked failed.
+        """
+        job = db.query(ImportJob).filter(
+            ImportJob.id == job_id,
+            ImportJob.location_id == location_id
+        ).first()
+        if not job:
+            return None
+
+        now = datetime.utcnow()
+        last_seen = job.heartbeat_at or job.created_at
+        if job.status in ("QUEUED", "RUNNING") and last_seen < now - timedelta(seconds=3 * settings.import_job_heartbeat_seconds):
+            db.query(ImportJob).filter(
+                ImportJob.id == job.id,
+                ImportJob.status == job.status
+            ).update({
+                "status": "FAILED",
+                "error": "Import did not finish",
+                "finished_at": now
+            }, synchronize_session=False)
+            db.commit()
+            db.refresh(job)
+
+        return job
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(settings.import_job_heartbeat_seconds)
+            with self._lock:
+                job_ids = list(self._jobs)
+            if not job_ids:
+                continue
+
+            db = SessionLocal()
+            try:
+                db.query(ImportJob).filter(
+                    ImportJob.id.in_(job_ids),
+                    ImportJob.status.in_(["QUEUED", "RUNNING"])
+                ).update({"heartbeat_at": datetime.utcnow()}, synchronize_session=False)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                print(f"Error renewing import job heartbeats: {e}")
+            finally:
+                db.close()
+
+    def _run(self, job_id: UUID, upload: BinaryIO):
+        db = SessionLocal()
+        csv_file = io.TextIOWrapper(upload, encoding="utf-8-sig", newline="")
+        try:
+            # A job already marked failed by a poll is not brought back
+            started = db.query(ImportJob).filter(
+                ImportJob.id == job_id,
+                ImportJob.status == "QUEUED"
+            ).update({"status": "RUNNING", "started_at": datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+            if not started:
+                return
+
+            job = db.query(ImportJob).filter(ImportJob.id == job_id).first()
+            location_id, dry_run = job.location_id, job.dry_run
+            try:
+                report = import_service.import_csv(
+                    db, location_id, csv_file, job.device_id, REPORT_MAX_ROWS, dry_run=dry_run
+                )
+                if dry_run:
+                    db.rollback()
+                result = {"status": "SUCCEEDED", "report": asdict(report)}
+            except Exception as e:
+                db.rollback()
+                report = None
+                result = {"status": "FAILED", "error": str(e)}
+                if not isinstance(e, ValueError):
+                    print(f"Error in import job {job_id}: {e}")
+
+            result["finished_at"] = datetime.utcnow()
+            finished = db.query(ImportJob).filter(
+                ImportJob.id == job_id,
+                ImportJob.status == "RUNNING"
+            ).update(result, synchronize_session=False)
+            if not finished:
+                # Reported failed meanwhile, so nothing is imported either
+                db.rollback()
+                return
+            db.commit()
+
+            if report and report.imported and not dry_run:
+                self._loop.call_soon_threadsafe(self._imported, location_id)
+        finally:
+            csv_file.close()
+            db.close()
+            with self._lock:
+                self._in_flight -= 1
+                self._jobs.discard(job_id)
+
+        self.prune()
+
+    @staticmethod
+    def _imported(location_id: UUID):
+        # Cached clock states predate the imported history
+        ingest_queue.invalidate_all()
+        clock_event_bus.publish(location_id, "resync", {})
+
+    def prune(self):
+        """Delete rows of jobs finished before the retention period"""
+        cutoff = datetime.utcnow() - timedelta(hours=settings.import_job_retention_hours)
+        db = SessionLocal()
+        try:
+            db.query(ImportJob).filter(
+                ImportJob.status.in_(["SUCCEEDED", "FAILED"]),
+                ImportJob.finished_at < cutoff
+            ).delete(synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Error pruning import jobs: {e}")
+        finally:
+            db.close()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            in_flight = self._in_flight
+        return {
+            "workers": settings.import_job_workers,
+            "in_flight": in_flight,
+            "max_in_flight": self.max_in_flight
+        }
+
+
+import_job_service = ImportJobService()
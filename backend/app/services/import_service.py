@@ -0,0 +1,389 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, TextIO
+from uuid import UUID
+import csv
+import io
+from app.models.device import Device
+from app.models.employee import Employee
+from app.models.location import Location
+from app.services.clock_logic import clock_logic_service
+
+REQUIRED_COLUMNS = {"employee_id", "event_type", "event_time"}
+COPY_BATCH_ROWS = 5000
+DEFAULT_METHOD = "IMPORT"
+
+STAGING_COLUMNS = [
+    "line_no", "employee_code", "event_type", "raw_time", "event_time",
+    "local_time", "method", "employee_id", "device_id", "status", "error"
+]
+
+
+@dataclass
+class ImportReport:
+    total: int = 0
+    imported: int = 0
+    duplicate: int = 0
+    rejected: int = 0
+    rejected_rows: List[dict] = field(default_factory=list)
+
+
+class _CopyStream:
+    """File-like object over an iterator of text chunks, for COPY FROM STDIN"""
+
+    def __init__(self, chunks: Iterator[str]):
+        self._chunks = chunks
+        self._buffer = ""
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+class ImportService:
+    """
+    Bulk import of historical time events from a CSV file
+
+    The CSV needs employee_id (the employee's badge id), event_type (IN or
+    OUT) and event_time (ISO 8601; times without an offset are local to
+    the location) columns, and may have device_id and method. Rows are
+    streamed into a temporary staging table with COPY, checked against the
+    existing history set-wise and merged with one INSERT ... SELECT. The
+    clock state locks that serialize the merge against live punches are
+    only taken for the merge itself.
+    """
+
+    def _staging_chunks(
+        self,
+        rows: Iterator[dict],
+        employees: Dict[str, UUID],
+        devices: Dict[str, UUID],
+        default_device_id: Optional[UUID],
+        report: ImportReport
+    ) -> Iterator[str]:
+        """Resolve and pre-validate CSV rows, yielding COPY csv chunks"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        for line_no, row in enumerate(rows, start=2):
+            report.total += 1
+            employee_code = (row.get("employee_id") or "").strip()
+            event_type = (row.get("event_type") or "").strip().upper()
+            raw_time = (row.get("event_time") or "").strip()
+            device_code = (row.get("device_id") or "").strip()
+            method = (row.get("method") or "").strip().upper() or DEFAULT_METHOD
+
+            event_time = local_time = None
+            error = None
+            employee_id = employees.get(employee_code)
+            device_id = devices.get(device_code) if device_code else default_device_id
+
+            if employee_id is None:
+                error = f"Unknown employee {employee_code!r}"
+            elif device_id is None:
+                error = f"Unknown device {device_code!r}" if device_code else "No device given"
+            elif event_type not in ("IN", "OUT"):
+                error = f"Invalid event type: {event_type}"
+            else:
+                try:
+                    parsed = datetime.fromisoformat(raw_time)
+                    if parsed.tzinfo is None:
+                        local_time = parsed.isoformat()
+                    else:
+                        event_time = parsed.isoformat()
+                except ValueError:
+                    error = f"Invalid event time {raw_time!r}"
+
+            writer.writerow([
+                line_no, employee_code, event_type, raw_time, event_time, local_time, method,
+                employee_id, device_id, "REJECTED" if error else None, error
+            ])
+
+            if report.total % COPY_BATCH_ROWS == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+        yield buffer.getvalue()
+
+    def _create_staging_table(self, db: Session):
+        db.execute(text("""
+            CREATE TEMPORARY TABLE import_staging (
+                line_no bigint PRIMARY KEY,
+                employee_code text,
+                event_type text,
+                raw_time text,
+                event_time timestamptz,
+                local_time timestamp,
+                method text,
+                employee_id uuid,
+                device_id uuid,
+                status text,
+                error text
+            ) ON COMMIT DROP
+        """))
+
+    def _copy_into_staging(self, db: Session, chunks: Iterator[str]):
+        cursor = db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY import_staging ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                _CopyStream(chunks)
+            )
+        finally:
+            cursor.close()
+        db.execute(text("ANALYZE import_staging"))
+
+    def _validate_staging(self, db: Session, location: Location):
+        """
+        Mark duplicate and rejected staging rows
+
+        Each employee's accepted rows and existing valid events are merged in
+        time order and split into runs of the same event type. A valid
+        history keeps exactly one event per run, starting with IN, so within
+        a run the existing event wins, or else the earliest imported row.
+        Leading OUT runs have nothing to close.
+        """
+        db.execute(text("""
+            UPDATE import_staging
+            SET event_time = local_time AT TIME ZONE :timezone
+            WHERE status IS NULL AND event_time IS NULL
+        """), {"timezone": location.timezone})
+
+        db.execute(text("""
+            UPDATE import_staging s
+            SET status = 'DUPLICATE', error = 'Already recorded'
+            FROM time_events te
+            WHERE s.status IS NULL
+              AND te.employee_id = s.employee_id
+              AND te.event_time = s.event_time
+              AND te.event_type = s.event_type
+              AND te.is_valid
+        """))
+
+        db.execute(text("""
+            WITH merged AS (
+                SELECT line_no, employee_id, event_time, event_type, 0 AS existing
+                FROM import_staging
+                WHERE status IS NULL
+                UNION ALL
+                SELECT NULL, te.employee_id, te.event_time, te.event_type, 1
+                FROM time_events te
+                WHERE te.is_valid
+                  AND te.employee_id IN (SELECT employee_id FROM import_staging WHERE status IS NULL)
+            ),
+            starts AS (
+                SELECT *,
+                    CASE WHEN event_type = lag(event_type, 1, 'OUT') OVER w THEN 0 ELSE 1 END AS run_start
+                FROM merged
+                WINDOW w AS (PARTITION BY employee_id ORDER BY event_time, existing DESC, line_no)
+            ),
+            runs AS (
+                SELECT *,
+                    sum(run_start) OVER (
+                        PARTITION BY employee_id ORDER BY event_time, existing DESC, line_no
+                        ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+                    ) AS run_no
+                FROM starts
+            ),
+            ranked AS (
+                SELECT *,
+                    max(existing) OVER (PARTITION BY employee_id, run_no) AS run_has_existing,
+                    row_number() OVER (
+                        PARTITION BY employee_id, run_no ORDER BY event_time, existing DESC, line_no
+                    ) AS run_position
+                FROM runs
+            )
+            UPDATE import_staging s
+            SET status = 'REJECTED',
+                error = CASE
+                    WHEN r.run_no = 0 THEN 'OUT without a preceding IN'
+                    WHEN r.run_has_existing = 1 THEN 'Repeats the ' || r.event_type || ' of an existing event'
+                    ELSE 'Repeats the ' || r.event_type || ' of an earlier row'
+                END
+            FROM ranked r
+            WHERE r.existing = 0
+              AND s.line_no = r.line_no
+              AND (r.run_no = 0 OR r.run_has_existing = 1 OR r.run_position > 1)
+        """))
+
+    @staticmethod
+    def _state_versions(db: Session, employee_ids: List[UUID]) -> Dict[UUID, datetime]:
+        """When the clock state of each employee with events last changed"""
+        return dict(db.execute(text("""
+            SELECT employee_id, updated_at
+            FROM employee_clock_state
+            WHERE employee_id = ANY(CAST(:employee_ids AS uuid[])) AND last_event_time IS NOT NULL
+        """), {"employee_ids": employee_ids}).all())
+
+    @staticmethod
+    def _reset_validation(db: Session):
+        """Clear what _validate_staging marked; rows rejected while staging have no event time"""
+        db.execute(text("""
+            UPDATE import_staging SET status = NULL, error = NULL
+            WHERE status IS NOT NULL AND event_time IS NOT NULL
+        """))
+
+    def _merge_staging(self, db: Session, location: Location) -> int:
+        """
+        Insert accepted rows, refresh the clock state of their employees
+        and bump the export versions of the days they fall on
+        """
+        result = db.execute(text("""
+            INSERT INTO time_events (
+                id, employee_id, device_id, location_id, event_type,
+                event_time, local_date, method, is_valid, created_at
+            )
+            SELECT gen_random_uuid(), employee_id, device_id, :location_id, event_type,
+                event_time, timezone(:timezone, event_time)::date, method, true, now() AT TIME ZONE 'UTC'
+            FROM import_staging
+            WHERE status IS NULL
+        """), {"location_id": location.id, "timezone": location.timezone})
+
+        db.execute(text("""
+            INSERT INTO employee_clock_state (
+                employee_id, location_id, state, last_event_id,
+                last_event_time, last_event_type, device_id, updated_at
+            )
+            SELECT DISTINCT ON (te.employee_id)
+                te.employee_id,
+                te.location_id,
+                CASE WHEN te.event_type = 'OUT' THEN 'CLOCKED_OUT' ELSE 'CLOCKED_IN' END,
+                te.id,
+                te.event_time,
+                te.event_type,
+                te.device_id,
+                now() AT TIME ZONE 'UTC'
+            FROM time_events te
+            WHERE te.is_valid
+              AND te.employee_id IN (SELECT employee_id FROM import_staging WHERE status IS NULL)
+            ORDER BY te.employee_id, te.event_time DESC
+            ON CONFLICT (employee_id) DO UPDATE SET
+                location_id = excluded.location_id,
+                state = excluded.state,
+                last_event_id = excluded.last_event_id,
+                last_event_time = excluded.last_event_time,
+                last_event_type = excluded.last_event_type,
+                device_id = excluded.device_id,
+                updated_at = excluded.updated_at
+        """))
+
+        db.execute(text("""
+            INSERT INTO export_day_versions (location_id, local_date, version, updated_at)
+            SELECT DISTINCT :location_id, timezone(:timezone, event_time)::date, 1, now() AT TIME ZONE 'UTC'
+            FROM import_staging
+            WHERE status IS NULL
+            ORDER BY 2
+            ON CONFLICT (location_id, local_date) DO UPDATE SET
+                version = export_day_versions.version + 1,
+                updated_at = excluded.updated_at
+        """), {"location_id": location.id, "timezone": location.timezone})
+
+        return result.rowcount
+
+    def import_csv(
+        self,
+        db: Session,
+        location_id: UUID,
+        csv_file: TextIO,
+        default_device_id: Optional[UUID] = None,
+        max_report_rows: Optional[int] = None,
+        dry_run: bool = False
+    ) -> ImportReport:
+        """
+        Import time events for a location from a CSV file
+
+        Rows without a device_id column value are attributed to
+        default_device_id. Rows already recorded are counted as duplicates,
+        so re-running an import is safe. Rejected rows are skipped and
+        listed in the report (up to max_report_rows). A dry run only
+        validates, without taking any locks. The caller commits.
+
+        Validation runs before the clock states of the employees are
+        locked, and is repeated under the locks if any of them changed in
+        the meantime.
+
+        Raises:
+            ValueError if the location does not exist or required columns are missing
+        """
+        location = db.query(Location).filter(Location.id == location_id).first()
+        if not location:
+            raise ValueError(f"Location {location_id} not found")
+
+        # Large files outlast the statement timeout meant for requests
+        db.execute(text("SET LOCAL statement_timeout = 0"))
+
+        reader = csv.DictReader(csv_file)
+        missing = REQUIRED_COLUMNS - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"Missing CSV columns: {', '.join(sorted(missing))}")
+
+        employees = dict(db.query(Employee.employee_id, Employee.id).filter(
+            Employee.location_id == location_id
+        ).all())
+        devices = dict(db.query(Device.device_id, Device.id).filter(
+            Device.location_id == location_id
+        ).all())
+
+        report = ImportReport()
+        self._create_staging_table(db)
+        self._copy_into_staging(
+            db,
+            self._staging_chunks(reader, employees, devices, default_device_id, report)
+        )
+
+        employee_ids = db.scalars(text(
+            "SELECT DISTINCT employee_id FROM import_staging WHERE status IS NULL"
+        )).all()
+        versions = self._state_versions(db, employee_ids)
+        self._validate_staging(db, location)
+
+        if dry_run:
+            report.imported = db.execute(text("SELECT count(*) FROM import_staging WHERE status IS NULL")).scalar()
+        else:
+            # Serializes against live punches for these employees until commit
+            if employee_ids:
+                clock_logic_service.lock_states(db, employee_ids)
+                if self._state_versions(db, employee_ids) != versions:
+                    self._reset_validation(db)
+                    self._validate_staging(db, location)
+            report.imported = self._merge_staging(db, location)
+
+        counts = dict(db.execute(text(
+            "SELECT status, count(*) FROM import_staging WHERE status IS NOT NULL GROUP BY status"
+        )).all())
+        report.duplicate = counts.get("DUPLICATE", 0)
+        report.rejected = counts.get("REJECTED", 0)
+
+        query = """
+            SELECT line_no, employee_code, event_type, raw_time, error
+            FROM import_staging
+            WHERE status = 'REJECTED'
+            ORDER BY line_no
+        """
+        if max_report_rows is not None:
+            query += f" LIMIT {int(max_report_rows)}"
+        report.rejected_rows = [
+            {
+                "line": row.line_no,
+                "employee_id": row.employee_code,
+                "event_type": row.event_type,
+                "event_time": row.raw_time,
+                "error": row.error
+            }
+            for row in db.execute(text(query))
+        ]
+
+        return report
+
+
+import_service = ImportService()
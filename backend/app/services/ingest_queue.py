@@ -0,0 +1,516 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+from app.config import settings
+from app.database import SessionLocal
+from app.models.time_event import TimeEvent
+from app.services.clock_logic import clock_logic_service, EventRejected
+from app.services.event_bus import clock_event_bus
+from app.services.metrics import LatencyHistogram
+
+
+class IngestQueueFullError(Exception):
+    """Raised when too many accepted punches are still waiting to be written"""
+
+
+class IngestTimeoutError(Exception):
+    """Raised when a punch was not acknowledged within ingest_submit_timeout_seconds"""
+
+
+JOURNAL_COLUMNS = [
+    "id", "employee_id", "device_id", "location_id", "event_type",
+    "event_time", "method", "client_event_id", "created_at"
+]
+UUID_COLUMNS = {"id", "employee_id", "device_id", "location_id", "client_event_id"}
+DATETIME_COLUMNS = {"event_time", "created_at"}
+
+
+class IngestQueue:
+    """
+    Group-commit ingest path for time events (INGEST_MODE=queued)
+
+    Punches are validated against an in-memory copy of each employee's
+    clock state, which includes punches not written yet, and acknowledged
+    without a Postgres transaction of their own. A background writer
+    inserts them with ClockLogicService.record_events, which validates
+    again under the state row locks, in groups of ingest_flush_max_events
+    or every ingest_flush_interval_ms.
+
+    ingest_durability decides when a punch is acknowledged:
+      database - after its group commit to Postgres
+      full     - after it is appended to the SQLite journal and fsynced
+      normal   - after it is appended to the journal (WAL, synchronous=NORMAL);
+                 survives a process crash but not a power loss
+
+    Journaled punches are written on the next startup if the process dies
+    first. Failed writes are retried with exponential backoff, and the
+    events of a failed group are then written one at a time; an event
+    that still fails on its own after ingest_write_max_attempts is
+    rejected so the punches behind it are not held up. Punches the writer
+    rejects after they were acknowledged (also possible if another process
+    changed the state) are kept in the journal's rejected_events table.
+    The cached state assumes this process is the only one recording
+    punches, so run a single worker in this mode.
+    """
+
+    def __init__(self):
+        self.enabled = settings.ingest_mode == "queued"
+        self.durability = settings.ingest_durability
+        self.max_batch = settings.ingest_flush_max_events
+        self.flush_interval = settings.ingest_flush_interval_ms / 1000.0
+        self.max_pending = settings.ingest_queue_max_pending
+        self.journal_path = settings.ingest_journal_path or _default_journal_path()
+        self.max_attempts = settings.ingest_write_max_attempts
+        self.submit_timeout = settings.ingest_submit_timeout_seconds
+        self.retry_base = settings.ingest_retry_base_ms / 1000.0
+        self.retry_max = settings.ingest_retry_max_seconds
+
+        self._states: Dict[UUID, Tuple] = {}
+        self._client_ids: Dict[UUID, Tuple[TimeEvent, asyncio.Future]] = {}  # Unwritten events and their acknowledgements
+        self._journal_buffer: List[Tuple[TimeEvent, asyncio.Future]] = []
+        self._queue: List[Tuple[TimeEvent, Optional[asyncio.Future]]] = []
+        self._pending = 0
+        self._written = 0
+        self._rejected = 0
+        self._failures = 0  # Consecutive failed writes
+        self._isolate = 0  # Events of a failed group still to write one at a time
+        self._attempts: Dict[UUID, int] = {}
+
+        self._journal: Optional[sqlite3.Connection] = None
+        self._journal_lock = threading.Lock()
+        self._journal_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-journal")
+        self._writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-writer")
+        self._journal_task: Optional[asyncio.Task] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self.flush_latency = LatencyHistogram()
+
+    async def submit(self, db: AsyncSession, event: TimeEvent) -> Tuple[TimeEvent, bool]:
+        """
+        Validate a new event and queue it for the writer
+
+        Returns:
+            Tuple of (event, is_replay), like ClockLogicService.record_event
+
+        Raises:
+            EventRejected, IngestQueueFullError when the queue is full, or
+            IngestTimeoutError when the punch is not acknowledged in time;
+            it stays queued, and a retry with the same client_event_id
+            waits for the same acknowledgement
+        """
+        original = None
+        if event.client_event_id and event.client_event_id not in self._client_ids:
+            original = await db.run_sync(_find_by_client_event_id, event.client_event_id)
+
+        if event.employee_id not in self._states:
+            loaded = await db.run_sync(clock_logic_service.get_states, [event.employee_id])
+            if event.employee_id in loaded:
+                self._states.setdefault(event.employee_id, loaded[event.employee_id])
+
+        # No awaits from here until the event is queued, so the cached
+        # state is checked and updated atomically on the event loop
+        acknowledgement = None
+        if event.client_event_id and event.client_event_id in self._client_ids:
+            original, acknowledgement = self._client_ids[event.client_event_id]
+        if original:
+            if original.location_id != event.location_id or original.employee_id != event.employee_id:
+                raise EventRejected(
+                    EventRejected.CLIENT_ID_CONFLICT,
+                    "client_event_id already used for another event"
+                )
+            if acknowledgement is not None:
+                # Not a replay until the original is acknowledged
+                original, _ = await self._acknowledged(acknowledgement)
+            return original, True
+
+        if self._pending >= self.max_pending:
+            raise IngestQueueFullError()
+
+        current = self._states.get(event.employee_id)
+        error = clock_logic_service.check_event(current, event)
+        if error:
+            raise error
+
+        future = asyncio.get_running_loop().create_future()
+        self._states[event.employee_id] = clock_logic_service.advance_state(current, event)
+        if event.client_event_id:
+            self._client_ids[event.client_event_id] = (event, future)
+        self._pending += 1
+
+        if self.durability == "database":
+            self._enqueue(event, future)
+        else:
+            self._journal_buffer.append((event, future))
+            if self._journal_task is None or self._journal_task.done():
+                self._journal_task = asyncio.get_running_loop().create_task(self._append_journal())
+
+        return await self._acknowledged(future)
+
+    async def _acknowledged(self, future: asyncio.Future) -> Tuple[TimeEvent, bool]:
+        """Outcome of a submitted event; a timeout leaves the future to its retries"""
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self.submit_timeout)
+        except asyncio.TimeoutError:
+            raise IngestTimeoutError()
+
+    def invalidate(self, employee_id: UUID) -> None:
+        """Forget the cached state of an employee, e.g. after an admin correction"""
+        self._states.pop(employee_id, None)
+
+    def invalidate_all(self) -> None:
+        """Forget all cached states, e.g. after a bulk import"""
+        self._states.clear()
+
+    def _discard(self, event: TimeEvent) -> None:
+        """Undo the cached effects of an event that will not be written"""
+        self._states.pop(event.employee_id, None)
+        self._forget_client_id(event)
+
+    def _forget_client_id(self, event: TimeEvent) -> None:
+        if event.client_event_id and self._client_ids.get(event.client_event_id, (None,))[0] is event:
+            del self._client_ids[event.client_event_id]
+
+    def _enqueue(self, event: TimeEvent, future: Optional[asyncio.Future]) -> None:
+        self._queue.append((event, future))
+        if len(self._queue) >= self.max_batch:
+            self._wakeup.set()
+
+    async def _append_journal(self):
+        """Append buffered events to the journal, one fsync per group"""
+        loop = asyncio.get_running_loop()
+        while self._journal_buffer:
+            batch, self._journal_buffer = self._journal_buffer, []
+            try:
+                await loop.run_in_executor(
+                    self._journal_executor,
+                    self._write_journal,
+                    [event for event, _ in batch]
+                )
+            except Exception as e:
+                print(f"Error appending to ingest journal: {e}")
+                for event, future in batch:
+                    self._pending -= 1
+                    self._discard(event)
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for event, future in batch:
+                self._enqueue(event, None)
+                if not future.done():
+                    future.set_result((event, False))
+
+    def _open_journal(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(os.path.abspath(self.journal_path)), exist_ok=True)
+        conn = sqlite3.connect(self.journal_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={'FULL' if self.durability == 'full' else 'NORMAL'}")
+        columns = ", ".join(f"{column} TEXT" for column in JOURNAL_COLUMNS)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS queued_events (seq INTEGER PRIMARY KEY AUTOINCREMENT, {columns})")
+        conn.execute(f"CREATE TABLE IF NOT EXISTS rejected_events ({columns}, error TEXT, rejected_at TEXT)")
+        conn.commit()
+        return conn
+
+    def _write_journal(self, events: List[TimeEvent]) -> None:
+        placeholders = ", ".join("?" for _ in JOURNAL_COLUMNS)
+        with self._journal_lock, self._journal:
+            self._journal.executemany(
+                f"INSERT INTO queued_events ({', '.join(JOURNAL_COLUMNS)}) VALUES ({placeholders})",
+                [_journal_row(event) for event in events]
+            )
+
+    def _remove_from_journal(self, written: List[TimeEvent], rejected: List[Tuple[TimeEvent, Exception]]) -> None:
+        placeholders = ", ".join("?" for _ in JOURNAL_COLUMNS)
+        rejected_at = datetime.utcnow().isoformat()
+        with self._journal_lock, self._journal:
+            self._journal.executemany(
+                f"INSERT INTO rejected_events ({', '.join(JOURNAL_COLUMNS)}, error, rejected_at) "
+                f"VALUES ({placeholders}, ?, ?)",
+                [_journal_row(event) + (str(error), rejected_at) for event, error in rejected]
+            )
+            self._journal.executemany(
+                "DELETE FROM queued_events WHERE id = ?",
+                [(str(event.id),) for event in written] + [(str(event.id),) for event, _ in rejected]
+            )
+
+    def _write_batch(self, events: List[TimeEvent]):
+        """
+        Insert a group of events in one Postgres transaction
+
+        Runs on the writer thread. Returns the record_events outcomes and
+        the new states of the affected employees for locations with stream
+        subscribers.
+        """
+        db = SessionLocal()
+        try:
+            outcomes = clock_logic_service.record_events(db, events)
+            db.commit()
+
+            states = {}
+            for location_id in {e.location_id for e in events}:
+                if clock_event_bus.has_subscribers(location_id):
+                    states[location_id] = clock_logic_service.get_location_states(
+                        db,
+                        location_id,
+                        active_only=False,
+                        employee_ids=list({e.employee_id for e in events if e.location_id == location_id})
+                    )
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        # The group is committed now; rows left in the journal are
+        # recognised as written by _recover on the next start
+        if self._journal is not None:
+            try:
+                self._remove_from_journal(
+                    [event for event, (_, error, _) in zip(events, outcomes) if not error],
+                    [(event, error) for event, (_, error, _) in zip(events, outcomes) if error]
+                )
+            except Exception as e:
+                print(f"Error removing written time events from the ingest journal: {e}")
+
+        return outcomes, states
+
+    async def _reject_failed(self, event: TimeEvent, future: Optional[asyncio.Future], error: Exception) -> None:
+        """Give up on an event that cannot be written on its own, so the events behind it can be"""
+        print(f"Queued time event {event.id} rejected after {self.max_attempts} failed writes: {error}")
+        del self._queue[0]
+        self._pending -= 1
+        self._rejected += 1
+        self._attempts.pop(event.id, None)
+        self._discard(event)
+        if self._journal is not None:
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    self._journal_executor, self._remove_from_journal, [], [(event, error)]
+                )
+            except Exception as e:
+                print(f"Error moving time event {event.id} to the rejected journal: {e}")
+        if future is not None and not future.done():
+            future.set_exception(error)
+
+    def backoff(self) -> float:
+        """Seconds to wait before the next write after consecutive failures"""
+        if not self._failures:
+            return self.flush_interval
+        delay = min(self.retry_base * 2 ** (self._failures - 1), self.retry_max)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def flush(self) -> bool:
+        """
+        Write queued events in groups of at most max_batch
+
+        After a group fails, its events are written one at a time, so an
+        event that fails on its own can be found. Such an event is rejected
+        after max_attempts failures, unless the error is one of the
+        database being unavailable. Returns False if a write failed; the
+        events stay queued.
+        """
+        loop = asyncio.get_running_loop()
+        async with self._flush_lock:
+            while self._queue:
+                batch = self._queue[:1 if self._isolate else self.max_batch]
+                events = [event for event, _ in batch]
+                started = time.perf_counter()
+                try:
+                    outcomes, states = await loop.run_in_executor(self._writer_executor, self._write_batch, events)
+                except Exception as e:
+                    print(f"Error writing {len(batch)} queued time events: {e}")
+                    self._failures += 1
+                    if len(batch) > 1:
+                        self._isolate = len(batch)
+                        continue
+                    if not isinstance(e, (OperationalError, InterfaceError)):
+                        event, future = batch[0]
+                        self._attempts[event.id] = self._attempts.get(event.id, 0) + 1
+                        if self._attempts[event.id] >= self.max_attempts:
+                            await self._reject_failed(event, future, e)
+                            self._isolate = max(self._isolate - 1, 0)
+                            continue
+                    return False
+                finally:
+                    self.flush_latency.observe(time.perf_counter() - started)
+
+                del self._queue[:len(batch)]
+                self._pending -= len(batch)
+                self._failures = 0
+                self._isolate = max(self._isolate - len(batch), 0)
+
+                created = {}
+                for (event, future), (recorded, error, is_replay) in zip(batch, outcomes):
+                    self._attempts.pop(event.id, None)
+                    if error:
+                        self._rejected += 1
+                        self._discard(event)
+                        if future is None:
+                            print(f"Queued time event {event.id} rejected on write: {error}")
+                    else:
+                        self._written += 1
+                        # Retries are now answered from the database
+                        self._forget_client_id(event)
+                        if not is_replay:
+                            created.setdefault(event.location_id, []).append(recorded)
+                    if future is not None and not future.done():
+                        if error:
+                            future.set_exception(error)
+                        else:
+                            future.set_result((recorded, is_replay))
+
+                for location_id, location_states in states.items():
+                    if created.get(location_id):
+                        clock_event_bus.publish_states(
+                            location_id,
+                            "QUEUED",
+                            location_states,
+                            [_event_dict(e) for e in created[location_id]]
+                        )
+        return True
+
+    async def _writer_loop(self):
+        while True:
+            if self._failures:
+                # Backing off: a full queue does not cut the wait short
+                await asyncio.sleep(self.backoff())
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def _recover(self) -> List[TimeEvent]:
+        """Journaled events not yet in Postgres, in acknowledgement order"""
+        with self._journal_lock:
+            rows = self._journal.execute(
+                f"SELECT {', '.join(JOURNAL_COLUMNS)} FROM queued_events ORDER BY seq"
+            ).fetchall()
+        events = [_event_from_row(row) for row in rows]
+        if not events:
+            return []
+
+        # A crash between the Postgres commit and the journal delete
+        # leaves events that were already written
+        db = SessionLocal()
+        try:
+            written = set(db.scalars(select(TimeEvent.id).where(TimeEvent.id.in_([e.id for e in events]))))
+        finally:
+            db.close()
+
+        if written:
+            with self._journal_lock, self._journal:
+                self._journal.executemany(
+                    "DELETE FROM queued_events WHERE id = ?",
+                    [(str(event_id),) for event_id in written]
+                )
+        return [event for event in events if event.id not in written]
+
+    async def start(self):
+        """Open the journal, write what a previous run left in it and start the writer"""
+        if not self.enabled or self._writer_task is not None:
+            return
+
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+
+        if self.durability != "database":
+            self._journal = await loop.run_in_executor(self._journal_executor, self._open_journal)
+            recovered = await loop.run_in_executor(self._writer_executor, self._recover)
+            if recovered:
+                self._queue = [(event, None) for event in recovered]
+                self._pending = len(recovered)
+                # New punches are checked against states that must include these
+                while not await self.flush():
+                    if self._failures > 2 * self.max_attempts:
+                        raise RuntimeError(f"Could not write {len(self._queue)} journaled time events")
+                    await asyncio.sleep(self.backoff())
+                print(f"Recovered {len(recovered)} journaled time events")
+
+        self._writer_task = loop.create_task(self._writer_loop())
+
+    async def stop(self):
+        """Stop the writer after flushing everything that was acknowledged"""
+        if self._writer_task is None:
+            return
+
+        if self._journal_task is not None:
+            await self._journal_task
+        self._writer_task.cancel()
+        try:
+            await self._writer_task
+        except asyncio.CancelledError:
+            pass
+        self._writer_task = None
+
+        await self.flush()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def get_stats(self) -> dict:
+        return {
+            "mode": settings.ingest_mode,
+            "durability": self.durability,
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "written": self._written,
+            "rejected": self._rejected,
+            "consecutive_failures": self._failures,
+            "flush_latency": self.flush_latency.snapshot()
+        }
+
+
+def _default_journal_path() -> str:
+    """The journal must survive restarts, so it lives in the state directory, not the temp directory"""
+    state_home = os.environ.get("XDG_STATE_HOME") or os.path.join(os.path.expanduser("~"), ".local", "state")
+    return os.path.join(state_home, "kiosk-backend", "ingest_journal.db")
+
+
+def _find_by_client_event_id(db, client_event_id: UUID) -> Optional[TimeEvent]:
+    return db.query(TimeEvent).filter(TimeEvent.client_event_id == client_event_id).first()
+
+
+def _journal_row(event: TimeEvent) -> tuple:
+    values = []
+    for column in JOURNAL_COLUMNS:
+        value = getattr(event, column)
+        if value is None:
+            values.append(None)
+        elif column in DATETIME_COLUMNS:
+            values.append(value.isoformat())
+        else:
+            values.append(str(value))
+    return tuple(values)
+
+
+def _event_from_row(row) -> TimeEvent:
+    values = {}
+    for column, value in zip(JOURNAL_COLUMNS, row):
+        if value is not None and column in UUID_COLUMNS:
+            value = UUID(value)
+        elif value is not None and column in DATETIME_COLUMNS:
+            value = datetime.fromisoformat(value)
+        values[column] = value
+    return TimeEvent(is_valid=True, **values)
+
+
+def _event_dict(event: TimeEvent) -> dict:
+    return {column.key: getattr(event, column.key) for column in TimeEvent.__table__.columns}
+
+
+ingest_queue = IngestQueue()
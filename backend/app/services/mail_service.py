@@ -0,0 +1,347 @@
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Tuple
+import asyncio
+import base64
+import concurrent.futures
+import random
+import time
+import httpx
+from app.config import settings
+from app.services.metrics import LatencyHistogram
+
+SENDGRID_MAX_PERSONALIZATIONS = 1000
+
+
+@dataclass
+class MailAttachment:
+    filename: str
+    content: bytes
+    mime_type: str = "application/octet-stream"
+
+
+@dataclass
+class OutboundMail:
+    to_email: str
+    subject: str
+    html_content: str
+    attachments: List[MailAttachment] = field(default_factory=list)
+
+    def content_key(self) -> Tuple:
+        """Mails with equal keys differ only by recipient"""
+        return (
+            self.subject,
+            self.html_content,
+            tuple((a.filename, a.mime_type, a.content) for a in self.attachments)
+        )
+
+
+@dataclass
+class DeliveryResult:
+    ok: bool
+    error: Optional[str] = None
+    retryable: bool = False
+    retry_after: Optional[float] = None
+
+
+class MailTransport:
+    """Delivers batches of mails; one DeliveryResult per mail, in order"""
+
+    async def send_batch(self, mails: List[OutboundMail]) -> List[DeliveryResult]:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class SendGridTransport(MailTransport):
+    """
+    SendGrid v3 mail/send over one pooled, keep-alive async client
+
+    Mails with the same content are sent as one request with a
+    personalization per recipient; the rest are sent concurrently.
+    """
+
+    def __init__(self, api_key: str, base_url: str, from_email: str, max_connections: int):
+        self.from_email = from_email
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            headers={"Authorization": f"Bearer {api_key}"},
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections
+            ),
+            timeout=httpx.Timeout(30.0)
+        )
+
+    def _payload(self, mails: List[OutboundMail]) -> dict:
+        first = mails[0]
+        payload = {
+            "personalizations": [{"to": [{"email": mail.to_email}]} for mail in mails],
+            "from": {"email": self.from_email},
+            "subject": first.subject,
+            "content": [{"type": "text/html", "value": first.html_content}]
+        }
+        if first.attachments:
+            payload["attachments"] = [
+                {
+                    "content": base64.b64encode(a.content).decode("ascii"),
+                    "type": a.mime_type,
+                    "filename": a.filename,
+                    "disposition": "attachment"
+                }
+                for a in first.attachments
+            ]
+        return payload
+
+    async def _post(self, mails: List[OutboundMail]) -> DeliveryResult:
+        try:
+            response = await self.client.post("/v3/mail/send", json=self._payload(mails))
+        except httpx.HTTPError as e:
+            return DeliveryResult(ok=False, error=f"{type(e).__name__}: {e}", retryable=True)
+
+        if response.status_code in (200, 201, 202):
+            return DeliveryResult(ok=True)
+
+        retry_after = response.headers.get("Retry-After")
+        return DeliveryResult(
+            ok=False,
+            error=f"SendGrid returned {response.status_code}: {response.text[:200]}",
+            retryable=response.status_code == 429 or response.status_code >= 500,
+            retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None
+        )
+
+    async def send_batch(self, mails: List[OutboundMail]) -> List[DeliveryResult]:
+        groups: Dict[Tuple, List[int]] = {}
+        for index, mail in enumerate(mails):
+            groups.setdefault(mail.content_key(), []).append(index)
+
+        requests = []
+        for indexes in groups.values():
+            for start in range(0, len(indexes), SENDGRID_MAX_PERSONALIZATIONS):
+                requests.append(indexes[start:start + SENDGRID_MAX_PERSONALIZATIONS])
+
+        outcomes = await asyncio.gather(*(self._post([mails[i] for i in chunk]) for chunk in requests))
+
+        results: List[Optional[DeliveryResult]] = [None] * len(mails)
+        for chunk, outcome in zip(requests, outcomes):
+            for index in chunk:
+                results[index] = outcome
+        return results
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+class StubTransport(MailTransport):
+    """
+    Local stand-in for tests and benchmarks (MAIL_TRANSPORT=stub)
+
+    Keeps the most recent mails in memory, with optional simulated latency
+    and a rate of retryable failures.
+    """
+
+    def __init__(self, latency_ms: float = 0, failure_rate: float = 0.0):
+        self.latency = latency_ms / 1000.0
+        self.failure_rate = failure_rate
+        self.sent: Deque[OutboundMail] = deque(maxlen=1000)
+        self.requests = 0
+
+    async def send_batch(self, mails: List[OutboundMail]) -> List[DeliveryResult]:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        results = []
+        for mail in mails:
+            if self.failure_rate and random.random() < self.failure_rate:
+                results.append(DeliveryResult(ok=False, error="Simulated failure", retryable=True))
+            else:
+                self.sent.append(mail)
+                results.append(DeliveryResult(ok=True))
+        return results
+
+
+@dataclass
+class _PendingMail:
+    mail: OutboundMail
+    future: asyncio.Future
+    queued_at: float
+    attempts: int = 0
+
+
+class MailQueue:
+    """
+    Outbound mail queue on the event loop
+
+    mail_concurrency workers each take up to mail_batch_size queued mails
+    and hand them to the transport together. Retryable failures are
+    queued again after an exponential backoff with jitter (or the
+    provider's Retry-After) until mail_max_attempts. Callers await the
+    final outcome; worker threads use send_blocking.
+    """
+
+    def __init__(self):
+        self.batch_size = settings.mail_batch_size
+        self.concurrency = settings.mail_concurrency
+        self.max_attempts = settings.mail_max_attempts
+        self.backoff = settings.mail_retry_base_seconds
+        self.transport: Optional[MailTransport] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._workers: List[asyncio.Task] = []
+        self._retrying: Dict[int, Tuple[_PendingMail, asyncio.TimerHandle]] = {}
+        self._counts = {"sent": 0, "failed": 0, "retried": 0}
+        self.delivery_latency = LatencyHistogram()
+
+    def _create_transport(self) -> Optional[MailTransport]:
+        if settings.mail_transport == "stub":
+            return StubTransport(settings.mail_stub_latency_ms, settings.mail_stub_failure_rate)
+        if not settings.sendgrid_api_key:
+            return None
+        return SendGridTransport(
+            settings.sendgrid_api_key,
+            settings.sendgrid_api_url,
+            settings.mail_from,
+            self.concurrency
+        )
+
+    def start(self, transport: Optional[MailTransport] = None):
+        """Start the workers on the running event loop"""
+        if self._workers:
+            return
+        self.transport = transport or self._create_transport()
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=settings.mail_queue_size)
+        self._workers = [self._loop.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        """
+        Deliver what is queued, then stop the workers and close the transport
+
+        Mails still waiting for a retry are reported as failed.
+        """
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=settings.mail_send_timeout_seconds)
+        except asyncio.TimeoutError:
+            print(f"Mail queue stopped with {self._queue.qsize()} mails undelivered")
+        for pending, handle in self._retrying.values():
+            handle.cancel()
+            self._finish(pending, DeliveryResult(ok=False, error="Mail queue stopped"))
+        self._retrying.clear()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self.transport is not None:
+            await self.transport.close()
+
+    async def send(self, mail: OutboundMail) -> DeliveryResult:
+        """
+        Queue a mail and wait for its final delivery result
+
+        Cancelling the wait also cancels the mail: it is not sent or
+        retried any more, unless a send of it is already in flight.
+
+        Raises:
+            RuntimeError if the queue is not running
+            ValueError if no transport is configured
+        """
+        if not self._workers:
+            raise RuntimeError("Mail queue is not running")
+        if self.transport is None:
+            raise ValueError("SendGrid API key not configured")
+
+        pending = _PendingMail(mail, self._loop.create_future(), time.perf_counter())
+        await self._queue.put(pending)
+        return await pending.future
+
+    def send_blocking(self, mail: OutboundMail) -> DeliveryResult:
+        """
+        Send from a worker thread, waiting for the final result
+
+        A mail without a result within mail_send_timeout_seconds is
+        cancelled and reported as failed, so a caller that sends it again
+        later does not deliver it twice.
+        """
+        if self._loop is None:
+            raise RuntimeError("Mail queue is not running")
+        future = asyncio.run_coroutine_threadsafe(self.send(mail), self._loop)
+        try:
+            return future.result(timeout=settings.mail_send_timeout_seconds)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            return DeliveryResult(
+                ok=False,
+                error=f"Not delivered within {settings.mail_send_timeout_seconds}s"
+            )
+
+    def _retry_delay(self, attempts: int, retry_after: Optional[float]) -> float:
+        delay = self.backoff * (2 ** (attempts - 1))
+        delay += random.uniform(0, delay / 2)
+        return max(delay, retry_after or 0)
+
+    def _schedule_retry(self, pending: _PendingMail, delay: float):
+        handle = self._loop.call_later(delay, self._requeue, pending)
+        self._retrying[id(pending)] = (pending, handle)
+
+    def _requeue(self, pending: _PendingMail):
+        del self._retrying[id(pending)]
+        if pending.future.cancelled():
+            return
+        try:
+            self._queue.put_nowait(pending)
+        except asyncio.QueueFull:
+            self._schedule_retry(pending, self.backoff)
+
+    def _finish(self, pending: _PendingMail, result: DeliveryResult):
+        if result.ok:
+            self._counts["sent"] += 1
+        else:
+            self._counts["failed"] += 1
+            print(f"Error sending email to {pending.mail.to_email}: {result.error}")
+        self.delivery_latency.observe(time.perf_counter() - pending.queued_at)
+        if not pending.future.done():
+            pending.future.set_result(result)
+
+    async def _worker(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            # Mails cancelled by their sender while queued are dropped
+            for pending in batch:
+                if pending.future.cancelled():
+                    self._queue.task_done()
+            batch = [pending for pending in batch if not pending.future.cancelled()]
+            if not batch:
+                continue
+
+            try:
+                results = await self.transport.send_batch([p.mail for p in batch])
+            except Exception as e:
+                results = [DeliveryResult(ok=False, error=str(e), retryable=True)] * len(batch)
+
+            for pending, result in zip(batch, results):
+                pending.attempts += 1
+                if not result.ok and result.retryable and pending.attempts < self.max_attempts:
+                    self._counts["retried"] += 1
+                    self._schedule_retry(pending, self._retry_delay(pending.attempts, result.retry_after))
+                else:
+                    self._finish(pending, result)
+                self._queue.task_done()
+
+    def get_stats(self) -> dict:
+        return {
+            "transport": type(self.transport).__name__ if self.transport else None,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "awaiting_retry": len(self._retrying),
+            **self._counts,
+            "delivery_latency": self.delivery_latency.snapshot()
+        }
+
+
+mail_queue = MailQueue()
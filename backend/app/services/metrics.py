@@ -0,0 +1,90 @@
+from sqlalchemy.exc import TimeoutError as SQLAlchemyTimeoutError
+from typing import Dict, Sequence
+import threading
+import time
+
+
+class LatencyHistogram:
+    """Thread-safe latency histogram with fixed millisecond buckets"""
+
+    DEFAULT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self, buckets_ms: Sequence[float] = DEFAULT_BUCKETS_MS):
+        self.buckets_ms = tuple(sorted(buckets_ms))
+        self._counts = [0] * (len(self.buckets_ms) + 1)
+        self._count = 0
+        self._total_ms = 0.0
+        self._max_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        """Record one duration, in seconds"""
+        ms = seconds * 1000.0
+        index = len(self.buckets_ms)
+        for i, bound in enumerate(self.buckets_ms):
+            if ms <= bound:
+                index = i
+                break
+
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._total_ms += ms
+            if ms > self._max_ms:
+                self._max_ms = ms
+
+    def snapshot(self) -> Dict:
+        """Return count, mean/max in milliseconds and per-bucket counts"""
+        with self._lock:
+            buckets = {f"le_{bound}ms": count for bound, count in zip(self.buckets_ms, self._counts)}
+            buckets["inf"] = self._counts[-1]
+            return {
+                "count": self._count,
+                "mean_ms": round(self._total_ms / self._count, 3) if self._count else 0.0,
+                "max_ms": round(self._max_ms, 3),
+                "buckets": buckets
+            }
+
+
+class PoolMetrics:
+    """Connection checkout wait time and timeout counters for one engine's pool"""
+
+    def __init__(self):
+        self.wait_time = LatencyHistogram()
+        self._timeouts = 0
+        self._lock = threading.Lock()
+
+    def pool_class(self, base: type) -> type:
+        """Subclass a SQLAlchemy pool class so every checkout is timed"""
+        metrics = self
+
+        class InstrumentedPool(base):
+            def _do_get(self):
+                started_at = time.perf_counter()
+                try:
+                    return super()._do_get()
+                except SQLAlchemyTimeoutError:
+                    metrics.record_timeout()
+                    raise
+                finally:
+                    metrics.wait_time.observe(time.perf_counter() - started_at)
+
+        InstrumentedPool.__name__ = f"Instrumented{base.__name__}"
+        return InstrumentedPool
+
+    def record_timeout(self) -> None:
+        with self._lock:
+            self._timeouts += 1
+
+    def snapshot(self, pool) -> Dict:
+        """Current pool occupancy plus the checkout wait time histogram"""
+        with self._lock:
+            timeouts = self._timeouts
+        return {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": max(pool.overflow(), 0),
+            "timeouts": timeouts,
+            "wait_time": self.wait_time.snapshot()
+        }
@@ -1,57 +1,395 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-from sqlalchemy.orm import Session
-from datetime import datetime, time
+from apscheduler.triggers.interval import IntervalTrigger
+from sqlalchemy import and_, or_, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Connection
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+from uuid import UUID
+import asyncio
 import pytz
-from app.database import SessionLocal
+import time as timer
+import uuid
+from app.config import settings
+from app.database import SessionLocal, engine
+from app.models.export_run import ExportRun
 from app.models.location import Location
 from app.services.export_service import export_service
+from app.services.hours_rollup import hours_rollup_service
+from app.services.metrics import LatencyHistogram
+
+EXPORT_JOB_PREFIX = "export:"
+EXPORT_DURATION_BUCKETS_MS = (100, 500, 1000, 5000, 10000, 30000, 60000, 120000, 300000, 600000)
+SCHEDULER_LOCK_KEY = 0x6B696F736B  # Advisory lock held by the scheduler leader
 
 
 class SchedulerService:
-    """Service for scheduling daily exports"""
+    """
+    Service for scheduling daily exports
+
+    Only one process runs jobs: the one holding a session-level Postgres
+    advisory lock on a dedicated connection. Other processes retry every
+    scheduler_lease_check_seconds and take over when the leader's
+    connection goes away. Each export also claims its (location, date)
+    row in export_runs before running, so a leadership handover can never
+    email the same day twice.
+
+    Each location with a manager email gets its own cron job at its
+    export_time in its timezone. Jobs are reconciled with the locations
+    table every export_schedule_refresh_seconds, which also catches up
+    exports from the last export_catchup_days that were missed or failed,
+    for locations that already have run history. The leader also refreshes
+    the hours rollup every rollup_refresh_seconds.
+
+    Exports run on a bounded thread pool, each with its own session.
+    A run that exceeds export_timeout_seconds is reported as timed out and
+    the location is not exported again until that run has finished.
+    """
 
     def __init__(self):
-        self.scheduler = AsyncIOScheduler()
+        self.scheduler: Optional[AsyncIOScheduler] = None
         self.is_running = False
+        self.timeout = settings.export_timeout_seconds
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.export_workers,
+            thread_name_prefix="export"
+        )
+        self._lock_connection: Optional[Connection] = None
+        self._election_task: Optional[asyncio.Task] = None
+        self._schedules: Dict[UUID, Tuple[time, str]] = {}
+        self._running: Set[UUID] = set()
+        self._counts = {"succeeded": 0, "failed": 0, "timed_out": 0, "skipped": 0, "caught_up": 0}
+        self.run_duration = LatencyHistogram(EXPORT_DURATION_BUCKETS_MS)
+
+    @property
+    def is_leader(self) -> bool:
+        return self._lock_connection is not None
 
     def start(self):
-        """Start the scheduler"""
-        if not self.is_running:
-            self._schedule_exports()
-            self.scheduler.start()
-            self.is_running = True
-
-    def stop(self):
-        """Stop the scheduler"""
+        """Start competing for scheduler leadership"""
+        if settings.scheduler_enabled and self._election_task is None:
+            self._election_task = asyncio.get_running_loop().create_task(self._election_loop())
+
+    async def stop(self):
+        """Stop running jobs and hand leadership to another process"""
+        if self._election_task is not None:
+            self._election_task.cancel()
+            try:
+                await self._election_task
+            except asyncio.CancelledError:
+                pass
+            self._election_task = None
+
+        self._stop_jobs()
+        if self._lock_connection is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._release_lock)
+
+    def _try_acquire_lock(self) -> Optional[Connection]:
+        """Take the leader lock on a connection detached from the pool"""
+        connection = engine.connect()
+        try:
+            # Detached, so closing the connection always releases the lock
+            connection.detach()
+            acquired = connection.execute(
+                text("SELECT pg_try_advisory_lock(:key)"),
+                {"key": SCHEDULER_LOCK_KEY}
+            ).scalar()
+            connection.commit()
+        except Exception:
+            connection.close()
+            raise
+
+        if not acquired:
+            connection.close()
+            return None
+        return connection
+
+    def _lock_alive(self) -> bool:
+        try:
+            self._lock_connection.exec_driver_sql("SELECT 1")
+            self._lock_connection.commit()
+            return True
+        except Exception as e:
+            print(f"Scheduler lock connection lost: {e}")
+            self._lock_connection.invalidate()
+            self._lock_connection = None
+            return False
+
+    def _release_lock(self):
+        connection, self._lock_connection = self._lock_connection, None
+        try:
+            connection.close()
+        except Exception as e:
+            print(f"Error releasing scheduler lock: {e}")
+
+    async def _election_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                if self._lock_connection is None:
+                    self._lock_connection = await loop.run_in_executor(None, self._try_acquire_lock)
+                    if self._lock_connection is not None:
+                        print("Acquired scheduler leadership")
+                        self._start_jobs()
+                elif not await loop.run_in_executor(None, self._lock_alive):
+                    print("Lost scheduler leadership")
+                    self._stop_jobs()
+            except Exception as e:
+                print(f"Error in scheduler election: {e}")
+            await asyncio.sleep(settings.scheduler_lease_check_seconds)
+
+    def _start_jobs(self):
         if self.is_running:
-            self.scheduler.shutdown()
+            return
+        self.scheduler = AsyncIOScheduler()
+        self.scheduler.add_job(
+            self.refresh,
+            trigger=IntervalTrigger(seconds=settings.export_schedule_refresh_seconds),
+            id="refresh_export_jobs",
+            replace_existing=True,
+            next_run_time=datetime.now(pytz.UTC)
+        )
+        self.scheduler.add_job(
+            self.refresh_rollups,
+            trigger=IntervalTrigger(seconds=settings.rollup_refresh_seconds),
+            id="refresh_hours_rollup",
+            replace_existing=True,
+            next_run_time=datetime.now(pytz.UTC)
+        )
+        self.scheduler.start()
+        self.is_running = True
+
+    def _stop_jobs(self):
+        if self.is_running:
+            self.scheduler.shutdown(wait=False)
+            self.scheduler = None
+            self._schedules.clear()
             self.is_running = False
 
-    def _schedule_exports(self):
-        """Schedule daily exports for all locations"""
-        # This should be called after app startup
-        # For now, we'll schedule a job that runs daily and checks all locations
-        # In production, you might want individual jobs per location
-        
-        async def daily_export_job():
-            """Job that runs daily and exports yesterday's data for all locations"""
-            db = SessionLocal()
+    def _load_schedules(self) -> Dict[UUID, Tuple[time, str]]:
+        db = SessionLocal()
+        try:
+            rows = db.query(Location.id, Location.export_time, Location.timezone).filter(
+                Location.manager_email != ""
+            ).all()
+            return {row.id: (row.export_time, row.timezone) for row in rows}
+        finally:
+            db.close()
+
+    async def refresh(self):
+        """
+        Match export jobs to the locations table, then catch up missed exports
+
+        Leadership can be lost while a query runs, which shuts this
+        scheduler down, so the refresh stops if it is no longer current.
+        """
+        scheduler = self.scheduler
+        loop = asyncio.get_running_loop()
+        schedules = await loop.run_in_executor(None, self._load_schedules)
+        if not self.is_running or self.scheduler is not scheduler:
+            return
+
+        for location_id in set(self._schedules) - set(schedules):
+            scheduler.remove_job(f"{EXPORT_JOB_PREFIX}{location_id}")
+            del self._schedules[location_id]
+
+        for location_id, (export_time, timezone) in schedules.items():
+            if self._schedules.get(location_id) == (export_time, timezone):
+                continue
             try:
-                locations = db.query(Location).filter(Location.manager_email != "").all()
-                for location in locations:
-                    export_service.export_yesterday_for_location(db, location.id)
-            finally:
-                db.close()
-        
-        # Schedule to run daily at 1 AM UTC (adjust as needed)
-        self.scheduler.add_job(
-            daily_export_job,
-            trigger=CronTrigger(hour=1, minute=0),
-            id="daily_export",
-            replace_existing=True
+                tz = pytz.timezone(timezone)
+            except pytz.UnknownTimeZoneError:
+                print(f"Not scheduling export for location {location_id}: unknown timezone {timezone}")
+                continue
+
+            scheduler.add_job(
+                self._run_export,
+                trigger=CronTrigger(
+                    hour=export_time.hour,
+                    minute=export_time.minute,
+                    second=export_time.second,
+                    timezone=tz
+                ),
+                args=[location_id],
+                id=f"{EXPORT_JOB_PREFIX}{location_id}",
+                replace_existing=True,
+                misfire_grace_time=None,
+                coalesce=True
+            )
+            self._schedules[location_id] = (export_time, timezone)
+
+        missed = await loop.run_in_executor(None, self._missed_runs, dict(self._schedules))
+        if not self.is_running or self.scheduler is not scheduler:
+            return
+        for location_id, export_date in missed:
+            if location_id not in self._running:
+                self._counts["caught_up"] += 1
+                loop.create_task(self._run_export(location_id, export_date))
+
+    async def refresh_rollups(self):
+        """Recompute hours rollup days changed since the last refresh"""
+        await asyncio.get_running_loop().run_in_executor(None, hours_rollup_service.refresh_all)
+
+    def _missed_runs(self, schedules: Dict[UUID, Tuple[time, str]]) -> List[Tuple[UUID, date]]:
+        """
+        (location, date) exports that were due within export_catchup_days
+        but never succeeded and have attempts left
+
+        Locations without any run history are skipped, so enabling the run
+        log does not resend exports from before it existed.
+        """
+        days = settings.export_catchup_days
+        if not schedules or days <= 0:
+            return []
+
+        earliest = datetime.utcnow().date() - timedelta(days=days + 1)
+        db = SessionLocal()
+        try:
+            tracked = set(db.scalars(text("SELECT DISTINCT location_id FROM export_runs")))
+            runs = {
+                (run.location_id, run.export_date): run
+                for run in db.query(ExportRun).filter(ExportRun.export_date >= earliest)
+            }
+        finally:
+            db.close()
+
+        missed = []
+        for location_id, (export_time, timezone) in schedules.items():
+            if location_id not in tracked:
+                continue
+            tz = pytz.timezone(timezone)
+            now_local = datetime.now(tz)
+            for days_back in range(1, days + 1):
+                export_date = now_local.date() - timedelta(days=days_back)
+                due = tz.localize(datetime.combine(export_date + timedelta(days=1), export_time))
+                if due > now_local:
+                    continue
+                run = runs.get((location_id, export_date))
+                if run is None or (run.status == "FAILED" and run.attempts < settings.export_max_attempts):
+                    missed.append((location_id, export_date))
+        return missed
+
+    def _claim_run(self, db, location_id: UUID, export_date: date) -> Optional[UUID]:
+        """
+        Claim the export of a location and date, committing immediately
+
+        Succeeds for a new date, a failed run with attempts left, or a run
+        that was left RUNNING for longer than twice the timeout by a
+        process that died. Returns the run id, or None if not claimed.
+        """
+        now = datetime.utcnow()
+        statement = pg_insert(ExportRun).values(
+            id=uuid.uuid4(),
+            location_id=location_id,
+            export_date=export_date,
+            status="RUNNING",
+            attempts=1,
+            started_at=now
         )
+        statement = statement.on_conflict_do_update(
+            constraint="uq_export_runs_location_date",
+            set_={
+                "status": "RUNNING",
+                "attempts": ExportRun.attempts + 1,
+                "started_at": now,
+                "finished_at": None,
+                "duration_ms": None,
+                "error": None
+            },
+            where=or_(
+                and_(ExportRun.status == "FAILED", ExportRun.attempts < settings.export_max_attempts),
+                and_(ExportRun.status == "RUNNING", ExportRun.started_at < now - timedelta(seconds=2 * self.timeout))
+            )
+        ).returning(ExportRun.id)
 
+        run_id = db.execute(statement).scalar()
+        db.commit()
+        return run_id
 
-scheduler_service = SchedulerService()
+    def _export_location(self, location_id: UUID, export_date: date) -> Optional[bool]:
+        """
+        Claim and run one location's export in its own session (worker thread)
+
+        Returns None if the run was already claimed elsewhere
+        """
+        db = SessionLocal()
+        try:
+            run_id = self._claim_run(db, location_id, export_date)
+            if run_id is None:
+                return None
 
+            started = timer.perf_counter()
+            error = None
+            try:
+                succeeded = export_service.export_and_send(db, location_id, export_date)
+                if not succeeded:
+                    error = "Export failed"
+            except Exception as e:
+                succeeded = False
+                error = str(e)
+            db.rollback()
+
+            db.query(ExportRun).filter(ExportRun.id == run_id).update({
+                "status": "SUCCEEDED" if succeeded else "FAILED",
+                "finished_at": datetime.utcnow(),
+                "duration_ms": int((timer.perf_counter() - started) * 1000),
+                "error": error
+            })
+            db.commit()
+            return succeeded
+        finally:
+            db.close()
+
+    async def _run_export(self, location_id: UUID, export_date: Optional[date] = None):
+        if location_id in self._running:
+            self._counts["skipped"] += 1
+            print(f"Export for location {location_id} skipped: previous run still in progress")
+            return
+
+        if export_date is None:
+            schedule = self._schedules.get(location_id)
+            if schedule is None:
+                return
+            export_date = (datetime.now(pytz.timezone(schedule[1])) - timedelta(days=1)).date()
+
+        self._running.add(location_id)
+        started = timer.perf_counter()
+        future = asyncio.get_running_loop().run_in_executor(
+            self.executor, self._export_location, location_id, export_date
+        )
+
+        def finished(_):
+            self._running.discard(location_id)
+            self.run_duration.observe(timer.perf_counter() - started)
+
+        future.add_done_callback(finished)
+
+        try:
+            succeeded = await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self._counts["timed_out"] += 1
+            print(f"Export for location {location_id} timed out after {self.timeout}s")
+            return
+        except Exception as e:
+            succeeded = False
+            print(f"Error exporting location {location_id}: {e}")
+
+        if succeeded is None:
+            self._counts["skipped"] += 1
+        else:
+            self._counts["succeeded" if succeeded else "failed"] += 1
+
+    def get_stats(self) -> dict:
+        return {
+            "leader": self.is_leader,
+            "running": self.is_running,
+            "scheduled_locations": len(self._schedules),
+            "exports_in_progress": len(self._running),
+            **self._counts,
+            "run_duration": self.run_duration.snapshot()
+        }
+
+
+scheduler_service = SchedulerService()
@@ -0,0 +1,301 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterator, List, Tuple
+from uuid import UUID
+import csv
+import io
+import numpy as np
+import pytz
+from app.config import settings
+from app.models.location import Location
+
+SHIFT_CSV_HEADER = ["Employee ID", "Employee Name", "Date", "Start", "End", "Hours", "Split"]
+
+UNPAIRED_IN = "No matching OUT"
+UNPAIRED_OUT = "No matching IN"
+
+# Valid events of the period, plus each employee's IN just before it and
+# OUT just after it, so shifts crossing the period edges are paired
+_EVENTS_SQL = text("""
+    SELECT te.employee_id, te.event_type = 'IN', extract(epoch FROM te.event_time)::float8, true
+    FROM time_events te
+    WHERE te.location_id = :location_id
+      AND te.local_date BETWEEN :start_date AND :end_date
+      AND te.is_valid
+    UNION ALL
+    SELECT e.id, true, extract(epoch FROM b.event_time)::float8, false
+    FROM employees e
+    CROSS JOIN LATERAL (
+        SELECT event_type, event_time FROM time_events
+        WHERE employee_id = e.id AND is_valid AND event_time < :start AND event_time >= :lookback
+        ORDER BY event_time DESC LIMIT 1
+    ) b
+    WHERE e.location_id = :location_id AND b.event_type = 'IN'
+    UNION ALL
+    SELECT e.id, false, extract(epoch FROM b.event_time)::float8, false
+    FROM employees e
+    CROSS JOIN LATERAL (
+        SELECT event_type, event_time FROM time_events
+        WHERE employee_id = e.id AND is_valid AND event_time >= :end AND event_time < :lookahead
+        ORDER BY event_time LIMIT 1
+    ) b
+    WHERE e.location_id = :location_id AND b.event_type = 'OUT'
+""")
+
+
+def pair_shifts(
+    employee: np.ndarray,
+    is_in: np.ndarray,
+    event_time: np.ndarray,
+    in_period: np.ndarray,
+    max_shift_seconds: float
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Pair each IN with the next event of the same employee if it is an OUT
+
+    Inputs are parallel arrays sorted by employee, then event time. Pairs
+    longer than max_shift_seconds are not shifts. Returns the indexes of
+    shift INs, shift OUTs and unpaired punches within the period.
+    """
+    if len(employee) == 0:
+        empty = np.empty(0, dtype=np.intp)
+        return empty, empty, empty
+
+    starts = np.flatnonzero(
+        is_in[:-1]
+        & ~is_in[1:]
+        & (employee[:-1] == employee[1:])
+        & (event_time[1:] - event_time[:-1] <= max_shift_seconds)
+    )
+    ends = starts + 1
+
+    paired = np.zeros(len(employee), dtype=bool)
+    paired[starts] = True
+    paired[ends] = True
+    unpaired = np.flatnonzero(~paired & in_period)
+    return starts, ends, unpaired
+
+
+def split_at_midnights(
+    shift_start: np.ndarray,
+    shift_end: np.ndarray,
+    bounds: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Split shifts at day boundaries
+
+    bounds holds the epoch seconds of each local midnight of the period,
+    including the one ending it. Shifts are clipped to the period.
+    Returns (shift index, day index, start, end) per segment.
+    """
+    start = np.maximum(shift_start, bounds[0])
+    end = np.minimum(shift_end, bounds[-1])
+    first_day = np.searchsorted(bounds, start, side="right") - 1
+    last_day = np.searchsorted(bounds, end, side="left") - 1
+    counts = np.maximum(last_day - first_day + 1, 0)
+
+    shift = np.repeat(np.arange(len(start)), counts)
+    offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    day = first_day[shift] + offset
+    return shift, day, np.maximum(start[shift], bounds[day]), np.minimum(end[shift], bounds[day + 1])
+
+
+@dataclass
+class Timesheet:
+    """Worked time of a location's employees over a range of local dates"""
+
+    timezone: str
+    start_date: date
+    end_date: date
+    bounds: np.ndarray  # Epoch seconds of each local midnight, including the one ending the period
+    employees: List[Tuple[UUID, str, str]]  # (id, employee_id, name), in row order
+    worked_seconds: np.ndarray  # employees x days
+    shift_counts: np.ndarray  # employees x days, shift segments per day
+    unpaired_counts: np.ndarray  # per employee
+    segment_employee: np.ndarray
+    segment_day: np.ndarray
+    segment_start: np.ndarray
+    segment_end: np.ndarray
+    segment_split: np.ndarray  # True when the shift spans more than one segment
+    unpaired_employee: np.ndarray
+    unpaired_is_in: np.ndarray
+    unpaired_time: np.ndarray
+
+    @property
+    def days(self) -> List[date]:
+        return [self.start_date + timedelta(days=i) for i in range((self.end_date - self.start_date).days + 1)]
+
+    def totals(self) -> List[dict]:
+        """Worked time per employee, with the seconds worked on each day that has any"""
+        days = [d.isoformat() for d in self.days]
+        totals = self.worked_seconds.sum(axis=1)
+        shifts = self.shift_counts.sum(axis=1)
+        result = []
+        for row, (_, employee_id, name) in enumerate(self.employees):
+            worked = self.worked_seconds[row]
+            result.append({
+                "employee_id": employee_id,
+                "name": name,
+                "worked_seconds": int(totals[row]),
+                "worked_hours": round(float(totals[row]) / 3600, 2),
+                "shift_count": int(shifts[row]),
+                "unpaired_count": int(self.unpaired_counts[row]),
+                "days": {days[i]: int(worked[i]) for i in np.flatnonzero(worked)}
+            })
+        return result
+
+    def open_shifts(self) -> np.ndarray:
+        """employees x days, True where an IN of that day has no matching OUT"""
+        open_shifts = np.zeros(self.worked_seconds.shape, dtype=bool)
+        ins = self.unpaired_is_in
+        day = np.searchsorted(self.bounds, self.unpaired_time[ins], side="right") - 1
+        open_shifts[self.unpaired_employee[ins], day] = True
+        return open_shifts
+
+    def unpaired_punches(self) -> List[dict]:
+        tz = pytz.timezone(self.timezone)
+        return [
+            {
+                "employee_id": self.employees[row][1],
+                "name": self.employees[row][2],
+                "event_type": "IN" if is_in else "OUT",
+                "event_time": datetime.fromtimestamp(ts, tz).isoformat(),
+                "reason": UNPAIRED_IN if is_in else UNPAIRED_OUT
+            }
+            for row, is_in, ts in zip(
+                self.unpaired_employee.tolist(),
+                self.unpaired_is_in.tolist(),
+                self.unpaired_time.tolist()
+            )
+        ]
+
+    def iter_shifts_csv(self) -> Iterator[str]:
+        """One CSV row per shift and local day, with local times"""
+        tz = pytz.timezone(self.timezone)
+        days = [d.isoformat() for d in self.days]
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(SHIFT_CSV_HEADER)
+
+        for row, day, start, end, split in zip(
+            self.segment_employee.tolist(),
+            self.segment_day.tolist(),
+            self.segment_start.tolist(),
+            self.segment_end.tolist(),
+            self.segment_split.tolist()
+        ):
+            _, employee_id, name = self.employees[row]
+            writer.writerow((
+                employee_id,
+                name,
+                days[day],
+                datetime.fromtimestamp(start, tz).strftime("%H:%M:%S"),
+                datetime.fromtimestamp(end, tz).strftime("%H:%M:%S"),
+                f"{(end - start) / 3600:.2f}",
+                "true" if split else "false"
+            ))
+            if output.tell() > 65536:
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+
+        yield output.getvalue()
+
+
+class TimesheetService:
+    """
+    Worked hours from IN/OUT punches
+
+    Valid events are read as columnar arrays and paired with NumPy: an IN
+    followed by an OUT of the same employee within
+    timesheet_max_shift_hours is a shift, every other punch is unpaired.
+    Shifts are split at local midnight in the location timezone, so each
+    day gets the time actually worked on it.
+    """
+
+    @staticmethod
+    def _day_bounds(tz, start_date: date, end_date: date) -> np.ndarray:
+        """Epoch seconds of each local midnight from start_date to the day after end_date"""
+        days = (end_date - start_date).days + 2
+        return np.array([
+            tz.localize(datetime.combine(start_date + timedelta(days=i), time.min)).timestamp()
+            for i in range(days)
+        ])
+
+    def build(self, db: Session, location_id: UUID, start_date: date, end_date: date) -> Timesheet:
+        """
+        Timesheet of a location for an inclusive range of local dates
+
+        Raises:
+            ValueError if the location does not exist
+        """
+        location = db.query(Location).filter(Location.id == location_id).first()
+        if not location:
+            raise ValueError(f"Location {location_id} not found")
+
+        tz = pytz.timezone(location.timezone)
+        bounds = self._day_bounds(tz, start_date, end_date)
+        max_shift = settings.timesheet_max_shift_hours * 3600.0
+
+        employees = [
+            tuple(row) for row in db.execute(text(
+                "SELECT id, employee_id, name FROM employees WHERE location_id = :location_id ORDER BY name, id"
+            ), {"location_id": location_id})
+        ]
+        index: Dict[UUID, int] = {employee[0]: i for i, employee in enumerate(employees)}
+
+        start = datetime.fromtimestamp(bounds[0], pytz.UTC)
+        end = datetime.fromtimestamp(bounds[-1], pytz.UTC)
+        rows = db.execute(_EVENTS_SQL, {
+            "location_id": location_id,
+            "start_date": start_date,
+            "end_date": end_date,
+            "start": start,
+            "end": end,
+            "lookback": start - timedelta(seconds=max_shift),
+            "lookahead": end + timedelta(seconds=max_shift)
+        }).fetchall()
+
+        # Events of employees since moved to another location are skipped
+        rows = [row for row in rows if row[0] in index]
+        count = len(rows)
+        employee = np.fromiter((index[row[0]] for row in rows), dtype=np.int64, count=count)
+        is_in = np.fromiter((row[1] for row in rows), dtype=bool, count=count)
+        event_time = np.fromiter((row[2] for row in rows), dtype=np.float64, count=count)
+        in_period = np.fromiter((row[3] for row in rows), dtype=bool, count=count)
+
+        order = np.lexsort((event_time, employee))
+        employee, is_in, event_time, in_period = employee[order], is_in[order], event_time[order], in_period[order]
+
+        starts, ends, unpaired = pair_shifts(employee, is_in, event_time, in_period, max_shift)
+        shift, day, segment_start, segment_end = split_at_midnights(event_time[starts], event_time[ends], bounds)
+        segment_employee = employee[starts][shift]
+
+        n_employees, n_days = len(employees), len(bounds) - 1
+        cell = segment_employee * n_days + day
+        worked = np.bincount(cell, weights=segment_end - segment_start, minlength=n_employees * n_days)
+        shift_counts = np.bincount(cell, minlength=n_employees * n_days)
+
+        return Timesheet(
+            timezone=location.timezone,
+            start_date=start_date,
+            end_date=end_date,
+            bounds=bounds,
+            employees=employees,
+            worked_seconds=np.rint(worked).astype(np.int64).reshape(n_employees, n_days),
+            shift_counts=shift_counts.reshape(n_employees, n_days),
+            unpaired_counts=np.bincount(employee[unpaired], minlength=n_employees),
+            segment_employee=segment_employee,
+            segment_day=day,
+            segment_start=segment_start,
+            segment_end=segment_end,
+            segment_split=np.bincount(shift, minlength=len(starts))[shift] > 1,
+            unpaired_employee=employee[unpaired],
+            unpaired_is_in=is_in[unpaired],
+            unpaired_time=event_time[unpaired]
+        )
+
+
+timesheet_service = TimesheetService()
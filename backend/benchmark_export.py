@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Size and timing check for the export formats
+Encodes a synthetic month of punches for 500 employees with every
+available writer, then optionally exports a real location's date range
+from the database in each format (query included).
+
+Run: python benchmark_export.py [--location NAME --start YYYY-MM-DD --end YYYY-MM-DD]
+"""
+
+import argparse
+import random
+import time
+from datetime import date, timedelta
+from sqlalchemy import func
+from app.database import SessionLocal
+from app.models import Location, TimeEvent
+from app.services.export_formats import EXPORT_FORMATS, ChunkSink
+from app.services.export_service import EXPORT_BATCH_SIZE, export_service
+
+EMPLOYEES = 500
+DAYS = 31
+REPEATS = 5
+
+
+def synthetic_rows():
+    """Two punches per employee and day, in time order, as the export query returns them"""
+    rng = random.Random(42)
+    start = date(2024, 3, 1)
+    rows = []
+    for day in range(DAYS):
+        local_date = (start + timedelta(days=day)).isoformat()
+        punches = []
+        for employee in range(EMPLOYEES):
+            shift_in = 8 * 3600 + rng.randrange(-1800, 1800)
+            shift_out = shift_in + rng.randrange(6 * 3600, 10 * 3600)
+            for event_type, seconds in (("IN", shift_in), ("OUT", min(shift_out, 86399))):
+                punches.append((seconds, employee, event_type))
+        punches.sort()
+        for seconds, employee, event_type in punches:
+            rows.append((
+                local_date,
+                f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}",
+                f"E{employee:04d}",
+                f"Employee {employee}",
+                event_type,
+                "Main Street",
+                f"kiosk-{employee % 4}",
+                rng.choice(("PIN", "PIN", "BADGE")),
+                rng.random() > 0.01
+            ))
+    return rows
+
+
+def report(name, sizes, timings, rows, csv_size):
+    best = min(timings)
+    print(
+        f"  {name:8} {sizes:>12,} bytes  {sizes / csv_size:6.1%} of csv"
+        f"  best {best * 1000:8.1f} ms  {rows / best:>12,.0f} rows/s"
+    )
+
+
+def bench_writers():
+    rows = synthetic_rows()
+    batches = [rows[i:i + EXPORT_BATCH_SIZE] for i in range(0, len(rows), EXPORT_BATCH_SIZE)]
+    print(f"Synthetic: {EMPLOYEES} employees x {DAYS} days, {len(rows)} rows (writers only)")
+
+    csv_size = None
+    for export_format in EXPORT_FORMATS.values():
+        if not export_format.available:
+            print(f"  {export_format.name:8} skipped, {export_format.requires} is not installed")
+            continue
+        timings = []
+        for _ in range(REPEATS):
+            size = 0
+            sink = ChunkSink()
+            started = time.perf_counter()
+            writer = export_format.writer(sink)
+            for batch in batches:
+                writer.write_rows(batch)
+                size += len(sink.drain())
+            writer.close()
+            size += len(sink.drain())
+            timings.append(time.perf_counter() - started)
+        csv_size = csv_size or size
+        report(export_format.name, size, timings, len(rows), csv_size)
+
+
+def bench_location(name, start_date, end_date):
+    db = SessionLocal()
+    try:
+        location = db.query(Location).filter(Location.name == name).first()
+        if not location:
+            raise SystemExit(f"Location {name!r} not found")
+
+        rows = db.query(func.count(TimeEvent.id)).filter(
+            TimeEvent.location_id == location.id,
+            TimeEvent.local_date.between(start_date, end_date)
+        ).scalar()
+        print(f"Location {name}: {start_date} to {end_date}, {rows} rows (query + writer)")
+        csv_size = None
+        for export_format in EXPORT_FORMATS.values():
+            if not export_format.available:
+                print(f"  {export_format.name:8} skipped, {export_format.requires} is not installed")
+                continue
+            timings = []
+            for _ in range(REPEATS):
+                started = time.perf_counter()
+                size = sum(len(chunk) for chunk in export_service.iter_export(
+                    db, location.id, start_date, end_date, export_format.name
+                ))
+                timings.append(time.perf_counter() - started)
+                db.rollback()
+            csv_size = csv_size or size
+            report(export_format.name, size, timings, max(rows, 1), csv_size)
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the export formats")
+    parser.add_argument("--location", help="Location name to export from the database")
+    parser.add_argument("--start", type=date.fromisoformat)
+    parser.add_argument("--end", type=date.fromisoformat)
+    args = parser.parse_args()
+
+    bench_writers()
+    if args.location:
+        if not args.start or not args.end:
+            parser.error("--start and --end are required with --location")
+        bench_location(args.location, args.start, args.end)
+
+
+if __name__ == "__main__":
+    main()
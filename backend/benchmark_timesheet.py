@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Timing check for the timesheet engine
+Pairs and splits a synthetic month of punches for 500 employees (day and
+overnight shifts, some missing punches) in memory, then optionally builds
+the timesheet of a real location from the database.
+
+Run: python benchmark_timesheet.py [--location NAME --start YYYY-MM-DD --end YYYY-MM-DD]
+"""
+
+import argparse
+import time
+from datetime import date, datetime, timedelta
+import numpy as np
+import pytz
+from app.database import SessionLocal
+from app.models import Location
+from app.services.timesheet_service import pair_shifts, split_at_midnights, timesheet_service
+
+EMPLOYEES = 500
+DAYS = 31
+REPEATS = 20
+TIMEZONE = "America/Toronto"
+
+
+def synthetic_month(rng):
+    """Sorted (employee, is_in, event_time, in_period) arrays and the day bounds"""
+    tz = pytz.timezone(TIMEZONE)
+    start = date(2024, 3, 1)  # Includes a DST change
+    bounds = np.array([
+        tz.localize(datetime.combine(start + timedelta(days=i), datetime.min.time())).timestamp()
+        for i in range(DAYS + 1)
+    ])
+
+    employee = np.repeat(np.arange(EMPLOYEES), DAYS)
+    day = np.tile(np.arange(DAYS), EMPLOYEES)
+    overnight = rng.random(len(employee)) < 0.2
+    shift_in = bounds[day] + np.where(overnight, 20, 8) * 3600 + rng.integers(-1800, 1800, len(employee))
+    shift_out = shift_in + rng.integers(6 * 3600, 10 * 3600, len(employee))
+
+    employee = np.repeat(employee, 2)
+    is_in = np.tile([True, False], len(shift_in))
+    event_time = np.column_stack([shift_in, shift_out]).ravel().astype(np.float64)
+
+    keep = rng.random(len(event_time)) > 0.01  # Forgotten punches
+    employee, is_in, event_time = employee[keep], is_in[keep], event_time[keep]
+    in_period = event_time < bounds[-1]
+    return employee, is_in, event_time, in_period, bounds
+
+
+def bench_engine():
+    rng = np.random.default_rng(42)
+    employee, is_in, event_time, in_period, bounds = synthetic_month(rng)
+
+    timings = []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        starts, ends, unpaired = pair_shifts(employee, is_in, event_time, in_period, 24 * 3600)
+        shift, day, segment_start, segment_end = split_at_midnights(event_time[starts], event_time[ends], bounds)
+        cell = employee[starts][shift] * DAYS + day
+        worked = np.bincount(cell, weights=segment_end - segment_start, minlength=EMPLOYEES * DAYS)
+        timings.append(time.perf_counter() - started)
+
+    print(f"Synthetic: {EMPLOYEES} employees x {DAYS} days, {len(employee)} punches")
+    print(f"  {len(starts)} shifts, {len(segment_start)} day segments, {len(unpaired)} unpaired")
+    print(f"  {worked.sum() / 3600:.0f} hours worked")
+    print(f"  engine: best {min(timings) * 1000:.1f} ms, median {np.median(timings) * 1000:.1f} ms")
+
+
+def bench_location(name, start_date, end_date):
+    db = SessionLocal()
+    try:
+        location = db.query(Location).filter(Location.name == name).first()
+        if not location:
+            raise SystemExit(f"Location {name!r} not found")
+
+        started = time.perf_counter()
+        timesheet = timesheet_service.build(db, location.id, start_date, end_date)
+        built = time.perf_counter() - started
+
+        started = time.perf_counter()
+        csv_bytes = sum(len(chunk) for chunk in timesheet.iter_shifts_csv())
+        written = time.perf_counter() - started
+
+        print(f"Location {name}: {len(timesheet.employees)} employees, {start_date} to {end_date}")
+        print(f"  {len(timesheet.segment_start)} day segments, {len(timesheet.unpaired_time)} unpaired")
+        print(f"  build (query + engine): {built * 1000:.1f} ms")
+        print(f"  shift CSV: {csv_bytes} bytes in {written * 1000:.1f} ms")
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the timesheet engine")
+    parser.add_argument("--location", help="Location name to build a real timesheet for")
+    parser.add_argument("--start", type=date.fromisoformat)
+    parser.add_argument("--end", type=date.fromisoformat)
+    args = parser.parse_args()
+
+    bench_engine()
+    if args.location:
+        if not args.start or not args.end:
+            parser.error("--start and --end are required with --location")
+        bench_location(args.location, args.start, args.end)
+
+
+if __name__ == "__main__":
+    main()
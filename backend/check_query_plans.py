@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+EXPLAIN check for the hot-path queries
+Seeds a throwaway dataset, runs EXPLAIN on the queries behind clock state,
+event listing, exports, stats and face embedding lookups, and exits
+non-zero if any of them falls back to a sequential scan on a large table
+or does not use the index it was written for.
+Everything runs in one transaction that is rolled back.
+
+Run: python check_query_plans.py   (uses DATABASE_URL from .env)
+"""
+
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, func, desc, text, tuple_
+from app.database import engine
+from app.models import Location, Device, Employee, FaceEmbedding, TimeEvent
+
+WATCHED_TABLES = {"time_events", "face_embeddings"}
+
+EMPLOYEES = 1000
+EVENTS_PER_EMPLOYEE = 40
+EMBEDDING_BYTES = 12 + 512 * 4 + 16  # nonce + float32[512] + GCM tag
+
+
+def seed(conn):
+    """Insert a location with employees, embeddings and punch history"""
+    location_id = uuid.uuid4()
+    device_id = uuid.uuid4()
+    now = datetime.utcnow()
+
+    conn.execute(insert(Location), [{
+        "id": location_id,
+        "name": f"plan-check-{location_id}",
+        "manager_email": "",
+        "export_time": now.time(),
+        "timezone": "America/Toronto",
+        "created_at": now,
+        "updated_at": now
+    }])
+    conn.execute(insert(Device), [{
+        "id": device_id,
+        "device_id": f"plan-check-{device_id}",
+        "location_id": location_id,
+        "api_key": "x",
+        "registered_at": now,
+        "last_seen_at": now
+    }])
+
+    employee_ids = [uuid.uuid4() for _ in range(EMPLOYEES)]
+    conn.execute(insert(Employee), [{
+        "id": employee_id,
+        "location_id": location_id,
+        "employee_id": f"EMP{i:05d}",
+        "name": f"Employee {i}",
+        "pin_hash": "x",
+        "is_active": True,
+        "created_at": now,
+        "updated_at": now
+    } for i, employee_id in enumerate(employee_ids)])
+    conn.execute(insert(FaceEmbedding), [{
+        "id": uuid.uuid4(),
+        "employee_id": employee_id,
+        "embedding_encrypted": os.urandom(EMBEDDING_BYTES),
+        "encryption_key_id": "v1",
+        "created_at": now,
+        "updated_at": now
+    } for employee_id in employee_ids])
+    conn.execute(insert(TimeEvent), [{
+        "id": uuid.uuid4(),
+        "employee_id": employee_id,
+        "device_id": device_id,
+        "location_id": location_id,
+        "event_type": "IN" if n % 2 == 0 else "OUT",
+        "event_time": now - timedelta(hours=12 * (EVENTS_PER_EMPLOYEE - n)),
+        "local_date": (now - timedelta(hours=12 * (EVENTS_PER_EMPLOYEE - n))).date(),
+        "method": "FACE",
+        "is_valid": True,
+        "created_at": now
+    } for employee_id in employee_ids for n in range(EVENTS_PER_EMPLOYEE)])
+
+    conn.execute(text("ANALYZE locations, devices, employees, face_embeddings, time_events"))
+    return location_id, employee_ids[0]
+
+
+def hot_queries(location_id, employee_id):
+    """
+    The queries that must stay on indexes, as (name, statement, index)
+
+    index names the index the query must use, or is None when any index will do.
+    """
+    now = datetime.utcnow()
+    today = now.date()
+
+    return [
+        ("latest valid event for employee", select(TimeEvent).where(
+            TimeEvent.employee_id == employee_id,
+            TimeEvent.is_valid == True
+        ).order_by(desc(TimeEvent.event_time)).limit(1), None),
+        ("location events page", select(TimeEvent).where(
+            TimeEvent.location_id == location_id,
+            tuple_(TimeEvent.event_time, TimeEvent.id) < tuple_(now - timedelta(days=7), uuid.uuid4())
+        ).order_by(desc(TimeEvent.event_time), desc(TimeEvent.id)).limit(1001), "ix_time_events_location_time"),
+        ("location events in a time range", select(TimeEvent).where(
+            TimeEvent.location_id == location_id,
+            TimeEvent.event_time >= now - timedelta(days=2),
+            TimeEvent.event_time <= now - timedelta(days=1)
+        ).order_by(desc(TimeEvent.event_time), desc(TimeEvent.id)), "ix_time_events_location_time"),
+        ("location events for a day", select(TimeEvent).where(
+            TimeEvent.location_id == location_id,
+            TimeEvent.local_date == today
+        ).order_by(TimeEvent.local_date, TimeEvent.event_time), None),
+        ("location events count for a day", select(func.count()).select_from(TimeEvent).where(
+            TimeEvent.location_id == location_id,
+            TimeEvent.local_date == today
+        ), None),
+        ("face embedding for employee", select(FaceEmbedding).where(
+            FaceEmbedding.employee_id == employee_id
+        ), None),
+    ]
+
+
+def seq_scans(plan):
+    """Yield relation names of sequential scans on watched tables in a plan tree"""
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in WATCHED_TABLES:
+        yield plan["Relation Name"]
+    for child in plan.get("Plans", []):
+        yield from seq_scans(child)
+
+
+def index_names(plan):
+    """Yield the names of the indexes scanned in a plan tree"""
+    if "Index Name" in plan:
+        yield plan["Index Name"]
+    for child in plan.get("Plans", []):
+        yield from index_names(child)
+
+
+def explain(conn, statement):
+    compiled = statement.compile(dialect=conn.dialect)
+    params = {
+        key: str(value) if isinstance(value, uuid.UUID) else value
+        for key, value in compiled.params.items()
+    }
+    result = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", params)
+    return result.scalar()[0]["Plan"]
+
+
+def check_query_plans() -> bool:
+    failures = []
+    with engine.connect() as conn:
+        transaction = conn.begin()
+        try:
+            location_id, employee_id = seed(conn)
+            for name, statement, index in hot_queries(location_id, employee_id):
+                plan = explain(conn, statement)
+                scanned = sorted(set(seq_scans(plan)))
+                if scanned:
+                    failures.append(name)
+                    print(f"FAIL  {name}: Seq Scan on {', '.join(scanned)}")
+                elif index and index not in set(index_names(plan)):
+                    failures.append(name)
+                    print(f"FAIL  {name}: does not use {index}")
+                else:
+                    print(f"ok    {name}")
+        finally:
+            transaction.rollback()
+
+    return not failures
+
+
+if __name__ == "__main__":
+    sys.exit(0 if check_query_plans() else 1)
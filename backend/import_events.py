@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Bulk import historical time events from a CSV file
+Columns: employee_id, event_type, event_time and optionally device_id and
+method. Times without a UTC offset are local to the location. Rows that
+are already recorded are skipped, so an import can be re-run.
+
+Run: python import_events.py LOCATION events.csv [--device DEVICE_ID]
+         [--rejected rejected.csv] [--dry-run]
+     (LOCATION is a location name or id; uses DATABASE_URL from .env)
+"""
+
+import argparse
+import csv
+import sys
+import time
+from uuid import UUID
+from app.database import SessionLocal
+from app.models.device import Device
+from app.models.location import Location
+from app.services.import_service import import_service
+
+
+def find_location(db, location: str):
+    try:
+        return db.query(Location).filter(Location.id == UUID(location)).first()
+    except ValueError:
+        return db.query(Location).filter(Location.name == location).first()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Bulk import historical time events")
+    parser.add_argument("location", help="location name or id")
+    parser.add_argument("csv_path", help="CSV file to import")
+    parser.add_argument("--device", help="device_id for rows without one")
+    parser.add_argument("--rejected", help="write rejected rows to this CSV file")
+    parser.add_argument("--dry-run", action="store_true", help="validate without saving")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        location = find_location(db, args.location)
+        if not location:
+            print(f"Location {args.location} not found")
+            return 1
+
+        default_device_id = None
+        if args.device:
+            device = db.query(Device).filter(
+                Device.device_id == args.device,
+                Device.location_id == location.id
+            ).first()
+            if not device:
+                print(f"Device {args.device} not found at {location.name}")
+                return 1
+            default_device_id = device.id
+
+        started = time.perf_counter()
+        with open(args.csv_path, newline="", encoding="utf-8-sig") as csv_file:
+            try:
+                report = import_service.import_csv(db, location.id, csv_file, default_device_id)
+            except ValueError as e:
+                print(e)
+                return 1
+
+        if args.dry_run:
+            db.rollback()
+        else:
+            db.commit()
+        elapsed = time.perf_counter() - started
+    finally:
+        db.close()
+
+    print(f"{report.total} rows in {elapsed:.1f}s: {report.imported} imported, "
+          f"{report.duplicate} duplicate, {report.rejected} rejected"
+          f"{' (dry run, nothing saved)' if args.dry_run else ''}")
+
+    if args.rejected and report.rejected_rows:
+        with open(args.rejected, "w", newline="") as out:
+            writer = csv.DictWriter(out, fieldnames=list(report.rejected_rows[0]))
+            writer.writeheader()
+            writer.writerows(report.rejected_rows)
+        print(f"Rejected rows written to {args.rejected}")
+    else:
+        for row in report.rejected_rows[:20]:
+            print(f"  line {row['line']}: {row['error']}")
+        if report.rejected > 20:
+            print(f"  ... {report.rejected - 20} more (use --rejected to save them all)")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())